@@ -4,6 +4,8 @@ from typing import List
 from localization import L, Localization
 from resources.fonts import QXFontDB
 from resources.gfx import QXImageDB
+from xlib import appargs as lib_appargs
+from xlib import onnxruntime as lib_ort
 from xlib import os as lib_os
 from xlib import qt as qtx
 from xlib.qt.widgets.QXLabel import QXLabel
@@ -42,31 +44,61 @@ class QLiveSwap(qtx.QXWidget):
 
         # Construct backend config
         backend_db          = self.backend_db          = backend.BackendDB( settings_dirpath / 'states.dat' )
-        backend_weak_heap   = self.backend_weak_heap   = backend.BackendWeakHeap(size_mb=2048)
+        backend_weak_heap   = self.backend_weak_heap   = backend.BackendWeakHeap(size_mb=int(lib_appargs.get_arg_str('WEAK_HEAP_SIZE_MB', '2048')), slab=lib_appargs.get_arg_bool('WEAK_HEAP_SLAB'))
         reemit_frame_signal = self.reemit_frame_signal = backend.BackendSignal()
 
+        face_swap_dfm_replicas = max(1, int(lib_appargs.get_arg_str('FACE_SWAP_REPLICAS', '1')))
+
+        # FaceDetector, FaceMarker and FaceAligner in one process
+        fused_front_end = lib_appargs.get_arg_bool('FUSED_FRONT_END')
+
         multi_sources_bc_out  = backend.BackendConnection(multi_producer=True)
-        face_detector_bc_out  = backend.BackendConnection()
-        face_marker_bc_out    = backend.BackendConnection()
-        face_aligner_bc_out   = backend.BackendConnection()
-        face_swapper_bc_out   = backend.BackendConnection()
+        face_detector_bc_out  = backend.BackendLocalConnection() if fused_front_end else backend.BackendConnection()
+        face_marker_bc_out    = backend.BackendLocalConnection() if fused_front_end else backend.BackendConnection()
+        face_aligner_bc_out   = backend.BackendConnection(multi_consumer=face_swap_dfm_replicas > 1, sequence=face_swap_dfm_replicas > 1)
+        face_swapper_bc_out   = backend.BackendConnection(multi_producer=face_swap_dfm_replicas > 1)
         frame_adjuster_bc_out = backend.BackendConnection()
         face_merger_bc_out    = backend.BackendConnection()
 
+        # frames from replicas come in order of completion
+        face_merger_bc_in = backend.BackendReorderConnection(frame_adjuster_bc_out) if face_swap_dfm_replicas > 1 else frame_adjuster_bc_out
+
+        # YoloV5Face and InsightFace2D106 used by several backends are held by one process
+        shared_inference = lib_appargs.get_arg_bool('SHARED_INFERENCE')
+
+        inference_server = self.inference_server = lib_ort.InferenceServer(backend_weak_heap) if shared_inference else None
+        get_inference_server_client = lambda: inference_server.create_client() if inference_server is not None else None
+
         file_source    = self.file_source    = backend.FileSource   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_out=multi_sources_bc_out, backend_db=backend_db)
         camera_source  = self.camera_source  = backend.CameraSource (weak_heap=backend_weak_heap, bc_out=multi_sources_bc_out, backend_db=backend_db)
-        face_detector  = self.face_detector  = backend.FaceDetector (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=multi_sources_bc_out, bc_out=face_detector_bc_out, backend_db=backend_db )
-        face_marker    = self.face_marker    = backend.FaceMarker   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_detector_bc_out, bc_out=face_marker_bc_out, backend_db=backend_db)
+        face_detector  = self.face_detector  = backend.FaceDetector (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=multi_sources_bc_out, bc_out=face_detector_bc_out, backend_db=backend_db, inference_server_client=get_inference_server_client() )
+        face_marker    = self.face_marker    = backend.FaceMarker   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_detector_bc_out, bc_out=face_marker_bc_out, backend_db=backend_db, inference_server_client=get_inference_server_client())
         face_aligner   = self.face_aligner   = backend.FaceAligner  (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_marker_bc_out, bc_out=face_aligner_bc_out, backend_db=backend_db )
         face_animator  = self.face_animator  = backend.FaceAnimator (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_merger_bc_out, animatables_path=animatables_path, backend_db=backend_db )
-        face_swap_insight  = self.face_swap_insight  = backend.FaceSwapInsight (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, faces_path=animatables_path, backend_db=backend_db )
+        face_swap_insight  = self.face_swap_insight  = backend.FaceSwapInsight (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, faces_path=animatables_path, backend_db=backend_db, inference_server_client=get_inference_server_client() )
         face_swap_dfm   = self.face_swap_dfm   = backend.FaceSwapDFM  (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, dfm_models_path=dfm_models_path, backend_db=backend_db )
         frame_adjuster = self.frame_adjuster = backend.FrameAdjuster(weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_swapper_bc_out, bc_out=frame_adjuster_bc_out, backend_db=backend_db )
-        face_merger    = self.face_merger    = backend.FaceMerger   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=frame_adjuster_bc_out, bc_out=face_merger_bc_out, backend_db=backend_db )
+        face_merger    = self.face_merger    = backend.FaceMerger   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_merger_bc_in, bc_out=face_merger_bc_out, backend_db=backend_db )
         stream_output  = self.stream_output  = backend.StreamOutput (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_merger_bc_out, save_default_path=userdata_path, backend_db=backend_db)
 
+        for i in range(1, face_swap_dfm_replicas):
+            face_swap_dfm.add_replica( backend.FaceSwapDFM(weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, dfm_models_path=dfm_models_path, backend_db=backend_db, id=i) )
+
+        if fused_front_end:
+            front_end_group = backend.BackendWorkerGroup('FrontEnd')
+            for bcknd in [face_detector, face_marker, face_aligner]:
+                bcknd.set_worker_group(front_end_group)
+
         self.all_backends : List[backend.BackendHost] = [file_source, camera_source, face_detector, face_marker, face_aligner, face_animator, face_swap_insight, face_swap_dfm, frame_adjuster, face_merger, stream_output]
 
+        # enabled onnxruntime backends share the cpu threads, see _update_thread_allocation()
+        ort_loads = self._ort_loads = qtx.QXMainApplication.inst.get_app_data('_QLiveSwap_ort_loads', {})
+        self._ort_backends = [face_detector, face_marker, face_animator, face_swap_insight, face_swap_dfm]
+        self._ort_enabled_backends = []
+        for bcknd in self._ort_backends:
+            bcknd.call_on_profile_timing(lambda timing, name=bcknd.__class__.__name__: ort_loads.__setitem__(name, timing))
+            bcknd.call_on_state_change(self._on_ort_backend_state_change)
+
         self.q_file_source    = QFileSource(self.file_source)
         self.q_camera_source  = QCameraSource(self.camera_source)
         self.q_face_detector  = QFaceDetector(self.face_detector)
@@ -96,10 +128,61 @@ class QLiveSwap(qtx.QXWidget):
                                             (qtx.QXWidgetVBox([self.q_ds_merged_frame_viewer], fixed_width=256), qtx.AlignTop),
                                         ], spacing=5, size_policy=('fixed', 'fixed') )
 
-        self.setLayout(qtx.QXVBoxLayout( [ (qtx.QXWidgetVBox([q_nodes, q_view_nodes], spacing=5), qtx.AlignCenter) ]))
+        # statistics of the weak heap, see _on_weak_heap_timer()
+        self._q_weak_heap_label = QXLabel(font=QXFontDB.get_fixedwidth_font(size=7))
+
+        self.setLayout(qtx.QXVBoxLayout( [ (qtx.QXWidgetVBox([q_nodes, q_view_nodes, self._q_weak_heap_label], spacing=5), qtx.AlignCenter) ]))
 
         self._timer = qtx.QXTimer(interval=5, timeout=self._on_timer_5ms, start=True)
 
+        self._weak_heap_failed_lookups = 0
+        self._weak_heap_warned = False
+        self._weak_heap_timer = qtx.QXTimer(interval=1000, timeout=self._on_weak_heap_timer, start=True)
+
+    def _update_thread_allocation(self):
+        """
+        Split the cpu threads between the processes of enabled onnxruntime backends proportional to the load measured in the previous run.
+        The allocation is applied to the processes started after the call.
+        """
+        ort_loads = self._ort_loads
+        default_load = min(ort_loads.values(), default=1.0)
+
+        loads = {}
+        groups = {}
+        for bcknd in self._ort_enabled_backends:
+            load = ort_loads.get(bcknd.__class__.__name__, default_load)
+            if self.inference_server is not None and isinstance(bcknd, (backend.FaceDetector, backend.FaceMarker)):
+                # the models run in InferenceServer, the time of the stage is the time of waiting for the server,
+                # one thread is left for the models which are not shared
+                load = 0.0
+
+            names = bcknd.get_thread_allocation_names()
+            for name in names:
+                loads[name] = load
+
+            worker_group = bcknd.get_worker_group()
+            if worker_group is not None:
+                groups.setdefault(worker_group.get_name(), []).extend(names)
+
+        if self.inference_server is not None:
+            loads['InferenceServer'] = ort_loads.get('InferenceServer', default_load)
+
+        allocation = lib_ort.allocate_threads(loads, total_threads=int(lib_appargs.get_arg_str('ORT_CPU_THREADS', '0')),
+                                                     cpu_affinity=lib_appargs.get_arg_bool('CPU_AFFINITY'),
+                                                     groups=groups)
+        lib_ort.set_thread_allocation(allocation)
+
+        if self.inference_server is not None:
+            # the server is already running
+            self.inference_server.set_thread_allocation(*allocation['InferenceServer'])
+
+    def _on_ort_backend_state_change(self, bcknd, started, starting, stopping, stopped, busy):
+        if starting and bcknd not in self._ort_enabled_backends:
+            self._ort_enabled_backends.append(bcknd)
+            self._update_thread_allocation()
+        elif stopped and bcknd in self._ort_enabled_backends:
+            self._ort_enabled_backends.remove(bcknd)
+
     def _process_messages(self):
         self.backend_db.process_messages()
         for backend in self.all_backends:
@@ -108,15 +191,45 @@ class QLiveSwap(qtx.QXWidget):
     def _on_timer_5ms(self):
         self._process_messages()
 
+    def _on_weak_heap_timer(self):
+        stats = self.backend_weak_heap.get_stats()
+        MB = 1024*1024
+
+        s = f"{L('@QLiveSwap.frame_heap')}: "
+        if stats['alloc_bytes_per_sec'] is not None:
+            s += f"{stats['alloc_bytes_per_sec']/MB:.1f} MB/s, "
+        if stats['oldest_age'] is not None:
+            s += f"{L('@QLiveSwap.frame_heap.oldest')} {stats['oldest_age']:.2f} s, "
+        s += f"{L('@QLiveSwap.frame_heap.failed_lookups')} {stats['failed_lookups']}"
+        failed_processes = [ f"{name} {process_stats['failed_lookups']}" for name, process_stats in stats['processes'].items() if process_stats['failed_lookups'] != 0 ]
+        if len(failed_processes) != 0:
+            s += f" ({', '.join(failed_processes)})"
+        if stats['recommended_size_mb'] is not None:
+            s += f", {L('@QLiveSwap.frame_heap.recommended_size')} {stats['recommended_size_mb']} MB"
+
+        is_failed = stats['failed_lookups'] != self._weak_heap_failed_lookups
+        self._weak_heap_failed_lookups = stats['failed_lookups']
+
+        self._q_weak_heap_label.setText(s)
+        self._q_weak_heap_label.setToolTip(backend.BackendWeakHeap.format_stats(stats))
+        self._q_weak_heap_label.set_color('red' if is_failed else None)
+
+        if is_failed and not self._weak_heap_warned:
+            self._weak_heap_warned = True
+            print('Data is overwritten in the weak heap before it is processed. Increase the heap size with --weak-heap-size-mb.')
+
     def clear_backend_db(self):
         self.backend_db.clear()
 
     def initialize(self):
+        default_states = { bcknd : not isinstance(bcknd, (backend.CameraSource, backend.FaceAnimator, backend.FaceSwapInsight) ) for bcknd in self.all_backends }
+
+        # the allocation of all backends to be started
+        self._ort_enabled_backends = [ bcknd for bcknd in self._ort_backends if bcknd.get_saved_on_off_state(default_state=default_states[bcknd]) ]
+        self._update_thread_allocation()
+
         for bcknd in self.all_backends:
-            default_state = True
-            if isinstance(bcknd, (backend.CameraSource, backend.FaceAnimator, backend.FaceSwapInsight) ):
-                default_state = False
-            bcknd.restore_on_off_state(default_state=default_state)
+            bcknd.restore_on_off_state(default_state=default_states[bcknd])
 
     def finalize(self):
         # Gracefully stop the backend
@@ -132,6 +245,13 @@ class QLiveSwap(qtx.QXWidget):
 
         self.backend_db.finish_pending_jobs()
 
+        if self.inference_server is not None:
+            if self.inference_server.get_load() is not None:
+                self._ort_loads['InferenceServer'] = self.inference_server.get_load()
+            self.inference_server.stop()
+
+        qtx.QXMainApplication.inst.set_app_data('_QLiveSwap_ort_loads', self._ort_loads)
+
         self.q_ds_frame_viewer.clear()
         self.q_ds_fa_viewer.clear()
 
@@ -190,7 +310,16 @@ class QDFLAppWindow(qtx.QXWindow):
                                                 choices_names=[ L('@QDFLAppWindow.process_priority.normal'), L('@QDFLAppWindow.process_priority.lowest') ],
                                                 on_choice_selected=self._on_cb_process_priority_choice)
 
-        menu_bar_tail = qtx.QXFrameHBox([10, QXLabel(text=L('@QDFLAppWindow.process_priority')), 4, cb_process_priority], size_policy=('fixed', 'fixed'))
+        cpu_threads_choices = [0] + list(range(1, lib_ort.get_cpu_count()+1))
+        cb_cpu_threads = self._cb_cpu_threads = qtx.QXSaveableComboBox(
+                                                db_key = '_QDFLAppWindow_cpu_threads',
+                                                choices=cpu_threads_choices,
+                                                default_choice=0,
+                                                choices_names=[ L('@QDFLAppWindow.cpu_threads.auto') ] + [ str(x) for x in cpu_threads_choices[1:] ],
+                                                on_choice_selected=self._on_cb_cpu_threads_choice)
+
+        menu_bar_tail = qtx.QXFrameHBox([10, QXLabel(text=L('@QDFLAppWindow.process_priority')), 4, cb_process_priority,
+                                         10, QXLabel(text=L('@QDFLAppWindow.cpu_threads')), 4, cb_cpu_threads], size_policy=('fixed', 'fixed'))
 
         self.setLayout( qtx.QXVBoxLayout([  qtx.QXWidgetHBox([menu_bar, menu_bar_tail, qtx.QXFrame() ], size_policy=('minimumexpanding', 'fixed')),
                                             5,
@@ -214,6 +343,12 @@ class QDFLAppWindow(qtx.QXWindow):
         if self.q_live_swap is not None:
             qtx.QXMainApplication.inst.reinitialize()
 
+    def _on_cb_cpu_threads_choice(self, cpu_threads : int, _):
+        lib_appargs.set_arg_str('ORT_CPU_THREADS', str(cpu_threads))
+
+        if self.q_live_swap is not None:
+            qtx.QXMainApplication.inst.reinitialize()
+
     def finalize(self):
         self.q_live_swap.finalize()
 
@@ -0,0 +1,239 @@
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import List
+
+from xlib import onnxruntime as lib_ort
+
+from . import backend
+from .backend.FileSource import FPState, InputType
+from .backend.StreamOutput import SourceType
+
+
+class DeepFaceLiveHeadlessApp:
+    """
+    Runs FileSource -> FaceDetector -> FaceMarker -> FaceAligner -> FaceSwapDFM
+    -> FrameAdjuster -> FaceMerger -> StreamOutput without Qt.
+
+     userdata_path  Path    the same directory as used by DeepFaceLiveApp
+
+     config_path    Path    .json config file
+
+    config example
+
+        {
+            "input_type" : "VIDEO_FILE",
+            "input_path" : "/data/input.mp4",
+            "target_width" : 0,
+            "output_sequence_path" : "/data/output_sequence",
+            "output_source_type" : "MERGED_FRAME_OR_SOURCE_FRAME",
+            "weak_heap_size_mb" : 2048,
+            "weak_heap_slab" : false,
+            "face_swap_replicas" : 1,
+            "fused_front_end" : false,
+            "cpu_threads" : 0,
+            "cpu_affinity" : false,
+            "cpu_thread_loads" : { "FaceDetector" : 1, "FaceMarker" : 1, "FaceSwapDFM" : 4 }
+        }
+
+    Settings of the other modules are taken from settings/headless_states.dat,
+    which is copied from settings/states.dat of the GUI app on first run,
+    thus the modules can be tuned in the GUI first.
+
+    cpu_threads (0 - number of cpus) are split between the processes of FaceDetector, FaceMarker and FaceSwapDFM replicas
+    proportional to cpu_thread_loads. Measured loads are printed at the end of the run.
+    """
+
+    def __init__(self, userdata_path : Path, config_path : Path):
+        config = json.loads(Path(config_path).read_text())
+
+        input_type = InputType[config.get('input_type', 'VIDEO_FILE').upper()]
+        input_path = config.get('input_path', None)
+        if input_path is None:
+            raise ValueError('input_path is not specified in config')
+        input_path = Path(input_path)
+        if not input_path.exists():
+            raise FileNotFoundError(f'{input_path} does not exist.')
+
+        output_sequence_path = Path(config.get('output_sequence_path', userdata_path / 'output_sequence'))
+        output_sequence_path.mkdir(parents=True, exist_ok=True)
+
+        dfm_models_path = userdata_path / 'dfm_models'
+        dfm_models_path.mkdir(parents=True, exist_ok=True)
+
+        settings_dirpath = userdata_path / 'settings'
+        settings_dirpath.mkdir(parents=True, exist_ok=True)
+
+        states_path = settings_dirpath / 'headless_states.dat'
+        gui_states_path = settings_dirpath / 'states.dat'
+        if not states_path.exists() and gui_states_path.exists():
+            shutil.copy(gui_states_path, states_path)
+
+        backend_db          = self.backend_db          = backend.BackendDB( states_path )
+        backend_weak_heap   = self.backend_weak_heap   = backend.BackendWeakHeap(size_mb=int(config.get('weak_heap_size_mb', 2048)), slab=bool(config.get('weak_heap_slab', False)))
+        reemit_frame_signal = self.reemit_frame_signal = backend.BackendSignal()
+
+        face_swap_dfm_replicas = max(1, int(config.get('face_swap_replicas', 1)))
+
+        file_source_bc_out    = backend.BackendConnection()
+        fused_front_end = bool(config.get('fused_front_end', False))
+
+        face_detector_bc_out  = backend.BackendLocalConnection() if fused_front_end else backend.BackendConnection()
+        face_marker_bc_out    = backend.BackendLocalConnection() if fused_front_end else backend.BackendConnection()
+        face_aligner_bc_out   = backend.BackendConnection(multi_consumer=face_swap_dfm_replicas > 1, sequence=face_swap_dfm_replicas > 1)
+        face_swapper_bc_out   = backend.BackendConnection(multi_producer=face_swap_dfm_replicas > 1)
+        frame_adjuster_bc_out = backend.BackendConnection()
+        face_merger_bc_out    = backend.BackendConnection()
+
+        # frames from replicas come in order of completion
+        face_merger_bc_in = backend.BackendReorderConnection(frame_adjuster_bc_out) if face_swap_dfm_replicas > 1 else frame_adjuster_bc_out
+
+        file_source    = self.file_source    = backend.FileSource   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_out=file_source_bc_out, backend_db=backend_db)
+        face_detector  = self.face_detector  = backend.FaceDetector (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=file_source_bc_out, bc_out=face_detector_bc_out, backend_db=backend_db )
+        face_marker    = self.face_marker    = backend.FaceMarker   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_detector_bc_out, bc_out=face_marker_bc_out, backend_db=backend_db)
+        face_aligner   = self.face_aligner   = backend.FaceAligner  (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_marker_bc_out, bc_out=face_aligner_bc_out, backend_db=backend_db )
+        face_swap_dfm  = self.face_swap_dfm  = backend.FaceSwapDFM  (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, dfm_models_path=dfm_models_path, backend_db=backend_db )
+        frame_adjuster = self.frame_adjuster = backend.FrameAdjuster(weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_swapper_bc_out, bc_out=frame_adjuster_bc_out, backend_db=backend_db )
+        face_merger    = self.face_merger    = backend.FaceMerger   (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_merger_bc_in, bc_out=face_merger_bc_out, backend_db=backend_db )
+        stream_output  = self.stream_output  = backend.StreamOutput (weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_merger_bc_out, save_default_path=userdata_path, backend_db=backend_db)
+
+        for i in range(1, face_swap_dfm_replicas):
+            face_swap_dfm.add_replica( backend.FaceSwapDFM(weak_heap=backend_weak_heap, reemit_frame_signal=reemit_frame_signal, bc_in=face_aligner_bc_out, bc_out=face_swapper_bc_out, dfm_models_path=dfm_models_path, backend_db=backend_db, id=i) )
+
+        if fused_front_end:
+            # FaceDetector, FaceMarker and FaceAligner in one process
+            front_end_group = backend.BackendWorkerGroup('FrontEnd')
+            for bcknd in [face_detector, face_marker, face_aligner]:
+                bcknd.set_worker_group(front_end_group)
+
+        self.all_backends : List[backend.BackendHost] = [file_source, face_detector, face_marker, face_aligner, face_swap_dfm, frame_adjuster, face_merger, stream_output]
+
+        # every replica and every worker group is a process in the allocation
+        ort_backends = [face_detector, face_marker, face_swap_dfm]
+        ort_loads = config.get('cpu_thread_loads', {})
+        loads = {}
+        groups = {}
+        for bcknd in ort_backends:
+            names = bcknd.get_thread_allocation_names()
+            for name in names:
+                loads[name] = float(ort_loads.get(bcknd.__class__.__name__, 1.0))
+
+            worker_group = bcknd.get_worker_group()
+            if worker_group is not None:
+                groups.setdefault(worker_group.get_name(), []).extend(names)
+
+        thread_allocation = lib_ort.allocate_threads(loads, total_threads=int(config.get('cpu_threads', 0)),
+                                                     cpu_affinity=bool(config.get('cpu_affinity', False)),
+                                                     groups=groups)
+        lib_ort.set_thread_allocation(thread_allocation)
+        print(f'CPU threads: {", ".join(f"{name} {num_threads}" for name, (num_threads, _) in thread_allocation.items())}')
+
+        self.measured_loads = {}
+        for bcknd in ort_backends:
+            bcknd.call_on_profile_timing(lambda timing, name=bcknd.__class__.__name__: self.measured_loads.__setitem__(name, timing))
+        self.all_bcs : List[backend.BackendConnection] = [file_source_bc_out, face_detector_bc_out, face_marker_bc_out, face_aligner_bc_out, face_swapper_bc_out, frame_adjuster_bc_out, face_merger_bc_out]
+
+        self.latency_report = None
+        stream_output.call_on_latency_report(self._on_latency_report)
+
+        # Override the states of source and output.
+        # Player is not realtime and not autorewinded, thus every frame is processed once.
+        file_source_state = file_source.get_state()
+        file_source_state.input_type = input_type
+        file_source_state.input_path = input_path
+        fp_state = file_source_state.fp_state = FPState()
+        fp_state.target_width = int(config.get('target_width', 0))
+        fp_state.fps = 0
+        fp_state.is_realtime = False
+        fp_state.is_autorewind = False
+
+        stream_output_state = stream_output.get_state()
+        stream_output_state.source_type = SourceType[config.get('output_source_type', 'MERGED_FRAME_OR_SOURCE_FRAME').upper()]
+        stream_output_state.sequence_path = output_sequence_path
+        stream_output_state.save_fill_frame_gap = False
+        stream_output_state.is_showing_window = False
+        stream_output_state.is_streaming = False
+
+    def _on_latency_report(self, report):
+        self.latency_report = report
+
+    def _process_messages(self):
+        self.backend_db.process_messages()
+        for backend in self.all_backends:
+            backend.process_messages()
+
+    def _is_all_bcs_read(self) -> bool:
+        return all(bc.is_full_read() for bc in self.all_bcs)
+
+    def run(self):
+        file_source_cs = self.file_source.get_control_sheet()
+        stream_output_cs = self.stream_output.get_control_sheet()
+
+        for bcknd in self.all_backends:
+            bcknd.start()
+
+        play_requested = False
+        is_playing = False
+        source_ended_time = None
+        last_print_time = time.time()
+
+        try:
+            while True:
+                self._process_messages()
+
+                if not play_requested:
+                    if all(bcknd.is_started() and not bcknd.is_busy() for bcknd in self.all_backends) and \
+                       file_source_cs.play.is_enabled():
+                        file_source_cs.play.signal()
+                        play_requested = True
+
+                elif source_ended_time is None:
+                    if file_source_cs.pause.is_enabled():
+                        is_playing = True
+                    elif is_playing and file_source_cs.play.is_enabled():
+                        # FileSource is stopped at the last frame
+                        source_ended_time = time.time()
+
+                    if self.file_source.is_stopped():
+                        print('FileSource is stopped.')
+                        break
+                else:
+                    # Wait the pipeline to be drained
+                    if not self._is_all_bcs_read():
+                        source_ended_time = time.time()
+                    elif time.time() - source_ended_time >= 1.0:
+                        break
+
+                if time.time() - last_print_time >= 1.0:
+                    last_print_time = time.time()
+                    weak_heap_stats = self.backend_weak_heap.get_stats()
+                    print(f'Frame {file_source_cs.frame_index.get_number()} / {file_source_cs.frame_count.get_number()}, FPS: {stream_output_cs.avg_fps.get_number() or 0:.1f}, weak heap failed lookups: {weak_heap_stats["failed_lookups"]}')
+
+                time.sleep(0.001)
+        except KeyboardInterrupt:
+            print('Interrupted.')
+
+        self.finalize()
+
+        if self.latency_report is not None:
+            print('Latency of last frames:')
+            print(backend.BackendLatencyAggregator.format_report(self.latency_report))
+
+        if len(self.measured_loads) != 0:
+            print(f'Measured cpu_thread_loads: {json.dumps({ name : round(timing*1000, 2) for name, timing in self.measured_loads.items() })}')
+
+        print('Weak heap:')
+        print(backend.BackendWeakHeap.format_stats(self.backend_weak_heap.get_stats()))
+
+    def finalize(self):
+        # Gracefully stop the backend
+        for bcknd in self.all_backends:
+            while bcknd.is_starting() or bcknd.is_stopping():
+                self._process_messages()
+            bcknd.stop()
+
+        while not all( x.is_stopped() for x in self.all_backends ):
+            self._process_messages()
+
+        self.backend_db.finish_pending_jobs()
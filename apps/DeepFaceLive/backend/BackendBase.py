@@ -1,14 +1,18 @@
 import multiprocessing
 import pickle
-from typing import List, Union, Tuple
+import struct
+from collections import OrderedDict, deque
+from typing import Dict, List, Union, Tuple
 
 import numpy as np
 from xlib import mp as lib_mp
+from xlib import onnxruntime as lib_ort
 from xlib import time as lib_time
+from xlib.math import Affine2DUniMat
 from xlib.mp import csw as lib_csw
 from xlib.python.EventListener import EventListener
 
-from xlib.face import FRect, FLandmarks2D, FPose
+from xlib.face import ELandmarks2D, FRect, FLandmarks2D, FPose
 
 class BackendFaceSwapInfo:
     def __init__(self):
@@ -35,12 +39,148 @@ class BackendFaceSwapInfo:
         self.__init__()
         self.__dict__.update(d)
 
+
+# Wire format of BackendConnectionData.
+#
+# All values are little-endian.
+#
+#   header                  _wire_header
+#   frame_image_name        str
+#   merged_image_name       str
+#   'heap' section          u32 size, ...
+#   'fsi' section           u32 size, ...
+#   'trace' section         u32 size, ...
+#
+# str is i32 length (-1 for None) and utf-8 bytes.
+# array is u8 ndim (255 for None), u32 * ndim shape, u8 dtype length, dtype.str, raw data.
+#
+# Sections are decoded only on first access,
+# untouched sections are written back as is.
+#
+# Increment _WIRE_SCHEMA_VERSION on any change of the format.
+
+_WIRE_MAGIC = b'BCD\x00'
+_WIRE_SCHEMA_VERSION = 2
+_WIRE_SECTIONS = ('heap', 'fsi', 'trace')
+
+_wire_header = struct.Struct('<4sHqqbBqqdd')
+_wire_i32 = struct.Struct('<i')
+_wire_u32 = struct.Struct('<I')
+_wire_i64 = struct.Struct('<q')
+_wire_3d = struct.Struct('<3d')
+
+def _wire_write_str(out : bytearray, s : Union[str, None]):
+    if s is None:
+        out += _wire_i32.pack(-1)
+    else:
+        b = s.encode('utf-8')
+        out += _wire_i32.pack(len(b))
+        out += b
+
+def _wire_read_str(mv : memoryview, c : int) -> Tuple[Union[str, None], int]:
+    size, = _wire_i32.unpack_from(mv, c)
+    c += 4
+    if size == -1:
+        return None, c
+    return str(mv[c:c+size], 'utf-8'), c+size
+
+def _wire_write_shape_dtype(out : bytearray, shape, dtype):
+    dtype_b = np.dtype(dtype).str.encode('ascii')
+    out += struct.pack(f'<B{len(shape)}IB', len(shape), *shape, len(dtype_b))
+    out += dtype_b
+
+def _wire_read_shape_dtype(mv : memoryview, c : int) -> Tuple[Union[Tuple, None], Union[np.dtype, None], int]:
+    ndim = mv[c]
+    c += 1
+    if ndim == 255:
+        return None, None, c
+    shape = struct.unpack_from(f'<{ndim}I', mv, c)
+    c += 4*ndim
+    dtype_size = mv[c]
+    c += 1
+    dtype = np.dtype( str(mv[c:c+dtype_size], 'ascii') )
+    return shape, dtype, c+dtype_size
+
+def _wire_write_array(out : bytearray, n : Union[np.ndarray, None], dtype=None):
+    if n is None:
+        out.append(255)
+    else:
+        n = np.ascontiguousarray(n, dtype=dtype)
+        _wire_write_shape_dtype(out, n.shape, n.dtype)
+        out += n.data.cast('B')
+
+def _wire_read_array(mv : memoryview, c : int) -> Tuple[Union[np.ndarray, None], int]:
+    shape, dtype, c = _wire_read_shape_dtype(mv, c)
+    if shape is None:
+        return None, c
+    count = int(np.prod(shape))
+    n = np.frombuffer(mv, dtype=dtype, count=count, offset=c).reshape(shape)
+    return n, c+count*dtype.itemsize
+
+def _wire_write_lmrks(out : bytearray, lmrks : Union[FLandmarks2D, None]):
+    if lmrks is None:
+        out += _wire_i32.pack(-1)
+        _wire_write_array(out, None)
+    else:
+        out += _wire_i32.pack(lmrks.get_type().value)
+        _wire_write_array(out, lmrks.as_numpy(), np.float32)
+
+def _wire_read_lmrks(mv : memoryview, c : int) -> Tuple[Union[FLandmarks2D, None], int]:
+    type_value, = _wire_i32.unpack_from(mv, c)
+    ulmrks, c = _wire_read_array(mv, c+4)
+    if type_value == -1:
+        return None, c
+    return FLandmarks2D.create(ELandmarks2D(type_value), ulmrks), c
+
+_wire_fsi_str_fields = ('image_name', 'face_align_image_name', 'face_align_mask_name', 'face_align_lmrks_mask_name',
+                        'face_anim_image_name', 'face_swap_image_name', 'face_swap_mask_name')
+
+def _wire_write_fsi(out : bytearray, fsi : BackendFaceSwapInfo):
+    for field in _wire_fsi_str_fields:
+        _wire_write_str(out, getattr(fsi, field))
+    out += _wire_i64.pack(-1 if fsi.face_resolution is None else fsi.face_resolution)
+    _wire_write_array(out, fsi.face_urect.as_4pts() if fsi.face_urect is not None else None, np.float32)
+    _wire_write_array(out, fsi.face_pose.as_radians() if fsi.face_pose is not None else None, np.float32)
+    _wire_write_lmrks(out, fsi.face_ulmrks)
+    _wire_write_array(out, fsi.image_to_align_uni_mat, np.float32)
+    _wire_write_lmrks(out, fsi.face_align_ulmrks)
+
+def _wire_read_fsi(mv : memoryview, c : int) -> Tuple[BackendFaceSwapInfo, int]:
+    fsi = BackendFaceSwapInfo()
+    for field in _wire_fsi_str_fields:
+        value, c = _wire_read_str(mv, c)
+        setattr(fsi, field, value)
+
+    face_resolution, = _wire_i64.unpack_from(mv, c)
+    c += 8
+    fsi.face_resolution = None if face_resolution == -1 else face_resolution
+
+    pts, c = _wire_read_array(mv, c)
+    if pts is not None:
+        fsi.face_urect = FRect.from_4pts(pts)
+
+    pyr, c = _wire_read_array(mv, c)
+    if pyr is not None:
+        fsi.face_pose = FPose.from_radians(*pyr)
+
+    fsi.face_ulmrks, c = _wire_read_lmrks(mv, c)
+
+    mat, c = _wire_read_array(mv, c)
+    if mat is not None:
+        fsi.image_to_align_uni_mat = mat.copy().view(Affine2DUniMat)
+
+    fsi.face_align_ulmrks, c = _wire_read_lmrks(mv, c)
+    return fsi, c
+
+
 class BackendConnectionData:
     """
     data class for BackendConnection
 
     Should not contain large buffers.
     Large buffers are stored via MPWeakHeap
+
+    Transferred via compact binary format, see dumps()/loads()
     """
 
     def __init__(self, uid ):
@@ -50,6 +190,7 @@ class BackendConnectionData:
         self._weak_heap_image_infos = {}
 
         self._uid = uid
+        self._seq_num = None
         self._is_frame_reemitted = None
 
         self._frame_image_name = None
@@ -61,18 +202,207 @@ class BackendConnectionData:
 
         self._face_swap_info_list = []
 
+        # list of [stage_name, enter_time, exit_time, write_time] per passed stage
+        self._latency_trace = []
+
+        # not decoded yet sections of wire format
+        self._wire_sections = {}
+
     def __getstate__(self, ):
+        for name in _WIRE_SECTIONS:
+            self._wire_decode(name)
         d = self.__dict__.copy()
         d['_weak_heap'] = None
         return d
 
+    def _wire_decode(self, name):
+        """
+        decode the section of wire format if it is not decoded yet
+        """
+        mv = self._wire_sections.pop(name, None)
+        if mv is None:
+            return
+
+        if name == 'heap':
+            c = 0
+            count, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            for _ in range(count):
+                key, c = _wire_read_str(mv, c)
+                self._weak_heap_refs[key] = lib_mp.MPWeakHeap.DataRef.unpack(mv[c:c+lib_mp.MPWeakHeap.DataRef.sizeof])
+                c += lib_mp.MPWeakHeap.DataRef.sizeof
+
+            count, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            for _ in range(count):
+                key, c = _wire_read_str(mv, c)
+                shape, dtype, c = _wire_read_shape_dtype(mv, c)
+                self._weak_heap_image_infos[key] = (shape, dtype)
+
+        elif name == 'fsi':
+            c = 0
+            count, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            for _ in range(count):
+                fsi, c = _wire_read_fsi(mv, c)
+                self._face_swap_info_list.append(fsi)
+
+        elif name == 'trace':
+            c = 0
+            count, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            for _ in range(count):
+                stage_name, c = _wire_read_str(mv, c)
+                enter_t, exit_t, write_t = _wire_3d.unpack_from(mv, c)
+                c += _wire_3d.size
+                self._latency_trace.append([stage_name, enter_t,
+                                            None if np.isnan(exit_t) else exit_t,
+                                            None if np.isnan(write_t) else write_t])
+
+    def _wire_encode(self, name, out : bytearray):
+        if name == 'heap':
+            out += _wire_u32.pack(len(self._weak_heap_refs))
+            for key, ref in self._weak_heap_refs.items():
+                _wire_write_str(out, key)
+                out += ref.pack()
+
+            out += _wire_u32.pack(len(self._weak_heap_image_infos))
+            for key, (shape, dtype) in self._weak_heap_image_infos.items():
+                _wire_write_str(out, key)
+                _wire_write_shape_dtype(out, shape, dtype)
+
+        elif name == 'fsi':
+            out += _wire_u32.pack(len(self._face_swap_info_list))
+            for fsi in self._face_swap_info_list:
+                _wire_write_fsi(out, fsi)
+
+        elif name == 'trace':
+            out += _wire_u32.pack(len(self._latency_trace))
+            for stage_name, enter_t, exit_t, write_t in self._latency_trace:
+                _wire_write_str(out, stage_name)
+                out += _wire_3d.pack(enter_t,
+                                     np.nan if exit_t is None else exit_t,
+                                     np.nan if write_t is None else write_t)
+
+    def dumps(self) -> bytearray:
+        """
+        serialize to compact binary format
+        """
+        none_mask = (self._frame_count is None) | \
+                    (self._frame_num is None) << 1 | \
+                    (self._frame_fps is None) << 2 | \
+                    (self._frame_timestamp is None) << 3
+
+        out = bytearray()
+        out += _wire_header.pack(_WIRE_MAGIC, _WIRE_SCHEMA_VERSION, self._uid,
+                                 -1 if self._seq_num is None else self._seq_num,
+                                 -1 if self._is_frame_reemitted is None else int(self._is_frame_reemitted),
+                                 none_mask,
+                                 self._frame_count or 0,
+                                 self._frame_num or 0,
+                                 self._frame_fps or 0,
+                                 self._frame_timestamp or 0)
+        _wire_write_str(out, self._frame_image_name)
+        _wire_write_str(out, self._merged_image_name)
+
+        for name in _WIRE_SECTIONS:
+            section = self._wire_sections.get(name, None)
+            if section is None:
+                section = bytearray()
+                self._wire_encode(name, section)
+            out += _wire_u32.pack(len(section))
+            out += section
+        return out
+
+    @staticmethod
+    def loads(b : Union[bytes, bytearray, memoryview]) -> 'BackendConnectionData':
+        """
+        deserialize from binary format produced by dumps()
+
+        raises ValueError if the data is not BackendConnectionData of the current schema
+        """
+        mv = memoryview(b).cast('B')
+
+        magic, version, uid, seq_num, is_frame_reemitted, none_mask, \
+        frame_count, frame_num, frame_fps, frame_timestamp = _wire_header.unpack_from(mv, 0)
+
+        if magic != _WIRE_MAGIC:
+            raise ValueError('data is not BackendConnectionData')
+        if version != _WIRE_SCHEMA_VERSION:
+            raise ValueError(f'Unsupported schema version {version} of BackendConnectionData, expected {_WIRE_SCHEMA_VERSION}')
+
+        bcd = BackendConnectionData(uid=uid)
+        bcd._seq_num = None if seq_num == -1 else seq_num
+        bcd._is_frame_reemitted = None if is_frame_reemitted == -1 else bool(is_frame_reemitted)
+        bcd._frame_count     = None if none_mask & 1 else frame_count
+        bcd._frame_num       = None if none_mask & 2 else frame_num
+        bcd._frame_fps       = None if none_mask & 4 else frame_fps
+        bcd._frame_timestamp = None if none_mask & 8 else frame_timestamp
+
+        c = _wire_header.size
+        bcd._frame_image_name, c = _wire_read_str(mv, c)
+        bcd._merged_image_name, c = _wire_read_str(mv, c)
+
+        for name in _WIRE_SECTIONS:
+            size, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            bcd._wire_sections[name] = mv[c:c+size]
+            c += size
+        return bcd
+
+    def dump_content(self) -> bytes:
+        """
+        serialize the content produced by the stages:
+        frame and merged image names, weak heap references and face swap infos.
+
+        Weak heap references are unique per written data,
+        thus equal contents mean the same data.
+        """
+        out = bytearray()
+        _wire_write_str(out, self._frame_image_name)
+        _wire_write_str(out, self._merged_image_name)
+        for name in ('heap', 'fsi'):
+            section = self._wire_sections.get(name, None)
+            if section is None:
+                section = bytearray()
+                self._wire_encode(name, section)
+            out += _wire_u32.pack(len(section))
+            out += section
+        return bytes(out)
+
+    def load_content(self, b : bytes):
+        """
+        replace the content with the content from dump_content()
+        """
+        mv = memoryview(b).cast('B')
+        self._frame_image_name, c = _wire_read_str(mv, 0)
+        self._merged_image_name, c = _wire_read_str(mv, c)
+
+        self._weak_heap_refs = {}
+        self._weak_heap_image_infos = {}
+        self._face_swap_info_list = []
+        for name in ('heap', 'fsi'):
+            size, = _wire_u32.unpack_from(mv, c)
+            c += 4
+            self._wire_sections[name] = mv[c:c+size]
+            c += size
+
+    def is_weak_heap_valid(self) -> bool:
+        """
+        returns True if all stored files are not overwritten in the weak heap yet
+        """
+        self._wire_decode('heap')
+        return all( self._weak_heap.is_data_valid(ref) for ref in self._weak_heap_refs.values() )
+
     def assign_weak_heap(self, weak_heap : lib_mp.MPWeakHeap):
         self._weak_heap = weak_heap
 
     def set_file(self, key, data : Union[bytes, bytearray, memoryview]):
+        self._wire_decode('heap')
         self._weak_heap_refs[key] = self._weak_heap.add_data(data)
 
     def get_file(self, key) -> Union[bytes, None]:
+        self._wire_decode('heap')
         ref = self._weak_heap_refs.get(key, None)
         if ref is not None:
             return self._weak_heap.get_data(ref)
@@ -95,6 +425,7 @@ class BackendConnectionData:
         """
         if key is None:
             return (None, None)
+        self._wire_decode('heap')
         image_info = self._weak_heap_image_infos.get(key, None)
         if image_info is not None:
             shape, dtype = image_info
@@ -104,6 +435,7 @@ class BackendConnectionData:
     def get_image(self, key) -> Union[np.ndarray, None]:
         if key is None:
             return None
+        self._wire_decode('heap')
         image_info = self._weak_heap_image_infos.get(key, None)
         buffer = self.get_file(key)
 
@@ -114,6 +446,13 @@ class BackendConnectionData:
 
     def get_uid(self) -> int: return self._uid
 
+    def get_seq_num(self) -> Union[int, None]:
+        """
+        contiguous number of the data written to the connection with sequence=True, see BackendReorderConnection
+        """
+        return self._seq_num
+    def set_seq_num(self, seq_num : int): self._seq_num = seq_num
+
     def get_is_frame_reemitted(self) -> Union[bool, None]: return self._is_frame_reemitted
     def set_is_frame_reemitted(self, is_frame_reemitted : bool): self._is_frame_reemitted = is_frame_reemitted
     def get_frame_count(self) -> Union[int, None]: return self._frame_count
@@ -130,25 +469,153 @@ class BackendConnectionData:
     def get_merged_image_name(self) -> Union[str, None]: return self._merged_image_name
     def set_merged_image_name(self, merged_frame_name : str): self._merged_image_name = merged_frame_name
 
-    def get_face_swap_info_list(self) -> List[BackendFaceSwapInfo]: return self._face_swap_info_list
+    def trace_enter(self, t : float = None):
+        """
+        open new stage in latency trace
+
+            t   lib_time.mono_timestamp() of enter. Default current time.
+        """
+        self._wire_decode('trace')
+        self._latency_trace.append( [None, lib_time.mono_timestamp() if t is None else t, None, None] )
+
+    def trace_exit(self, stage_name : str, enter_t : float = None):
+        """
+        close the stage in latency trace when the data is processed
+
+            enter_t     used if the stage was not opened by trace_enter,
+                        for example in source stages, which construct the data.
+        """
+        self._wire_decode('trace')
+        trace = self._latency_trace
+        if len(trace) == 0 or trace[-1][2] is not None:
+            self.trace_enter(t=enter_t)
+        stage = trace[-1]
+        stage[0] = stage_name
+        stage[2] = lib_time.mono_timestamp()
+
+    def trace_write(self):
+        """
+        mark the time when the processed data is written to the next connection
+        """
+        self._wire_decode('trace')
+        trace = self._latency_trace
+        if len(trace) != 0 and trace[-1][2] is not None and trace[-1][3] is None:
+            trace[-1][3] = lib_time.mono_timestamp()
+
+    def get_latency_trace(self) -> List[ Tuple[Union[str,None], float, Union[float,None], Union[float,None]] ]:
+        """
+        returns list of (stage_name, enter_time, exit_time, write_time)
+        exit_time and write_time can be None if not reached yet
+        """
+        self._wire_decode('trace')
+        return [ tuple(x) for x in self._latency_trace ]
+
+    def get_face_swap_info_list(self) -> List[BackendFaceSwapInfo]:
+        self._wire_decode('fsi')
+        return self._face_swap_info_list
+
     def add_face_swap_info(self, fsi : BackendFaceSwapInfo):
         if not isinstance(fsi, BackendFaceSwapInfo):
             raise ValueError(f'fsi must be an instance of BackendFaceSwapInfo')
+        self._wire_decode('fsi')
         self._face_swap_info_list.append(fsi)
 
 
+class BackendLatencyAggregator:
+    """
+    Aggregates latency traces of BackendConnectionData.
+
+    Computes p50/p95/p99 in seconds of
+
+     'end_to_end'           enter of the first stage -> exit of the last stage
+
+     '<stage>.queue'        write of the previous stage -> enter of the stage,
+                            time the data was waiting in BackendConnection
+
+     '<stage>.process'      enter -> exit of the stage
+
+     '<stage>.wait'         exit -> write of the stage,
+                            time the stage was waiting the next stage to read
+    """
+    def __init__(self, samples=600):
+        self._samples = samples
+        self._measurements : Dict[str, deque] = {}
+
+    def _add(self, key, value):
+        m = self._measurements.get(key, None)
+        if m is None:
+            m = self._measurements[key] = deque(maxlen=self._samples)
+        m.append(value)
+
+    def add(self, bcd : BackendConnectionData):
+        trace = bcd.get_latency_trace()
+        if len(trace) == 0:
+            return
+
+        prev_write_t = None
+        last_t = None
+        for stage_name, enter_t, exit_t, write_t in trace:
+            if stage_name is None:
+                stage_name = 'unnamed'
+            if prev_write_t is not None:
+                self._add(f'{stage_name}.queue', enter_t - prev_write_t)
+            if exit_t is not None:
+                self._add(f'{stage_name}.process', exit_t - enter_t)
+                last_t = exit_t
+                if write_t is not None:
+                    self._add(f'{stage_name}.wait', write_t - exit_t)
+            prev_write_t = write_t
+
+        if last_t is not None:
+            self._add('end_to_end', last_t - trace[0][1])
+
+    def clear(self):
+        self._measurements = {}
+
+    def get_report(self) -> Dict[str, Tuple[float, float, float]]:
+        """
+        returns dict of key -> (p50, p95, p99) in seconds
+        """
+        return { key : tuple( float(x) for x in np.percentile(m, [50, 95, 99]) )
+                 for key, m in self._measurements.items() if len(m) != 0 }
+
+    @staticmethod
+    def format_report(report : Dict[str, Tuple[float, float, float]]) -> str:
+        lines = [f'{"":32} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}']
+        for key, (p50, p95, p99) in report.items():
+            lines.append(f'{key:32} {p50*1000:9.2f} {p95*1000:9.2f} {p99*1000:9.2f}')
+        return '\n'.join(lines)
+
 
 class BackendConnection:
-    def __init__(self, multi_producer=False):
-        self._rd = lib_mp.MPSPSCMRRingData(table_size=8192, heap_size_mb=8, multi_producer=multi_producer)
+    """
+        multi_producer(False)   allow multiple writers, for example the sources or replicas of the backend
+
+        multi_consumer(False)   allow multiple readers, for example replicas of the backend,
+                                every data is read by one of the readers
+
+        sequence(False)         set contiguous sequence number to the written data,
+                                use as input of the replicas, and BackendReorderConnection after them.
+                                Unlike uid, the number has no gaps of the frames dropped before the connection.
+    """
+    def __init__(self, multi_producer=False, multi_consumer=False, sequence=False):
+        if sequence and multi_producer:
+            raise ValueError('sequence requires single producer')
+        self._rd = lib_mp.MPSPSCMRRingData(table_size=8192, heap_size_mb=8, multi_producer=multi_producer, multi_consumer=multi_consumer)
+        self._sequence = sequence
 
     def write(self, bcd : BackendConnectionData):
-        self._rd.write( pickle.dumps(bcd) )
+        bcd.trace_write()
+        if self._sequence:
+            bcd.set_seq_num(self._rd.get_write_id()+1)
+        self._rd.write( bcd.dumps() )
 
     def read(self, timeout : float = 0) -> Union[BackendConnectionData, None]:
         b = self._rd.read(timeout=timeout)
         if b is not None:
-            return pickle.loads(b)
+            bcd = BackendConnectionData.loads(b)
+            bcd.trace_enter()
+            return bcd
         return None
 
     def get_write_id(self) -> int:
@@ -157,7 +624,7 @@ class BackendConnection:
     def get_by_id(self, id) -> Union[BackendConnectionData, None]:
         b = self._rd.get_by_id(id)
         if b is not None:
-            return pickle.loads(b)
+            return BackendConnectionData.loads(b)
         return None
 
     def wait_for_read(self, timeout : float) -> bool:
@@ -170,7 +637,163 @@ class BackendConnection:
         """
         if fully readed by receiver side minus buffer_size
         """
-        return self._rd.get_read_id() >= (self._rd.get_write_id() - buffer_size)
+        return self._rd.is_consumed(buffer_size)
+
+    def wait_for_full_read(self, buffer_size=0, timeout : float = None) -> bool:
+        """
+        wait until fully readed by receiver side minus buffer_size
+
+        returns True if fully readed, False on timeout
+        """
+        return self._rd.wait_for_consumed(buffer_size, timeout)
+
+
+class BackendReorderConnection:
+    """
+    BackendConnection which restores the order of the data by sequence number on read side,
+    see BackendConnection(sequence=True), or by uid if the data has no sequence number.
+
+    Should be used as input of the backend after replicated backends,
+    because the replicas write the frames in order of completion.
+
+        bc              BackendConnection
+
+        window_size     max amount of buffered frames waiting for the late frame
+
+        max_lateness    max time in sec to wait for the late frame
+
+    The late frame is skipped if window_size or max_lateness is exceeded,
+    and dropped if it arrives after the next frames are read.
+    The first frame is held for max_lateness as well, because the frames before it may be late.
+    """
+    def __init__(self, bc : BackendConnection, window_size : int = 8, max_lateness : float = 0.100):
+        self._bc = bc
+        self._window_size = window_size
+        self._max_lateness = max_lateness
+
+        self._last_uid = None
+        self._pending : Dict[int, BackendConnectionData] = {}
+        self._pending_t = None
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_last_uid'] = None
+        d['_pending'] = {}
+        d['_pending_t'] = None
+        return d
+
+    @staticmethod
+    def _get_order_num(bcd : BackendConnectionData) -> int:
+        seq_num = bcd.get_seq_num()
+        return bcd.get_uid() if seq_num is None else seq_num
+
+    def _add(self, bcd : BackendConnectionData):
+        uid = self._get_order_num(bcd)
+        last_uid = self._last_uid
+        if last_uid is not None and uid < last_uid:
+            if last_uid - uid <= self._window_size:
+                # late frame, drop
+                return
+            # source is restarted, reset the order
+            self._last_uid = None
+            self._pending = {}
+
+        if len(self._pending) == 0:
+            self._pending_t = lib_time.mono_timestamp()
+        self._pending[uid] = bcd
+
+    def _pop(self) -> Union[BackendConnectionData, None]:
+        pending = self._pending
+        if len(pending) == 0:
+            return None
+
+        last_uid = self._last_uid
+        uid = min(pending.keys())
+
+        if last_uid is None or uid > last_uid+1:
+            # wait for the late frame
+            if len(pending) < self._window_size and \
+               lib_time.mono_timestamp() - self._pending_t < self._max_lateness:
+                return None
+
+        # reemitted frame has the same uid, if there is no sequence number
+        self._last_uid = uid if last_uid is None else max(uid, last_uid)
+        bcd = pending.pop(uid)
+        self._pending_t = lib_time.mono_timestamp()
+
+        bcd.trace_exit('Reorder')
+        bcd.trace_write()
+        bcd.trace_enter()
+        return bcd
+
+    def write(self, bcd : BackendConnectionData):
+        self._bc.write(bcd)
+
+    def read(self, timeout : float = 0) -> Union[BackendConnectionData, None]:
+        bcd = self._pop()
+        if bcd is not None:
+            return bcd
+
+        bcd = self._bc.read(timeout=timeout if len(self._pending) == 0 else min(timeout, 0.001))
+        while bcd is not None:
+            self._add(bcd)
+            bcd = self._bc.read()
+        return self._pop()
+
+    def get_write_id(self) -> int: return self._bc.get_write_id()
+    def get_by_id(self, id) -> Union[BackendConnectionData, None]: return self._bc.get_by_id(id)
+    def wait_for_read(self, timeout : float) -> bool: return len(self._pending) != 0 or self._bc.wait_for_read(timeout)
+    def is_full_read(self, buffer_size=0) -> bool: return self._bc.is_full_read(buffer_size)
+    def wait_for_full_read(self, buffer_size=0, timeout : float = None) -> bool: return self._bc.wait_for_full_read(buffer_size, timeout)
+
+
+class BackendLocalConnection:
+    """
+    BackendConnection between the backends running in the same process (lib_csw.WorkerGroup).
+
+    The data is passed as is without encoding.
+    Only the ids are mirrored to the ring in shared memory,
+    thus get_write_id/is_full_read work in other processes as usual,
+    get_by_id returns the recently written data only in the process of the group.
+
+    Waits never block, because the reader ticks in the same thread after the writer.
+    """
+    def __init__(self, history_size : int = 8):
+        self._rd = lib_mp.MPSPSCMRRingData(table_size=8192, heap_size_mb=1)
+        self._queue = deque()
+        # (write id, bcd)
+        self._history = deque(maxlen=history_size)
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_queue'] = deque()
+        d['_history'] = deque(maxlen=self._history.maxlen)
+        return d
+
+    def write(self, bcd : BackendConnectionData):
+        bcd.trace_write()
+        # the ring requires non empty data
+        self._rd.write(b'\x00')
+        self._queue.append(bcd)
+        self._history.append( (self._rd.get_write_id(), bcd) )
+
+    def read(self, timeout : float = 0) -> Union[BackendConnectionData, None]:
+        if len(self._queue) != 0:
+            bcd = self._queue.popleft()
+            self._rd.skip()
+            bcd.trace_enter()
+            return bcd
+        return None
+
+    def get_write_id(self) -> int: return self._rd.get_write_id()
+    def get_by_id(self, id) -> Union[BackendConnectionData, None]:
+        for write_id, bcd in self._history:
+            if write_id == id:
+                return bcd
+        return None
+    def wait_for_read(self, timeout : float) -> bool: return len(self._queue) != 0
+    def is_full_read(self, buffer_size=0) -> bool: return self._rd.is_consumed(buffer_size)
+    def wait_for_full_read(self, buffer_size=0, timeout : float = None) -> bool: return self._rd.is_consumed(buffer_size)
 
 
 class BackendSignal:
@@ -186,6 +809,68 @@ class BackendSignal:
             self._ev.clear()
         return is_set
 
+    def wait(self, timeout : float) -> bool:
+        """
+        wait for the signal without receiving it
+
+        returns True if the signal is sent
+        """
+        return self._ev.wait(timeout)
+
+class BackendStageCache:
+    """
+    Cache of the outputs of the stage for the reemitted frames.
+
+    The output is keyed by uid of the input BackendConnectionData and the state of the stage,
+    and is stored with the content of the input, thus a reemitted frame reuses the output
+    if neither the stage nor the previous stages were changed.
+
+        max_count   max number of cached outputs
+    """
+
+    def __init__(self, max_count : int = 4):
+        self._max_count = max_count
+        # key : (input content, output content)
+        self._outputs = OrderedDict()
+
+    def clear(self):
+        self._outputs.clear()
+
+    def get_key(self, bcd : BackendConnectionData, state_key : bytes):
+        """
+        returns cache key of the input bcd
+        """
+        return (bcd.get_uid(), state_key)
+
+    def restore(self, key, input_content : bytes, bcd : BackendConnectionData) -> bool:
+        """
+        load the cached output for key to bcd, if it was processed from the same input_content
+
+        returns False if the output is not cached or its data is overwritten in the weak heap
+        """
+        contents = self._outputs.get(key, None)
+        if contents is None or contents[0] != input_content:
+            return False
+
+        bcd.load_content(contents[1])
+        if not bcd.is_weak_heap_valid():
+            bcd.load_content(input_content)
+            self._outputs.pop(key)
+            return False
+
+        self._outputs.move_to_end(key)
+        return True
+
+    def store(self, key, input_content : bytes, bcd : BackendConnectionData):
+        """
+        store the output bcd processed from the input_content with key
+        """
+        self._outputs[key] = (input_content, bcd.dump_content())
+        self._outputs.move_to_end(key)
+        while len(self._outputs) > self._max_count:
+            self._outputs.popitem(last=False)
+
+
 class BackendWeakHeap(lib_mp.MPWeakHeap):
     ...
 
@@ -195,6 +880,19 @@ class BackendDB(lib_csw.DB):
 class BackendWorkerState(lib_csw.WorkerState):
     ...
 
+class BackendWorkerGroup(lib_csw.WorkerGroup):
+    def __init__(self, name : str):
+        """
+            name    name of the process in thread allocation
+        """
+        super().__init__()
+        self._name = name
+
+    def get_name(self) -> str: return self._name
+
+def _get_thread_allocation_name(stage_name : str, replica_id : int) -> str:
+    return stage_name if replica_id == 0 else f'{stage_name}#{replica_id}'
+
 class BackendHost(lib_csw.Host):
     def __init__(self, backend_db : BackendDB = None,
                        sheet_cls = None,
@@ -213,21 +911,177 @@ class BackendHost(lib_csw.Host):
         self._profile_timing_evl = EventListener()
         self.call_on_msg('_profile_timing', self._on_profile_timing_msg)
 
+        self._latency_report_evl = EventListener()
+        self.call_on_msg('_latency_report', self._on_latency_report_msg)
+
+        self._replicas : List[BackendHost] = []
+
     def _on_profile_timing_msg(self, timing : float):
         self._profile_timing_evl.call(timing)
 
+    def _on_latency_report_msg(self, report : Dict[str, Tuple[float, float, float]]):
+        self._latency_report_evl.call(report)
+
     def call_on_profile_timing(self, func_or_list):
         self._profile_timing_evl.add(func_or_list)
 
+    def add_replica(self, replica : 'BackendHost'):
+        """
+        Add replica of this backend to process the frames in parallel.
+
+            replica     BackendHost of the same class constructed with the same arguments,
+                        bc_in must be BackendConnection(multi_consumer=True),
+                        bc_out must be BackendConnection(multi_producer=True)
+
+        Replica is started/stopped with this backend, starts with the state of this backend,
+        and receives the same control messages, thus the workers have the same state.
+        Use BackendReorderConnection in the next backends to restore the order of the frames.
+        """
+        if type(replica) != type(self):
+            raise ValueError('replica must be the same class')
+        self._replicas.append(replica)
+        self._get_pmpi().add_send_mirror(replica._get_pmpi(), name_prefix='__')
+
+    def get_replicas(self) -> List['BackendHost']:
+        return self._replicas
+
+    def get_thread_allocation_names(self) -> List[str]:
+        """
+        returns names of the processes of this backend and its replicas in thread allocation,
+        see BackendWorker.apply_thread_allocation()
+        """
+        return [ _get_thread_allocation_name(self.__class__.__name__, replica_id) for replica_id in range(1+len(self._replicas)) ]
+
+    def is_stopped(self):
+        return super().is_stopped() and all(replica.is_stopped() for replica in self._replicas)
+
+    def process_messages(self):
+        super().process_messages()
+
+        for replica in self._replicas:
+            replica.process_messages()
+
+            if self.is_started():
+                if replica.is_stopped():
+                    replica._state = self.get_state()
+                    replica.start()
+            elif not self.is_starting():
+                if replica.is_started():
+                    replica.stop()
+
+    def call_on_latency_report(self, func_or_list):
+        """
+        func(report : Dict[str, Tuple[float, float, float]])
+
+        called by backends which use BackendWorker.report_latency(),
+        see BackendLatencyAggregator
+        """
+        self._latency_report_evl.add(func_or_list)
+
 class BackendWorker(lib_csw.Worker):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._profile_timing_measurer = lib_time.AverageMeasurer(samples=120)
+        self._profile_timing_start_t = None
+
+        self._stage_name = self.__class__.__name__
+        if self._stage_name.endswith('Worker'):
+            self._stage_name = self._stage_name[:-len('Worker')]
+        lib_mp.MPWeakHeap.set_process_stats_name(self._stage_name)
+
+        self._latency_aggregator = BackendLatencyAggregator()
+        self._latency_report_t = 0
+
+        self._stage_cache = BackendStageCache()
+        self._stage_cache_state_key = None
+        self._stage_cache_key = None
+        self._stage_cache_input_content = None
+
+    def get_stage_name(self) -> str:
+        """
+        name of the stage in latency trace
+        """
+        return self._stage_name
+
+    def _proc_tick(self) -> bool:
+        # the workers of lib_csw.WorkerGroup tick in one process, thus the statistics are counted for the ticking stage
+        lib_mp.MPWeakHeap.set_process_stats_name(self._stage_name)
+        return super()._proc_tick()
+
+    def apply_thread_allocation(self, replica_id : int = 0):
+        """
+        apply the thread allocation of the process of this worker, see xlib.onnxruntime.allocate_threads()
+
+            replica_id      id of the replica of the backend, see BackendHost.add_replica()
+        """
+        lib_ort.apply_thread_allocation(_get_thread_allocation_name(self._stage_name, replica_id))
+
+    def save_state(self):
+        super().save_state()
+        self._stage_cache_state_key = None
+
+    def invalidate_stage_cache(self):
+        """
+        invalidate cached outputs, if the output of the stage is changed not by the state
+        """
+        self._stage_cache.clear()
+
+    def restore_stage_cache(self, bcd : BackendConnectionData) -> bool:
+        """
+        Restore the cached output for the input bcd.
+
+        returns True if the output is restored to bcd, and the processing should be skipped,
+        otherwise the output must be stored by store_stage_cache(bcd) after the processing.
+
+        Only the reemitted frames are cached, thus the live frames are not serialized.
+        """
+        self._stage_cache_key = None
+        if not bcd.get_is_frame_reemitted():
+            return False
+
+        if self._stage_cache_state_key is None:
+            self._stage_cache_state_key = pickle.dumps(self.get_state())
+
+        key = self._stage_cache.get_key(bcd, self._stage_cache_state_key)
+        input_content = bcd.dump_content()
+        if self._stage_cache.restore(key, input_content, bcd):
+            return True
+
+        self._stage_cache_key = key
+        self._stage_cache_input_content = input_content
+        return False
+
+    def store_stage_cache(self, bcd : BackendConnectionData):
+        if self._stage_cache_key is not None:
+            self._stage_cache.store(self._stage_cache_key, self._stage_cache_input_content, bcd)
+            self._stage_cache_key = None
+            self._stage_cache_input_content = None
 
     def start_profile_timing(self):
+        self._profile_timing_start_t = lib_time.mono_timestamp()
         self._profile_timing_measurer.start()
 
-    def stop_profile_timing(self):
+    def stop_profile_timing(self, bcd : BackendConnectionData = None):
+        """
+            bcd     if specified, the stage is closed in the latency trace of bcd
+        """
+        if bcd is not None:
+            bcd.trace_exit(self._stage_name, enter_t=self._profile_timing_start_t)
         self.send_msg('_profile_timing', self._profile_timing_measurer.stop() )
 
+    def report_latency(self, bcd : BackendConnectionData, interval : float = 1.0):
+        """
+        close the stage in the latency trace of bcd, aggregate it,
+        and send the report to the host every interval seconds.
+
+        Should be used in the last stage of the chain.
+        """
+        bcd.trace_exit(self._stage_name)
+        self._latency_aggregator.add(bcd)
+
+        t = lib_time.mono_timestamp()
+        if t - self._latency_report_t >= interval:
+            self._latency_report_t = t
+            self.send_msg('_latency_report', self._latency_aggregator.get_report() )
+
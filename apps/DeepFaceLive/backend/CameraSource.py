@@ -7,7 +7,7 @@ from typing import List
 import cv2
 import numpy as np
 from xlib import os as lib_os
-from xlib.image import ImageProcessor
+from xlib.image import ImageArena, ImageProcessor
 from xlib.mp import csw as lib_csw
 
 from .BackendBase import (BackendConnection, BackendConnectionData, BackendDB,
@@ -83,6 +83,8 @@ class CameraSourceWorker(BackendWorker):
         self.pending_bcd = None
         self.vcap = None
         self.last_timestamp = 0
+        # the frame is copied to weak_heap, thus the buffers are reused
+        self.image_arena = ImageArena()
         lib_os.set_timer_resolution(4)
 
         state, cs = self.get_state(), self.get_control_sheet()
@@ -247,7 +249,7 @@ class CameraSourceWorker(BackendWorker):
                         else:
                             self.last_timestamp += 1.0 / fps
 
-                    ip = ImageProcessor(img)
+                    ip = ImageProcessor(img, arena=self.image_arena)
                     ip.ch(3).to_uint8()
 
                     w, h = _ResolutionType_wh[state.resolution]
@@ -267,6 +269,7 @@ class CameraSourceWorker(BackendWorker):
                     img = ip.get_image('HWC')
 
                     bcd_uid = self.bcd_uid = self.bcd_uid + 1
+                    self.weak_heap.count_frame()
                     bcd = BackendConnectionData(uid=bcd_uid)
 
                     bcd.assign_weak_heap(self.weak_heap)
@@ -275,15 +278,17 @@ class CameraSourceWorker(BackendWorker):
                     bcd.set_frame_num(bcd_uid)
                     bcd.set_frame_timestamp(timestamp)
                     bcd.set_image(frame_name, img)
-                    self.stop_profile_timing()
+                    self.stop_profile_timing(bcd)
                     self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
 
-        time.sleep(0.001)
+        if self.vcap is None:
+            # vcap.read() waits for the next frame itself, thus sleep only if there is no device
+            time.sleep(0.005)
 
     def set_vcap(self, vcap):
         if self.vcap is not None:
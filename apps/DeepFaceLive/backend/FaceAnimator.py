@@ -1,4 +1,3 @@
-import time
 from pathlib import Path
 
 import numpy as np
@@ -48,6 +47,7 @@ class FaceAnimatorWorker(BackendWorker):
         self.driving_ref_motion = None
 
         lib_os.set_timer_resolution(1)
+        self.apply_thread_allocation()
 
         state, cs = self.get_state(), self.get_control_sheet()
 
@@ -130,6 +130,7 @@ class FaceAnimatorWorker(BackendWorker):
 
     def on_cs_reset_reference_pose(self):
         self.driving_ref_motion = None
+        self.invalidate_stage_cache()
         self.reemit_frame_signal.send()
 
     def on_tick(self):
@@ -142,35 +143,35 @@ class FaceAnimatorWorker(BackendWorker):
             if bcd is not None:
                 bcd.assign_weak_heap(self.weak_heap)
 
-                lia_model = self.lia_model
-                if lia_model is not None and self.animatable_img is not None:
+                if not self.restore_stage_cache(bcd):
+                    lia_model = self.lia_model
+                    if lia_model is not None and self.animatable_img is not None:
 
-                    for i, fsi in enumerate(bcd.get_face_swap_info_list()):
-                        if state.animator_face_id == i:
-                            face_align_image = bcd.get_image(fsi.face_align_image_name)
-                            if face_align_image is not None:
+                        for i, fsi in enumerate(bcd.get_face_swap_info_list()):
+                            if state.animator_face_id == i:
+                                face_align_image = bcd.get_image(fsi.face_align_image_name)
+                                if face_align_image is not None:
 
-                                _,H,W,_ = ImageProcessor(face_align_image).get_dims()
+                                    _,H,W,_ = ImageProcessor(face_align_image).get_dims()
 
-                                if self.driving_ref_motion is None:
-                                    self.driving_ref_motion = lia_model.extract_motion(face_align_image)
+                                    if self.driving_ref_motion is None:
+                                        self.driving_ref_motion = lia_model.extract_motion(face_align_image)
 
-                                anim_image = lia_model.generate(self.animatable_img, face_align_image, self.driving_ref_motion, power=state.relative_power)
-                                anim_image = ImageProcessor(anim_image).resize((W,H)).get_image('HWC')
+                                    anim_image = lia_model.generate(self.animatable_img, face_align_image, self.driving_ref_motion, power=state.relative_power)
+                                    anim_image = ImageProcessor(anim_image).resize((W,H)).get_image('HWC')
 
-                                fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
-                                bcd.set_image(fsi.face_swap_image_name, anim_image)
-                            break
+                                    fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
+                                    bcd.set_image(fsi.face_swap_image_name, anim_image)
+                                break
+                    self.store_stage_cache(bcd)
 
-                self.stop_profile_timing()
+                self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 class Sheet:
     class Host(lib_csw.Sheet.Host):
@@ -1,8 +1,8 @@
-import time
 from enum import IntEnum
 
 import numpy as np
 from modelhub import onnx as onnx_models
+from xlib import onnxruntime as lib_ort
 from xlib import os as lib_os
 from xlib.face import FRect
 from xlib.image import ImageProcessor
@@ -38,14 +38,15 @@ class FaceDetector(BackendHost):
                         reemit_frame_signal : BackendSignal,
                         bc_in : BackendConnection,
                         bc_out : BackendConnection,
-                        backend_db : BackendDB = None):
+                        backend_db : BackendDB = None,
+                        inference_server_client : lib_ort.InferenceServerClient = None):
         self._weak_heap = weak_heap
         self._bc_out = bc_out
         super().__init__(backend_db=backend_db,
                          sheet_cls=Sheet,
                          worker_cls=FaceDetectorWorker,
                          worker_state_cls=WorkerState,
-                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out] )
+                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, inference_server_client] )
 
     def get_control_sheet(self) -> 'Sheet.Host': return super().get_control_sheet()
 
@@ -58,7 +59,8 @@ class FaceDetectorWorker(BackendWorker):
 
     def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal,
                        bc_in : BackendConnection,
-                       bc_out : BackendConnection):
+                       bc_out : BackendConnection,
+                       inference_server_client : lib_ort.InferenceServerClient):
 
         self.weak_heap = weak_heap
         self.reemit_frame_signal = reemit_frame_signal
@@ -67,11 +69,15 @@ class FaceDetectorWorker(BackendWorker):
         self.pending_bcd = None
 
         self.temporal_rects = []
+        self.track_rects = []
+        self.track_frames = 0
         self.CenterFace = None
         self.S3FD = None
         self.YoloV5Face = None
 
         lib_os.set_timer_resolution(1)
+        self.apply_thread_allocation()
+        lib_ort.set_inference_server_client(inference_server_client)
 
         state, cs = self.get_state(), self.get_control_sheet()
         cs.detector_type.call_on_selected(self.on_cs_detector_type)
@@ -81,6 +87,7 @@ class FaceDetectorWorker(BackendWorker):
         cs.max_faces.call_on_number(self.on_cs_max_faces)
         cs.sort_by.call_on_selected(self.on_cs_sort_by)
         cs.temporal_smoothing.call_on_number(self.on_cs_temporal_smoothing)
+        cs.detect_every.call_on_number(self.on_cs_detect_every)
 
         cs.detector_type.enable()
         cs.detector_type.set_choices(DetectorType, DetectorTypeNames, none_choice_name=None)
@@ -142,6 +149,10 @@ class FaceDetectorWorker(BackendWorker):
                 cs.temporal_smoothing.set_config(lib_csw.Number.Config(min=1, max=150, step=1, allow_instant_update=True))
                 cs.temporal_smoothing.set_number(detector_state.temporal_smoothing if detector_state.temporal_smoothing is not None else 1)
 
+                cs.detect_every.enable()
+                cs.detect_every.set_config(lib_csw.Number.Config(min=1, max=60, step=1, allow_instant_update=True))
+                cs.detect_every.set_number(detector_state.detect_every if detector_state.detect_every is not None else 1)
+
             if detector_type == DetectorType.CENTER_FACE:
                 self.CenterFace = onnx_models.CenterFace(device)
             elif detector_type == DetectorType.S3FD:
@@ -200,6 +211,50 @@ class FaceDetectorWorker(BackendWorker):
         self.save_state()
         self.reemit_frame_signal.send()
 
+    def on_cs_detect_every(self, detect_every):
+        state, cs = self.get_state(), self.get_control_sheet()
+        cfg = cs.detect_every.get_config()
+        detect_every = state.get_detector_state().detect_every = int(np.clip(detect_every, cfg.min, cfg.max))
+        self.track_rects = []
+        cs.detect_every.set_number(detect_every)
+        self.save_state()
+        self.reemit_frame_signal.send()
+
+    def _extract(self, img, threshold, fixed_window):
+        detector_type = self.get_state().detector_type
+        if detector_type == DetectorType.CENTER_FACE:
+            return self.CenterFace.extract (img, threshold=threshold, fixed_window=fixed_window)
+        elif detector_type == DetectorType.S3FD:
+            return self.S3FD.extract (img, threshold=threshold, fixed_window=fixed_window)
+        elif detector_type == DetectorType.YOLOV5:
+            return self.YoloV5Face.extract (img, threshold=threshold, fixed_window=fixed_window)
+
+    def _track(self, frame_image, threshold):
+        """
+        Detects faces only inside expanded windows around the rects of the previous frame.
+        All windows are detected as a single batch.
+
+        returns list of FRect in the order of self.track_rects,
+                or None if any face is lost
+        """
+        roi_size = 192
+
+        rois, uni_mats = [], []
+        for rect in self.track_rects:
+            roi, uni_mat = rect.cut(frame_image, coverage=2.0, output_size=roi_size)
+            rois.append(roi)
+            uni_mats.append(uni_mat)
+
+        rects = []
+        for rect, uni_mat, roi_rects in zip(self.track_rects, uni_mats, self._extract(np.stack(rois), threshold, roi_size) ):
+            if len(roi_rects) == 0:
+                return None
+
+            roi_rects = [ FRect.from_ltrb( (l/roi_size, t/roi_size, r/roi_size, b/roi_size) ).transform(uni_mat, invert=True) for l,t,r,b in roi_rects ]
+            # the face closest to the previous position
+            rects.append( FRect.sort_by_dist_from_2D_point(roi_rects, *rect.get_center_point())[0] )
+        return rects
+
 
     def on_tick(self):
         state, cs = self.get_state(), self.get_control_sheet()
@@ -219,71 +274,80 @@ class FaceDetectorWorker(BackendWorker):
 
                     detector_state = state.get_detector_state()
 
-                    frame_image_name = bcd.get_frame_image_name()
-                    frame_image = bcd.get_image(frame_image_name)
-
-                    if frame_image is not None:
-                        _,H,W,_ = ImageProcessor(frame_image).get_dims()
-
-                        rects = []
-                        if detector_type == DetectorType.CENTER_FACE:
-                            rects = self.CenterFace.extract (frame_image, threshold=detector_state.threshold, fixed_window=detector_state.fixed_window_size)[0]
-                        elif detector_type == DetectorType.S3FD:
-                            rects = self.S3FD.extract (frame_image, threshold=detector_state.threshold, fixed_window=detector_state.fixed_window_size)[0]
-                        elif detector_type == DetectorType.YOLOV5:
-                            rects = self.YoloV5Face.extract (frame_image, threshold=detector_state.threshold, fixed_window=detector_state.fixed_window_size)[0]
-
-                        # to list of FaceURect
-                        rects = [ FRect.from_ltrb( (l/W, t/H, r/W, b/H) ) for l,t,r,b in rects ]
-
-                        # sort
-                        if detector_state.sort_by == FaceSortBy.LARGEST:
-                            rects = FRect.sort_by_area_size(rects)
-                        elif detector_state.sort_by == FaceSortBy.DIST_FROM_CENTER:
-                            rects = FRect.sort_by_dist_from_2D_point(rects, 0.5, 0.5)
-                        elif detector_state.sort_by == FaceSortBy.LEFT_RIGHT:
-                            rects = FRect.sort_by_dist_from_horizontal_point(rects, 0)
-                        elif detector_state.sort_by == FaceSortBy.RIGHT_LEFT:
-                            rects = FRect.sort_by_dist_from_horizontal_point(rects, 1)
-                        elif detector_state.sort_by == FaceSortBy.TOP_BOTTOM:
-                            rects = FRect.sort_by_dist_from_vertical_point(rects, 0)
-                        elif detector_state.sort_by == FaceSortBy.BOTTOM_TOP:
-                            rects = FRect.sort_by_dist_from_vertical_point(rects, 1)
-
-                        if len(rects) != 0:
-                            max_faces = detector_state.max_faces
-                            if max_faces != 0 and len(rects) > max_faces:
-                                rects = rects[:max_faces]
-
-                            if detector_state.temporal_smoothing != 1:
-                                if len(self.temporal_rects) != len(rects):
-                                    self.temporal_rects = [ [] for _ in range(len(rects)) ]
-
-                            for face_id, face_urect in enumerate(rects):
+                    if not self.restore_stage_cache(bcd):
+                        frame_image_name = bcd.get_frame_image_name()
+                        frame_image = bcd.get_image(frame_image_name)
+
+                        if frame_image is not None:
+                            _,H,W,_ = ImageProcessor(frame_image).get_dims()
+
+                            rects = None
+
+                            detect_every = detector_state.detect_every or 1
+                            if detect_every != 1 and not is_frame_reemitted and \
+                               len(self.track_rects) != 0 and self.track_frames < detect_every-1:
+                                # Track faces of the previous frame, full frame detection if any face is lost
+                                rects = self._track(frame_image, detector_state.threshold)
+                                if rects is not None:
+                                    self.track_frames += 1
+
+                            if rects is None:
+                                rects = self._extract(frame_image, detector_state.threshold, detector_state.fixed_window_size)[0]
+
+                                # to list of FaceURect
+                                rects = [ FRect.from_ltrb( (l/W, t/H, r/W, b/H) ) for l,t,r,b in rects ]
+                                self.track_frames = 0
+
+                            # sort
+                            if detector_state.sort_by == FaceSortBy.LARGEST:
+                                rects = FRect.sort_by_area_size(rects)
+                            elif detector_state.sort_by == FaceSortBy.DIST_FROM_CENTER:
+                                rects = FRect.sort_by_dist_from_2D_point(rects, 0.5, 0.5)
+                            elif detector_state.sort_by == FaceSortBy.LEFT_RIGHT:
+                                rects = FRect.sort_by_dist_from_horizontal_point(rects, 0)
+                            elif detector_state.sort_by == FaceSortBy.RIGHT_LEFT:
+                                rects = FRect.sort_by_dist_from_horizontal_point(rects, 1)
+                            elif detector_state.sort_by == FaceSortBy.TOP_BOTTOM:
+                                rects = FRect.sort_by_dist_from_vertical_point(rects, 0)
+                            elif detector_state.sort_by == FaceSortBy.BOTTOM_TOP:
+                                rects = FRect.sort_by_dist_from_vertical_point(rects, 1)
+
+                            if len(rects) != 0:
+                                max_faces = detector_state.max_faces
+                                if max_faces != 0 and len(rects) > max_faces:
+                                    rects = rects[:max_faces]
+
+                            self.track_rects = rects if detect_every != 1 else []
+
+                            if len(rects) != 0:
                                 if detector_state.temporal_smoothing != 1:
-                                    if not is_frame_reemitted or len(self.temporal_rects[face_id]) == 0:
-                                        self.temporal_rects[face_id].append( face_urect.as_4pts() )
+                                    if len(self.temporal_rects) != len(rects):
+                                        self.temporal_rects = [ [] for _ in range(len(rects)) ]
+
+                                for face_id, face_urect in enumerate(rects):
+                                    if detector_state.temporal_smoothing != 1:
+                                        if not is_frame_reemitted or len(self.temporal_rects[face_id]) == 0:
+                                            self.temporal_rects[face_id].append( face_urect.as_4pts() )
 
-                                    self.temporal_rects[face_id] = self.temporal_rects[face_id][-detector_state.temporal_smoothing:]
+                                        self.temporal_rects[face_id] = self.temporal_rects[face_id][-detector_state.temporal_smoothing:]
 
-                                    face_urect = FRect.from_4pts ( np.mean(self.temporal_rects[face_id],0 ) )
+                                        face_urect = FRect.from_4pts ( np.mean(self.temporal_rects[face_id],0 ) )
 
-                                if face_urect.get_area() != 0:
-                                    fsi = BackendFaceSwapInfo()
-                                    fsi.image_name = frame_image_name
-                                    fsi.face_urect = face_urect
-                                    bcd.add_face_swap_info(fsi)
+                                    if face_urect.get_area() != 0:
+                                        fsi = BackendFaceSwapInfo()
+                                        fsi.image_name = frame_image_name
+                                        fsi.face_urect = face_urect
+                                        bcd.add_face_swap_info(fsi)
+                        self.store_stage_cache(bcd)
 
-                    self.stop_profile_timing()
+                    self.stop_profile_timing(bcd)
                     self.pending_bcd = bcd
 
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 
 class Sheet:
@@ -297,6 +361,7 @@ class Sheet:
             self.threshold = lib_csw.Number.Client()
             self.max_faces = lib_csw.Number.Client()
             self.temporal_smoothing = lib_csw.Number.Client()
+            self.detect_every = lib_csw.Number.Client()
 
     class Worker(lib_csw.Sheet.Worker):
         def __init__(self):
@@ -308,6 +373,7 @@ class Sheet:
             self.threshold = lib_csw.Number.Host()
             self.max_faces = lib_csw.Number.Host()
             self.temporal_smoothing = lib_csw.Number.Host()
+            self.detect_every = lib_csw.Number.Host()
 
 class DetectorState(BackendWorkerState):
     fixed_window_size : int = None
@@ -315,6 +381,7 @@ class DetectorState(BackendWorkerState):
     max_faces : int = None
     sort_by : FaceSortBy = None
     temporal_smoothing : int = None
+    detect_every : int = None
 
 class CenterFaceState(BackendWorkerState):
     device = None
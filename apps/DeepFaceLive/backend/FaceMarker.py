@@ -1,9 +1,9 @@
-import time
 from enum import IntEnum
 import numpy as np
 from modelhub import onnx as onnx_models
 from modelhub import cv as cv_models
 
+from xlib import onnxruntime as lib_ort
 from xlib import os as lib_os
 from xlib.face import ELandmarks2D, FLandmarks2D, FPose
 from xlib.image import ImageProcessor
@@ -21,13 +21,14 @@ class MarkerType(IntEnum):
 MarkerTypeNames = ['OpenCV LBF','Google FaceMesh','InsightFace_2D106']
 
 class FaceMarker(BackendHost):
-    def __init__(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, backend_db : BackendDB = None):
+    def __init__(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, backend_db : BackendDB = None,
+                       inference_server_client : lib_ort.InferenceServerClient = None):
 
         super().__init__(backend_db=backend_db,
                          sheet_cls=Sheet,
                          worker_cls=FaceMarkerWorker,
                          worker_state_cls=WorkerState,
-                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, ] )
+                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, inference_server_client] )
 
     def get_control_sheet(self) -> 'Sheet.Host': return super().get_control_sheet()
 
@@ -39,6 +40,7 @@ class FaceMarkerWorker(BackendWorker):
     def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal,
                        bc_in : BackendConnection,
                        bc_out : BackendConnection,
+                       inference_server_client : lib_ort.InferenceServerClient,
                        ):
         self.weak_heap = weak_heap
         self.reemit_frame_signal = reemit_frame_signal
@@ -51,6 +53,8 @@ class FaceMarkerWorker(BackendWorker):
         self.temporal_lmrks = []
 
         lib_os.set_timer_resolution(1)
+        self.apply_thread_allocation()
+        lib_ort.set_inference_server_client(inference_server_client)
 
         state, cs = self.get_state(), self.get_control_sheet()
         cs.marker_type.call_on_selected(self.on_cs_marker_type)
@@ -167,59 +171,59 @@ class FaceMarkerWorker(BackendWorker):
                 is_marker_loaded = is_opencv_lbf or is_google_facemesh or is_insightface_2d106
 
                 if marker_type is not None:
-                    frame_image = bcd.get_image(bcd.get_frame_image_name())
-
-                    if frame_image is not None and is_marker_loaded:
-                        fsi_list = bcd.get_face_swap_info_list()
-                        if marker_state.temporal_smoothing != 1 and \
-                            len(self.temporal_lmrks) != len(fsi_list):
-                            self.temporal_lmrks = [ [] for _ in range(len(fsi_list)) ]
-
-                        for face_id, fsi in enumerate(fsi_list):
-                            if fsi.face_urect is not None:
-                                # Cut the face to feed to the face marker
-                                face_image, face_uni_mat = fsi.face_urect.cut(frame_image, marker_state.marker_coverage, 256 if is_opencv_lbf else \
-                                                                                                                         192 if is_google_facemesh else \
-                                                                                                                         192 if is_insightface_2d106 else 0 )
-                                _,H,W,_ = ImageProcessor(face_image).get_dims()
-                                if is_opencv_lbf:
-                                    lmrks = self.opencv_lbf.extract(face_image)[0]
-                                elif is_google_facemesh:
-                                    lmrks = self.google_facemesh.extract(face_image)[0]
-                                elif is_insightface_2d106:
-                                    lmrks = self.insightface_2d106.extract(face_image)[0]
-
-                                if marker_state.temporal_smoothing != 1:
-                                    if not is_frame_reemitted or len(self.temporal_lmrks[face_id]) == 0:
-                                        self.temporal_lmrks[face_id].append(lmrks)
-                                    self.temporal_lmrks[face_id] = self.temporal_lmrks[face_id][-marker_state.temporal_smoothing:]
-                                    lmrks = np.mean(self.temporal_lmrks[face_id],0 )
-
-                                if is_google_facemesh:
-                                    fsi.face_pose = FPose.from_3D_468_landmarks(lmrks)
-
-                                if is_opencv_lbf:
-                                    lmrks /= (W,H)
-                                elif is_google_facemesh:
-                                    lmrks = lmrks[...,0:2] / (W,H)
-                                elif is_insightface_2d106:
-                                    lmrks = lmrks[...,0:2] / (W,H)
-
-                                face_ulmrks = FLandmarks2D.create (ELandmarks2D.L68 if is_opencv_lbf else \
-                                                                   ELandmarks2D.L468 if is_google_facemesh else \
-                                                                   ELandmarks2D.L106 if is_insightface_2d106 else None, lmrks)
-                                face_ulmrks = face_ulmrks.transform(face_uni_mat, invert=True)
-                                fsi.face_ulmrks = face_ulmrks
-
-                    self.stop_profile_timing()
+                    if not self.restore_stage_cache(bcd):
+                        frame_image = bcd.get_image(bcd.get_frame_image_name())
+
+                        if frame_image is not None and is_marker_loaded:
+                            fsi_list = bcd.get_face_swap_info_list()
+                            if marker_state.temporal_smoothing != 1 and \
+                                len(self.temporal_lmrks) != len(fsi_list):
+                                self.temporal_lmrks = [ [] for _ in range(len(fsi_list)) ]
+
+                            for face_id, fsi in enumerate(fsi_list):
+                                if fsi.face_urect is not None:
+                                    # Cut the face to feed to the face marker
+                                    face_image, face_uni_mat = fsi.face_urect.cut(frame_image, marker_state.marker_coverage, 256 if is_opencv_lbf else \
+                                                                                                                             192 if is_google_facemesh else \
+                                                                                                                             192 if is_insightface_2d106 else 0 )
+                                    _,H,W,_ = ImageProcessor(face_image).get_dims()
+                                    if is_opencv_lbf:
+                                        lmrks = self.opencv_lbf.extract(face_image)[0]
+                                    elif is_google_facemesh:
+                                        lmrks = self.google_facemesh.extract(face_image)[0]
+                                    elif is_insightface_2d106:
+                                        lmrks = self.insightface_2d106.extract(face_image)[0]
+
+                                    if marker_state.temporal_smoothing != 1:
+                                        if not is_frame_reemitted or len(self.temporal_lmrks[face_id]) == 0:
+                                            self.temporal_lmrks[face_id].append(lmrks)
+                                        self.temporal_lmrks[face_id] = self.temporal_lmrks[face_id][-marker_state.temporal_smoothing:]
+                                        lmrks = np.mean(self.temporal_lmrks[face_id],0 )
+
+                                    if is_google_facemesh:
+                                        fsi.face_pose = FPose.from_3D_468_landmarks(lmrks)
+
+                                    if is_opencv_lbf:
+                                        lmrks /= (W,H)
+                                    elif is_google_facemesh:
+                                        lmrks = lmrks[...,0:2] / (W,H)
+                                    elif is_insightface_2d106:
+                                        lmrks = lmrks[...,0:2] / (W,H)
+
+                                    face_ulmrks = FLandmarks2D.create (ELandmarks2D.L68 if is_opencv_lbf else \
+                                                                       ELandmarks2D.L468 if is_google_facemesh else \
+                                                                       ELandmarks2D.L106 if is_insightface_2d106 else None, lmrks)
+                                    face_ulmrks = face_ulmrks.transform(face_uni_mat, invert=True)
+                                    fsi.face_ulmrks = face_ulmrks
+                        self.store_stage_cache(bcd)
+
+                    self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 class MarkerState(BackendWorkerState):
     marker_coverage : float = None
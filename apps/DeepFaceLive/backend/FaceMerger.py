@@ -1,11 +1,10 @@
-import time
 
 import cv2
 import numexpr as ne
 import numpy as np
 from xlib import avecl as lib_cl
 from xlib import os as lib_os
-from xlib.image import ImageProcessor
+from xlib.image import ImageArena, ImageProcessor
 from xlib.image import color_transfer as lib_ct
 from xlib.mp import csw as lib_csw
 from xlib.python import all_is_not_None
@@ -37,6 +36,10 @@ class FaceMergerWorker(BackendWorker):
         self.bc_out = bc_out
         self.pending_bcd = None
         self.out_merged_frame = None
+        self.frame_lut = None
+        self.frame_lut_key = None
+        # merged frame is copied to weak_heap, thus the buffers are reused
+        self.image_arena = ImageArena()
 
         lib_os.set_timer_resolution(1)
 
@@ -113,6 +116,11 @@ class FaceMergerWorker(BackendWorker):
             cs.face_opacity.enable()
             cs.face_opacity.set_config(lib_csw.Number.Config(min=0.0, max=1.0, step=0.01, decimals=2, allow_instant_update=True))
             cs.face_opacity.set_number(state.face_opacity if state.face_opacity is not None else 1.0)
+
+            cs.output_format.call_on_selected(self.on_cs_output_format)
+            cs.output_format.enable()
+            cs.output_format.set_choices(['uint8','float32'], none_choice_name=None)
+            cs.output_format.select(state.output_format if state.output_format is not None else 'uint8')
         else:
             state.device = device
             self.save_state()
@@ -188,6 +196,12 @@ class FaceMergerWorker(BackendWorker):
         self.save_state()
         self.reemit_frame_signal.send()
 
+    def on_cs_output_format(self, idx, output_format):
+        state, cs = self.get_state(), self.get_control_sheet()
+        state.output_format = output_format
+        self.save_state()
+        self.reemit_frame_signal.send()
+
     def on_cs_color_compression(self, color_compression):
         state, cs = self.get_state(), self.get_control_sheet()
         cfg = cs.color_compression.get_config()
@@ -204,59 +218,182 @@ class FaceMergerWorker(BackendWorker):
         self.save_state()
         self.reemit_frame_signal.send()
 
+    @staticmethod
+    def _get_frame_roi(aligned_to_source_mat, face_width, face_height, frame_width, frame_height):
+        """
+        returns (l,t,r,b) rect of the frame covered by the warped face,
+        r <= l or b <= t if the face is out of the frame
+        """
+        pts = aligned_to_source_mat.transform_points( [(0,0), (face_width,0), (0,face_height), (face_width,face_height)] )
+        # + pixels reached by the interpolation
+        l, t = (np.floor(pts.min(0)) - 2).astype(np.int32).tolist()
+        r, b = (np.ceil(pts.max(0)) + 2).astype(np.int32).tolist()
+        return max(0, l), max(0, t), min(frame_width, r), min(frame_height, b)
+
+    @staticmethod
+    def _get_roi_mat(aligned_to_source_mat, l, t):
+        """
+        returns mat to the frame cropped at l,t
+        """
+        roi_mat = np.array(aligned_to_source_mat, np.float64)
+        roi_mat[:,2] -= (l, t)
+        return roi_mat
+
+    def _color_compression(self, frame_image):
+        """
+        apply color compression to whole frame in place
+        """
+        state = self.get_state()
+        color_compression = max(4, (127.0 - state.color_compression) )
+        frame_image *= color_compression
+        np.floor(frame_image, out=frame_image)
+        frame_image /= color_compression
+        frame_image += 2.0 / color_compression
+
     _cpu_interp = {'bilinear' : ImageProcessor.Interpolation.LINEAR,
                    'bicubic'  : ImageProcessor.Interpolation.CUBIC,
                    'lanczos4' : ImageProcessor.Interpolation.LANCZOS4}
-    def _merge_on_cpu(self, frame_image, face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat, frame_width, frame_height, do_color_compression ):
+
+    def _get_face_layers_cpu(self, face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat, l, t, r, b):
+        """
+        returns (mask HW1, swapped face HWC) float32 of the face warped to (l,t,r,b) rect of the frame
+        """
         state = self.get_state()
 
         interpolation = self._cpu_interp[state.interpolation]
 
-        frame_image = ImageProcessor(frame_image).to_ufloat32().get_image('HWC')
-
         masks = []
         if state.face_mask_source:
-            masks.append( ImageProcessor(face_align_mask_img).to_ufloat32().get_image('HW') )
+            masks.append(face_align_mask_img)
         if state.face_mask_celeb:
-            masks.append( ImageProcessor(face_swap_mask_img).to_ufloat32().get_image('HW') )
+            masks.append(face_swap_mask_img)
         if state.face_mask_lmrks:
-            masks.append( ImageProcessor(face_align_lmrks_mask_img).to_ufloat32().get_image('HW') )
+            masks.append(face_align_lmrks_mask_img)
 
         masks_count = len(masks)
         if masks_count == 0:
             face_mask = np.ones(shape=(face_resolution, face_resolution), dtype=np.float32)
         else:
-            face_mask = masks[0]
-            for i in range(1, masks_count):
-                face_mask *= masks[i]
+            # multiply the masks and binarize in one pass, the same as _n_mask_multiply_op_text of GPU path
+            local_dict = { f'm{i}' : ImageProcessor(mask).get_image('HW') for i, mask in enumerate(masks) }
+            local_dict['k'] = np.float32(np.prod([ 1.0/255.0 if mask.dtype == np.uint8 else 1.0 for mask in masks ]))
+            expr = f"where({'*'.join(local_dict.keys())} > 0.5, one, zero)"
+            local_dict['one'], local_dict['zero'] = np.float32(1.0), np.float32(0.0)
+            face_mask = ne.evaluate(expr, local_dict=local_dict, casting='unsafe').astype(np.float32, copy=False)
 
         # Combine face mask
         face_mask = ImageProcessor(face_mask).erode_blur(state.face_mask_erode, state.face_mask_blur, fade_to_border=True).get_image('HWC')
-        frame_face_mask = ImageProcessor(face_mask).warp_affine(aligned_to_source_uni_mat, frame_width, frame_height).clip2( (1.0/255.0), 0.0, 1.0, 1.0).get_image('HWC')
+
+        roi_mat = self._get_roi_mat(aligned_to_source_uni_mat, l, t)
+
+        frame_face_mask = ImageProcessor(face_mask).warp_affine(roi_mat, r-l, b-t).clip2( (1.0/255.0), 0.0, 1.0, 1.0).get_image('HWC')
 
         face_swap_ip = ImageProcessor(face_swap_img).to_ufloat32()
 
-        if state.color_transfer == 'rct':            
+        if state.color_transfer == 'rct':
             face_swap_img = face_swap_ip.rct(like=face_align_img, mask=face_mask, like_mask=face_mask)
 
-        frame_face_swap_img = face_swap_ip.warp_affine(aligned_to_source_uni_mat, frame_width, frame_height, interpolation=interpolation).get_image('HWC')
+        frame_face_swap_img = face_swap_ip.warp_affine(roi_mat, r-l, b-t, interpolation=interpolation).get_image('HWC')
 
-        # Combine final frame
-        opacity = np.float32(state.face_opacity)
-        one_f = np.float32(1.0)
-        if opacity == 1.0:
-            out_merged_frame = ne.evaluate('frame_image*(one_f-frame_face_mask) + frame_face_swap_img*frame_face_mask')
-        else:
-            out_merged_frame = ne.evaluate('frame_image*(one_f-frame_face_mask) + frame_image*frame_face_mask*(one_f-opacity) + frame_face_swap_img*frame_face_mask*opacity')
+        return frame_face_mask, frame_face_swap_img
+
+    def _get_frame_lut(self):
+        """
+        returns uint8 -> uint8 LUT of color compression and quantization of the frame
+        computed the same way as for the float frame
+        """
+        state = self.get_state()
+        key = state.color_compression
+        if self.frame_lut_key != key:
+            lut = ImageProcessor(np.arange(256, dtype=np.uint8)[:,None,None]).to_ufloat32().get_image('HWC')
+            if state.color_compression != 0:
+                self._color_compression(lut)
+            self.frame_lut = ImageProcessor(lut).to_uint8().get_image('HWC').reshape(256)
+            self.frame_lut_key = key
+        return self.frame_lut
+
+    def _merge_on_cpu(self, frame_image, faces):
+        """
+        merges the faces to frame_image
+
+         faces  list of (face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img,
+                         face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat)
+
+        returns HWC merged frame of output format, color compressed
+
+        Fused kernels multithreaded by numexpr/cv2 write every pixel of the result once:
+        the frame is color compressed and converted in one pass,
+        then the rects covered by the faces are blended, color compressed and converted in one pass.
+        """
+        state = self.get_state()
+
+        frame_image = ImageProcessor(frame_image).ch(3).get_image('HWC')
+        frame_height, frame_width = frame_image.shape[:2]
+        out_dtype = np.uint8 if state.output_format == 'uint8' else np.float32
 
-        if do_color_compression and state.color_compression != 0:
-            color_compression = max(4, (127.0 - state.color_compression) )
-            out_merged_frame *= color_compression
-            np.floor(out_merged_frame, out=out_merged_frame)
-            out_merged_frame /= color_compression
-            out_merged_frame += 2.0 / color_compression
+        # merged frame is copied to weak_heap, thus the buffer is reused
+        out = self.out_merged_frame
+        if out is None or out.shape != frame_image.shape or out.dtype != out_dtype:
+            out = self.out_merged_frame = np.empty(frame_image.shape, out_dtype)
 
-        return out_merged_frame
+        is_cc = state.color_compression != 0
+        color_compression = np.float32(max(4, (127.0 - state.color_compression) ))
+
+        def get_kernel(value_expr):
+            if is_cc:
+                value_expr = f'floor(({value_expr})*c)/c + cc_add'
+            if out_dtype == np.uint8:
+                value_expr = f'({value_expr})*f32_255'
+                value_expr = f'where({value_expr} > f32_255, f32_255, where({value_expr} < f32_0, f32_0, {value_expr}))'
+            return value_expr
+
+        local_dict = {'c' : color_compression, 'cc_add' : np.float32(2.0) / color_compression,
+                      'f32_0' : np.float32(0.0), 'f32_1' : np.float32(1.0), 'f32_255' : np.float32(255.0),
+                      'opacity' : np.float32(state.face_opacity) }
+
+        frame_scale = np.float32(1.0/255.0) if frame_image.dtype == np.uint8 else np.float32(1.0)
+
+        if frame_image.dtype == np.uint8 and out_dtype == np.uint8:
+            cv2.LUT(frame_image, self._get_frame_lut(), dst=out)
+        else:
+            ne.evaluate(get_kernel('f*f_scale'), local_dict=dict(local_dict, f=frame_image, f_scale=frame_scale), out=out, casting='unsafe')
+
+        # faces with intersected rects are blended in the union of the rects in order
+        groups = []
+        for face_id, face in enumerate(faces):
+            face_height, face_width = face[1].shape[:2]
+            l,t,r,b = self._get_frame_roi(face[-1], face_width, face_height, frame_width, frame_height)
+            if l >= r or t >= b:
+                continue
+            group_faces = [ (face_id, face) ]
+
+            # merge the groups intersecting the rect, the union can intersect the others
+            while True:
+                others = [ group for group in groups if group[0] < r and l < group[2] and group[1] < b and t < group[3] ]
+                if len(others) == 0:
+                    break
+                for gl,gt,gr,gb,gfaces in others:
+                    l,t,r,b = min(l,gl), min(t,gt), max(r,gr), max(b,gb)
+                    group_faces += gfaces
+                groups = [ group for group in groups if all(group is not other for other in others) ]
+
+            groups.append( (l,t,r,b,group_faces) )
+
+        for l,t,r,b,group_faces in groups:
+            group_faces = sorted(group_faces, key=lambda x: x[0])
+
+            img, img_scale = frame_image[t:b,l:r], frame_scale
+            for i, (_, face) in enumerate(group_faces):
+                frame_face_mask, frame_face_swap_img = self._get_face_layers_cpu(*face, l, t, r, b)
+
+                value_expr = 'f*f_scale*(f32_1-m*opacity) + s*m*opacity'
+                face_local_dict = dict(local_dict, f=img, f_scale=img_scale, m=frame_face_mask, s=frame_face_swap_img)
+                if i == len(group_faces)-1:
+                    ne.evaluate(get_kernel(value_expr), local_dict=face_local_dict, out=out[t:b,l:r], casting='unsafe')
+                else:
+                    img, img_scale = ne.evaluate(value_expr, local_dict=face_local_dict), np.float32(1.0)
+
+        return out
 
     _gpu_interp = {'bilinear' : lib_cl.EInterpolation.LINEAR,
                    'bicubic'  : lib_cl.EInterpolation.CUBIC,
@@ -264,48 +401,63 @@ class FaceMergerWorker(BackendWorker):
 
     _n_mask_multiply_op_text = [ f"float X = {'*'.join([f'(((float)I{i}) / 255.0)' for i in range(n)])}; O = (X <= 0.5 ? 0 : 1);" for n in range(5) ]
 
-    def _merge_on_gpu(self, frame_image, face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat, frame_width, frame_height, do_color_compression ):
-        state = self.get_state()
-        interpolation = self._gpu_interp[state.interpolation]
-
-        masks = []
-        if state.face_mask_source:
-            masks.append( lib_cl.Tensor.from_value(face_align_mask_img) )
-        if state.face_mask_celeb:
-            masks.append( lib_cl.Tensor.from_value(face_swap_mask_img) )
-        if state.face_mask_lmrks:
-            masks.append( lib_cl.Tensor.from_value(face_align_lmrks_mask_img) )
-
-        masks_count = len(masks)
-        if masks_count == 0:
-            face_mask_t = lib_cl.Tensor(shape=(face_resolution, face_resolution), dtype=np.float32, initializer=lib_cl.InitConst(1.0))
-        else:
-            face_mask_t = lib_cl.any_wise(FaceMergerWorker._n_mask_multiply_op_text[masks_count], *masks, dtype=np.uint8).transpose( (2,0,1) )
+    def _merge_on_gpu(self, frame_image, faces):
+        """
+        merges the faces to HWC float frame_image in place,
 
-        face_mask_t = lib_cl.binary_morph(face_mask_t, state.face_mask_erode, state.face_mask_blur, fade_to_border=True, dtype=np.float32)
-        face_swap_img_t  = lib_cl.Tensor.from_value(face_swap_img ).transpose( (2,0,1), op_text='O = ((O_TYPE)I) / 255.0', dtype=np.float32)
+         faces  list of arguments of _merge_on_cpu() except frame_image
 
-        if state.color_transfer == 'rct':
-            face_align_img_t = lib_cl.Tensor.from_value(face_align_img).transpose( (2,0,1), op_text='O = ((O_TYPE)I) / 255.0', dtype=np.float32)
-            face_swap_img_t = lib_cl.rct(face_swap_img_t, face_align_img_t, target_mask_t=face_mask_t, source_mask_t=face_mask_t)
+        the union of the rects of the frame covered by the faces is transferred once
+        and the faces are blended in it on the device
+        """
+        state = self.get_state()
+        interpolation = self._gpu_interp[state.interpolation]
+        frame_height, frame_width = frame_image.shape[:2]
+
+        rois = [ self._get_frame_roi(face[-1], face[1].shape[1], face[1].shape[0], frame_width, frame_height) for face in faces ]
+        faces = [ face for face, (l,t,r,b) in zip(faces, rois) if l < r and t < b ]
+        rois = [ (l,t,r,b) for l,t,r,b in rois if l < r and t < b ]
+        if len(faces) == 0:
+            return
+        l, t = min(roi[0] for roi in rois), min(roi[1] for roi in rois)
+        r, b = max(roi[2] for roi in rois), max(roi[3] for roi in rois)
+
+        frame_image_t = lib_cl.Tensor.from_value(np.ascontiguousarray(frame_image[t:b,l:r])).transpose( (2,0,1) )
+
+        for face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat in faces:
+            roi_mat = self._get_roi_mat(aligned_to_source_uni_mat, l, t)
+
+            masks = []
+            if state.face_mask_source:
+                masks.append( lib_cl.Tensor.from_value(face_align_mask_img) )
+            if state.face_mask_celeb:
+                masks.append( lib_cl.Tensor.from_value(face_swap_mask_img) )
+            if state.face_mask_lmrks:
+                masks.append( lib_cl.Tensor.from_value(face_align_lmrks_mask_img) )
+
+            masks_count = len(masks)
+            if masks_count == 0:
+                face_mask_t = lib_cl.Tensor(shape=(face_resolution, face_resolution), dtype=np.float32, initializer=lib_cl.InitConst(1.0))
+            else:
+                face_mask_t = lib_cl.any_wise(FaceMergerWorker._n_mask_multiply_op_text[masks_count], *masks, dtype=np.uint8).transpose( (2,0,1) )
 
-        frame_face_mask_t     = lib_cl.remap_np_affine(face_mask_t,     aligned_to_source_uni_mat, interpolation=lib_cl.EInterpolation.LINEAR, output_size=(frame_height, frame_width), post_op_text='O = (O <= (1.0/255.0) ? 0.0 : O > 1.0 ? 1.0 : O);' )
-        frame_face_swap_img_t = lib_cl.remap_np_affine(face_swap_img_t, aligned_to_source_uni_mat, interpolation=interpolation, output_size=(frame_height, frame_width), post_op_text='O = clamp(O, 0.0, 1.0);' )
+            face_mask_t = lib_cl.binary_morph(face_mask_t, state.face_mask_erode, state.face_mask_blur, fade_to_border=True, dtype=np.float32)
+            face_swap_img_t  = lib_cl.Tensor.from_value(face_swap_img ).transpose( (2,0,1), op_text='O = ((O_TYPE)I) / 255.0', dtype=np.float32)
 
-        frame_image_t = lib_cl.Tensor.from_value(frame_image).transpose( (2,0,1), op_text='O = ((float)I) / 255.0;' if frame_image.dtype == np.uint8 else None,
-                                                                                  dtype=np.float32 if frame_image.dtype == np.uint8 else None)
+            if state.color_transfer == 'rct':
+                face_align_img_t = lib_cl.Tensor.from_value(face_align_img).transpose( (2,0,1), op_text='O = ((O_TYPE)I) / 255.0', dtype=np.float32)
+                face_swap_img_t = lib_cl.rct(face_swap_img_t, face_align_img_t, target_mask_t=face_mask_t, source_mask_t=face_mask_t)
 
-        opacity = state.face_opacity
-        if opacity == 1.0:
-            frame_final_t = lib_cl.any_wise('O = I0*(1.0-I1) + I2*I1', frame_image_t, frame_face_mask_t, frame_face_swap_img_t, dtype=np.float32)
-        else:
-            frame_final_t = lib_cl.any_wise('O = I0*(1.0-I1) + I0*I1*(1.0-I3) + I2*I1*I3', frame_image_t, frame_face_mask_t, frame_face_swap_img_t, np.float32(opacity), dtype=np.float32)
+            frame_face_mask_t     = lib_cl.remap_np_affine(face_mask_t,     roi_mat, interpolation=lib_cl.EInterpolation.LINEAR, output_size=(b-t, r-l), post_op_text='O = (O <= (1.0/255.0) ? 0.0 : O > 1.0 ? 1.0 : O);' )
+            frame_face_swap_img_t = lib_cl.remap_np_affine(face_swap_img_t, roi_mat, interpolation=interpolation, output_size=(b-t, r-l), post_op_text='O = clamp(O, 0.0, 1.0);' )
 
-        if do_color_compression and state.color_compression != 0:
-            color_compression = max(4, (127.0 - state.color_compression) )
-            frame_final_t = lib_cl.any_wise('O = ( floor(I0 * I1) / I1 ) + (2.0 / I1);', frame_final_t, np.float32(color_compression))
+            opacity = state.face_opacity
+            if opacity == 1.0:
+                frame_image_t = lib_cl.any_wise('O = I0*(1.0-I1) + I2*I1', frame_image_t, frame_face_mask_t, frame_face_swap_img_t, dtype=np.float32)
+            else:
+                frame_image_t = lib_cl.any_wise('O = I0*(1.0-I1) + I0*I1*(1.0-I3) + I2*I1*I3', frame_image_t, frame_face_mask_t, frame_face_swap_img_t, np.float32(opacity), dtype=np.float32)
 
-        return frame_final_t.transpose( (1,2,0) ).np()
+        frame_image[t:b,l:r] = frame_image_t.transpose( (1,2,0) ).np()
 
     def on_tick(self):
         state, cs = self.get_state(), self.get_control_sheet()
@@ -317,61 +469,73 @@ class FaceMergerWorker(BackendWorker):
             if bcd is not None:
                 bcd.assign_weak_heap(self.weak_heap)
 
-                frame_image_name = bcd.get_frame_image_name()
-                merged_frame = bcd.get_image(frame_image_name)
-
-                if merged_frame is not None:
-                    fsi_list = bcd.get_face_swap_info_list()
-                    fsi_list_len = len(fsi_list)
-                    has_merged_faces = False
-
-                    for fsi_id, fsi in enumerate(fsi_list):
+                if not self.restore_stage_cache(bcd):
+                    frame_image_name = bcd.get_frame_image_name()
+                    merged_frame = bcd.get_image(frame_image_name)
 
-                        face_anim_img             = bcd.get_image(fsi.face_anim_image_name)
-                        if face_anim_img is not None:
-                            has_merged_faces = True
-                            merged_frame = face_anim_img
-                        else:
+                    if merged_frame is not None:
+                        fsi_list = bcd.get_face_swap_info_list()
+                        has_merged_faces = False
+                        # arguments of _merge_on_cpu() of the faces merged to merged_frame in one pass
+                        faces = []
 
-                            image_to_align_uni_mat = fsi.image_to_align_uni_mat
-                            face_resolution        = fsi.face_resolution
+                        for fsi in fsi_list:
 
-                            face_align_img            = bcd.get_image(fsi.face_align_image_name)
-                            face_align_lmrks_mask_img = bcd.get_image(fsi.face_align_lmrks_mask_name)
-                            face_align_mask_img       = bcd.get_image(fsi.face_align_mask_name)
-                            face_swap_img             = bcd.get_image(fsi.face_swap_image_name)
-                            face_swap_mask_img        = bcd.get_image(fsi.face_swap_mask_name)
-
-                            if all_is_not_None(face_resolution, face_align_img, face_align_mask_img, face_swap_img, face_swap_mask_img, image_to_align_uni_mat):
+                            face_anim_img             = bcd.get_image(fsi.face_anim_image_name)
+                            if face_anim_img is not None:
                                 has_merged_faces = True
-                                face_height, face_width = face_align_img.shape[:2]
-                                frame_height, frame_width = merged_frame.shape[:2]
-                                aligned_to_source_uni_mat = image_to_align_uni_mat.invert()
-                                aligned_to_source_uni_mat = aligned_to_source_uni_mat.source_translated(-state.face_x_offset, -state.face_y_offset)
-                                aligned_to_source_uni_mat = aligned_to_source_uni_mat.source_scaled_around_center(state.face_scale,state.face_scale)
-                                aligned_to_source_uni_mat = aligned_to_source_uni_mat.to_exact_mat (face_width, face_height, frame_width, frame_height)
-
-                                do_color_compression = fsi_id == fsi_list_len-1
-                                if state.device == 'CPU':
-                                    merged_frame = self._merge_on_cpu(merged_frame, face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat, frame_width, frame_height, do_color_compression=do_color_compression )
-                                else:
-                                    merged_frame = self._merge_on_gpu(merged_frame, face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat, frame_width, frame_height, do_color_compression=do_color_compression )
-
-                    if has_merged_faces:
-                        # keep image in float32 in order not to extra load FaceMerger
-                        merged_image_name = f'{frame_image_name}_merged'
-                        bcd.set_merged_image_name(merged_image_name)
-                        bcd.set_image(merged_image_name, merged_frame)
-
-                self.stop_profile_timing()
+                                merged_frame = face_anim_img
+                                faces = []
+                            else:
+
+                                image_to_align_uni_mat = fsi.image_to_align_uni_mat
+                                face_resolution        = fsi.face_resolution
+
+                                face_align_img            = bcd.get_image(fsi.face_align_image_name)
+                                face_align_lmrks_mask_img = bcd.get_image(fsi.face_align_lmrks_mask_name)
+                                face_align_mask_img       = bcd.get_image(fsi.face_align_mask_name)
+                                face_swap_img             = bcd.get_image(fsi.face_swap_image_name)
+                                face_swap_mask_img        = bcd.get_image(fsi.face_swap_mask_name)
+
+                                if all_is_not_None(face_resolution, face_align_img, face_align_mask_img, face_swap_img, face_swap_mask_img, image_to_align_uni_mat):
+                                    has_merged_faces = True
+                                    face_height, face_width = face_align_img.shape[:2]
+                                    frame_height, frame_width = merged_frame.shape[:2]
+                                    aligned_to_source_uni_mat = image_to_align_uni_mat.invert()
+                                    aligned_to_source_uni_mat = aligned_to_source_uni_mat.source_translated(-state.face_x_offset, -state.face_y_offset)
+                                    aligned_to_source_uni_mat = aligned_to_source_uni_mat.source_scaled_around_center(state.face_scale,state.face_scale)
+                                    aligned_to_source_uni_mat = aligned_to_source_uni_mat.to_exact_mat (face_width, face_height, frame_width, frame_height)
+
+                                    faces.append( (face_resolution, face_align_img, face_align_mask_img, face_align_lmrks_mask_img, face_swap_img, face_swap_mask_img, aligned_to_source_uni_mat) )
+
+                        if len(faces) != 0:
+                            if state.device == 'CPU':
+                                merged_frame = self._merge_on_cpu(merged_frame, faces)
+                            else:
+                                # the faces are merged in place to own float copy of the frame
+                                merged_frame = ImageProcessor(merged_frame, copy=merged_frame.dtype != np.uint8, arena=self.image_arena).ch(3).to_ufloat32().get_image('HWC')
+                                self._merge_on_gpu(merged_frame, faces)
+
+                                if state.color_compression != 0:
+                                    self._color_compression(merged_frame)
+
+                        if has_merged_faces:
+                            if state.output_format == 'uint8':
+                                # quantized once here instead of in every consumer, the source image is not changed
+                                merged_frame = ImageProcessor(merged_frame, arena=self.image_arena).to_uint8().get_image('HWC')
+
+                            merged_image_name = f'{frame_image_name}_merged'
+                            bcd.set_merged_image_name(merged_image_name)
+                            bcd.set_image(merged_image_name, merged_frame)
+                    self.store_stage_cache(bcd)
+
+                self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 
 class Sheet:
@@ -395,6 +559,7 @@ class Sheet:
             self.interpolation = lib_csw.DynamicSingleSwitch.Client()
             self.color_compression = lib_csw.Number.Client()
             self.face_opacity = lib_csw.Number.Client()
+            self.output_format = lib_csw.DynamicSingleSwitch.Client()
 
     class Worker(lib_csw.Sheet.Worker):
         def __init__(self):
@@ -414,6 +579,7 @@ class Sheet:
 
             self.color_compression = lib_csw.Number.Host()
             self.face_opacity = lib_csw.Number.Host()
+            self.output_format = lib_csw.DynamicSingleSwitch.Host()
 
 class WorkerState(BackendWorkerState):
     device : lib_cl.DeviceInfo = None
@@ -431,7 +597,5 @@ class WorkerState(BackendWorkerState):
     interpolation = None
     color_compression : int = None
     face_opacity : float = None
+    output_format = None
 
-# out_merged_frame = self.out_merged_frame
-# if out_merged_frame is None or out_merged_frame.shape[:2] != (frame_height, frame_width):
-#     out_merged_frame = self.out_merged_frame = np.empty_like(frame_image, np.float32)
@@ -1,11 +1,11 @@
-import time
 from pathlib import Path
 from typing import Dict
 
 import numpy as np
 from modelhub import DFLive
+from xlib import appargs as lib_appargs
 from xlib import os as lib_os
-from xlib.image.ImageProcessor import ImageProcessor
+from xlib.image.ImageProcessor import ImageArena, ImageProcessor
 from xlib.mp import csw as lib_csw
 from xlib.python import all_is_not_None
 
@@ -22,7 +22,7 @@ class FaceSwapDFM(BackendHost):
                          sheet_cls=Sheet,
                          worker_cls=FaceSwapDFMWorker,
                          worker_state_cls=WorkerState,
-                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, dfm_models_path])
+                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, dfm_models_path, id])
 
     def get_control_sheet(self) -> 'Sheet.Host': return super().get_control_sheet()
 
@@ -33,7 +33,7 @@ class FaceSwapDFMWorker(BackendWorker):
     def get_state(self) -> 'WorkerState': return super().get_state()
     def get_control_sheet(self) -> 'Sheet.Worker': return super().get_control_sheet()
 
-    def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, dfm_models_path : Path):
+    def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, dfm_models_path : Path, id : int):
         self.weak_heap = weak_heap
         self.reemit_frame_signal = reemit_frame_signal
         self.bc_in = bc_in
@@ -43,13 +43,23 @@ class FaceSwapDFMWorker(BackendWorker):
         self.pending_bcd = None
 
         self.dfm_model_initializer = None
+        self.dfm_model_waiting_info = None
         self.dfm_model = None
 
+        # recently used models are kept to switch between them without initialization
+        self.dfm_model_cache = DFLive.DFMModelCache(max_memory_mb=int(lib_appargs.get_arg_str('DFM_CACHE_SIZE_MB', '4096')))
+        self.dfm_model_cache_models_info = []
+
+        # the processed faces are consumed within the tick
+        self.image_arena = ImageArena()
+
         lib_os.set_timer_resolution(1)
+        self.apply_thread_allocation(replica_id=id)
 
         state, cs = self.get_state(), self.get_control_sheet()
 
         cs.model.call_on_selected(self.on_cs_model)
+        cs.preload_model.call_on_selected(self.on_cs_preload_model)
         cs.device.call_on_selected(self.on_cs_device)
         cs.swap_all_faces.call_on_flag(self.on_cs_swap_all_faces)
         cs.face_id.call_on_number(self.on_cs_face_id)
@@ -70,9 +80,13 @@ class FaceSwapDFMWorker(BackendWorker):
     def on_cs_device(self, idx, device):
         state, cs = self.get_state(), self.get_control_sheet()
         if device is not None and state.device == device:
+            models_info = DFLive.get_available_models_info(self.dfm_models_path)
             cs.model.enable()
-            cs.model.set_choices( DFLive.get_available_models_info(self.dfm_models_path), none_choice_name='@misc.menu_select')
+            cs.model.set_choices( models_info, none_choice_name='@misc.menu_select')
             cs.model.select(state.model)
+
+            cs.preload_model.enable()
+            cs.preload_model.set_choices( models_info, none_choice_name='@misc.menu_select')
         else:
             state.device = device
             self.save_state()
@@ -81,14 +95,114 @@ class FaceSwapDFMWorker(BackendWorker):
     def on_cs_model(self, idx, model):
         state, cs = self.get_state(), self.get_control_sheet()
 
-        if state.model == model:
-            state.model_state = state.models_state[model.get_name()] = state.models_state.get(model.get_name(), ModelState())
-            self.dfm_model_initializer = DFLive.DFMModel_from_info(state.model, state.device)
-            self.set_busy(True)
-        else:
+        if state.model != model:
             state.model = model
             self.save_state()
+
+        cs.model_dl_progress.disable()
+        cs.model_dl_error.disable()
+        self.dfm_model_initializer = None
+        self.dfm_model_waiting_info = None
+
+        if model is None:
             self.restart()
+            return
+
+        # The current model is in use until the new one is initialized.
+        dfm_model = self.dfm_model_cache.get(model, state.device)
+        if dfm_model is not None:
+            self.on_model_initialized(model, dfm_model)
+        elif self.dfm_model_cache.is_preloading(model, state.device):
+            self.dfm_model_waiting_info = model
+        else:
+            self.dfm_model_initializer = DFLive.DFMModel_from_info(model, state.device)
+
+        if self.dfm_model is None:
+            self.set_busy(True)
+
+    def on_cs_preload_model(self, idx, model):
+        state, cs = self.get_state(), self.get_control_sheet()
+        if model is not None:
+            # the model initializing by the worker is not loaded twice
+            if not (self.dfm_model_initializer is not None and model == state.model):
+                self.dfm_model_cache.preload(model, state.device)
+            cs.preload_model.unselect()
+
+    def on_model_initialized(self, model : DFLive.DFMModelInfo, dfm_model):
+        state, cs = self.get_state(), self.get_control_sheet()
+
+        self.dfm_model_cache.put(model, state.device, dfm_model, in_use=True)
+        self.dfm_model = dfm_model
+        state.model_state = state.models_state[model.get_name()] = state.models_state.get(model.get_name(), ModelState())
+
+        self.update_model_info_label()
+
+        cs.swap_all_faces.enable()
+        cs.swap_all_faces.set_flag( state.model_state.swap_all_faces if state.model_state.swap_all_faces is not None else False)
+        # face_id of the previous model
+        self.on_cs_swap_all_faces(cs.swap_all_faces.get_flag())
+
+        if self.dfm_model.has_morph_value():
+            cs.morph_factor.enable()
+            cs.morph_factor.set_config(lib_csw.Number.Config(min=0, max=1, step=0.01, decimals=2, allow_instant_update=True))
+            cs.morph_factor.set_number(state.model_state.morph_factor if state.model_state.morph_factor is not None else 0.75)
+        else:
+            cs.morph_factor.disable()
+
+        cs.presharpen_amount.enable()
+        cs.presharpen_amount.set_config(lib_csw.Number.Config(min=0, max=10, step=0.1, decimals=1, allow_instant_update=True))
+        cs.presharpen_amount.set_number(state.model_state.presharpen_amount if state.model_state.presharpen_amount is not None else 0)
+
+        cs.pre_gamma_red.enable()
+        cs.pre_gamma_red.set_config(lib_csw.Number.Config(min=0.01, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.pre_gamma_red.set_number(state.model_state.pre_gamma_red if state.model_state.pre_gamma_red is not None else 1)
+
+        cs.pre_gamma_green.enable()
+        cs.pre_gamma_green.set_config(lib_csw.Number.Config(min=0.01, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.pre_gamma_green.set_number(state.model_state.pre_gamma_green if state.model_state.pre_gamma_green is not None else 1)
+
+        cs.pre_gamma_blue.enable()
+        cs.pre_gamma_blue.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.pre_gamma_blue.set_number(state.model_state.pre_gamma_blue if state.model_state.pre_gamma_blue is not None else 1)
+
+        cs.post_gamma_red.enable()
+        cs.post_gamma_red.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.post_gamma_red.set_number(state.model_state.post_gamma_red if state.model_state.post_gamma_red is not None else 1)
+
+        cs.post_gamma_blue.enable()
+        cs.post_gamma_blue.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.post_gamma_blue.set_number(state.model_state.post_gamma_blue if state.model_state.post_gamma_blue is not None else 1)
+
+        cs.post_gamma_green.enable()
+        cs.post_gamma_green.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
+        cs.post_gamma_green.set_number(state.model_state.post_gamma_green if state.model_state.post_gamma_green is not None else 1)
+
+        cs.two_pass.enable()
+        cs.two_pass.set_flag(state.model_state.two_pass if state.model_state.two_pass is not None else False)
+
+        self.save_state()
+        self.set_busy(False)
+        self.invalidate_stage_cache()
+        self.reemit_frame_signal.send()
+
+    def update_model_info_label(self):
+        cs = self.get_control_sheet()
+        model_width, model_height = self.dfm_model.get_input_res()
+
+        self.dfm_model_cache_models_info = self.dfm_model_cache.get_models_info()
+
+        cs.model_info_label.enable()
+        cs.model_info_label.set_config( lib_csw.InfoLabel.Config(info_icon=True,
+                                            info_lines=[f'@FaceSwapDFM.model_information',
+                                                        '',
+                                                        f'@FaceSwapDFM.filename',
+                                                        f'{self.dfm_model.get_model_path().name}',
+                                                        '',
+                                                        f'@FaceSwapDFM.resolution',
+                                                        f'{model_width}x{model_height}',
+                                                        '',
+                                                        f'@FaceSwapDFM.cached_models',
+                                                        ] + [ model.get_name() for model in reversed(self.dfm_model_cache_models_info) ] ) )
 
     def on_cs_swap_all_faces(self, swap_all_faces):
         state, cs = self.get_state(), self.get_control_sheet()
@@ -222,64 +336,12 @@ class FaceSwapDFMWorker(BackendWorker):
                 cs.model_dl_progress.set_progress(0)
 
             elif events.new_status_initialized:
-                self.dfm_model = events.dfm_model
                 self.dfm_model_initializer = None
-
-                model_width, model_height = self.dfm_model.get_input_res()
-
-                cs.model_info_label.enable()
-                cs.model_info_label.set_config( lib_csw.InfoLabel.Config(info_icon=True,
-                                                    info_lines=[f'@FaceSwapDFM.model_information',
-                                                                '',
-                                                                f'@FaceSwapDFM.filename',
-                                                                f'{self.dfm_model.get_model_path().name}',
-                                                                '',
-                                                                f'@FaceSwapDFM.resolution',
-                                                                f'{model_width}x{model_height}']) )
-
-                cs.swap_all_faces.enable()
-                cs.swap_all_faces.set_flag( state.model_state.swap_all_faces if state.model_state.swap_all_faces is not None else False)
-
-                if self.dfm_model.has_morph_value():
-                    cs.morph_factor.enable()
-                    cs.morph_factor.set_config(lib_csw.Number.Config(min=0, max=1, step=0.01, decimals=2, allow_instant_update=True))
-                    cs.morph_factor.set_number(state.model_state.morph_factor if state.model_state.morph_factor is not None else 0.75)
-
-                cs.presharpen_amount.enable()
-                cs.presharpen_amount.set_config(lib_csw.Number.Config(min=0, max=10, step=0.1, decimals=1, allow_instant_update=True))
-                cs.presharpen_amount.set_number(state.model_state.presharpen_amount if state.model_state.presharpen_amount is not None else 0)
-
-                cs.pre_gamma_red.enable()
-                cs.pre_gamma_red.set_config(lib_csw.Number.Config(min=0.01, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.pre_gamma_red.set_number(state.model_state.pre_gamma_red if state.model_state.pre_gamma_red is not None else 1)
-
-                cs.pre_gamma_green.enable()
-                cs.pre_gamma_green.set_config(lib_csw.Number.Config(min=0.01, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.pre_gamma_green.set_number(state.model_state.pre_gamma_green if state.model_state.pre_gamma_green is not None else 1)
-
-                cs.pre_gamma_blue.enable()
-                cs.pre_gamma_blue.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.pre_gamma_blue.set_number(state.model_state.pre_gamma_blue if state.model_state.pre_gamma_blue is not None else 1)
-
-                cs.post_gamma_red.enable()
-                cs.post_gamma_red.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.post_gamma_red.set_number(state.model_state.post_gamma_red if state.model_state.post_gamma_red is not None else 1)
-
-                cs.post_gamma_blue.enable()
-                cs.post_gamma_blue.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.post_gamma_blue.set_number(state.model_state.post_gamma_blue if state.model_state.post_gamma_blue is not None else 1)
-
-                cs.post_gamma_green.enable()
-                cs.post_gamma_green.set_config(lib_csw.Number.Config(min=0.010, max=4, step=0.01, decimals=2, allow_instant_update=True))
-                cs.post_gamma_green.set_number(state.model_state.post_gamma_green if state.model_state.post_gamma_green is not None else 1)
-
-                cs.two_pass.enable()
-                cs.two_pass.set_flag(state.model_state.two_pass if state.model_state.two_pass is not None else False)
-
-                self.set_busy(False)
-                self.reemit_frame_signal.send()
+                self.on_model_initialized(state.model, events.dfm_model)
 
             elif events.new_status_error:
+                self.dfm_model_initializer = None
+                self.dfm_model = None
                 self.set_busy(False)
                 cs.model_dl_error.enable()
                 cs.model_dl_error.set_error(events.error)
@@ -287,6 +349,27 @@ class FaceSwapDFMWorker(BackendWorker):
             if events.download_progress is not None:
                 cs.model_dl_progress.set_progress(events.download_progress)
 
+        for model, error in self.dfm_model_cache.pop_preload_errors():
+            if model == self.dfm_model_waiting_info:
+                self.dfm_model_waiting_info = None
+                self.set_busy(False)
+            cs.model_dl_error.enable()
+            cs.model_dl_error.set_error(f'{model.get_name()}: {error}')
+
+        if self.dfm_model_waiting_info is not None:
+            # the model is preloading in background
+            dfm_model = self.dfm_model_cache.get(self.dfm_model_waiting_info, state.device)
+            if dfm_model is not None:
+                self.on_model_initialized(self.dfm_model_waiting_info, dfm_model)
+                self.dfm_model_waiting_info = None
+            elif not self.dfm_model_cache.is_preloading(self.dfm_model_waiting_info, state.device):
+                # the preloaded model did not fit the cache, initialize in usual way
+                self.dfm_model_initializer = DFLive.DFMModel_from_info(self.dfm_model_waiting_info, state.device)
+                self.dfm_model_waiting_info = None
+
+        if self.dfm_model is not None and self.dfm_model_cache_models_info != self.dfm_model_cache.get_models_info():
+            self.update_model_info_label()
+
         if self.pending_bcd is None:
             self.start_profile_timing()
 
@@ -294,16 +377,23 @@ class FaceSwapDFMWorker(BackendWorker):
             if bcd is not None:
                 bcd.assign_weak_heap(self.weak_heap)
 
-                model_state = state.model_state
-                dfm_model = self.dfm_model
-                if all_is_not_None(dfm_model, model_state):
+                if not self.restore_stage_cache(bcd):
+                    model_state = state.model_state
+                    dfm_model = self.dfm_model
+                    if all_is_not_None(dfm_model, model_state):
+                        # Gather aligned faces of the same size into batches to convert them in one run
+                        batches = {}
+                        for i, fsi in enumerate(bcd.get_face_swap_info_list()):
+                            if not model_state.swap_all_faces and model_state.face_id != i:
+                                continue
 
-                    for i, fsi in enumerate(bcd.get_face_swap_info_list()):
-                        if not model_state.swap_all_faces and model_state.face_id != i:
-                            continue
+                            face_align_image = bcd.get_image(fsi.face_align_image_name)
+                            if face_align_image is not None:
+                                batches.setdefault(face_align_image.shape, []).append( (fsi, face_align_image) )
 
-                        face_align_image = bcd.get_image(fsi.face_align_image_name)
-                        if face_align_image is not None:
+                        for batch in batches.values():
+                            fsi_list = [ fsi for fsi, _ in batch ]
+                            face_align_images = np.stack([ face_align_image for _, face_align_image in batch ])
 
                             pre_gamma_red = model_state.pre_gamma_red
                             pre_gamma_green = model_state.pre_gamma_green
@@ -312,47 +402,46 @@ class FaceSwapDFMWorker(BackendWorker):
                             post_gamma_blue = model_state.post_gamma_blue
                             post_gamma_green = model_state.post_gamma_green
 
-                            fai_ip = ImageProcessor(face_align_image)
+                            fai_ip = ImageProcessor(face_align_images, arena=self.image_arena)
                             if model_state.presharpen_amount != 0:
                                 fai_ip.gaussian_sharpen(sigma=1.0, power=model_state.presharpen_amount)
 
                             if pre_gamma_red != 1.0 or pre_gamma_green != 1.0 or pre_gamma_blue != 1.0:
                                 fai_ip.gamma(pre_gamma_red, pre_gamma_green, pre_gamma_blue)
-                            face_align_image = fai_ip.get_image('HWC')
+                            face_align_images = fai_ip.get_image('NHWC')
 
-                            celeb_face, celeb_face_mask_img, face_align_mask_img = dfm_model.convert(face_align_image, morph_factor=model_state.morph_factor)
-                            celeb_face, celeb_face_mask_img, face_align_mask_img = celeb_face[0], celeb_face_mask_img[0], face_align_mask_img[0]
+                            celeb_faces, celeb_face_mask_imgs, face_align_mask_imgs = dfm_model.convert(face_align_images, morph_factor=model_state.morph_factor)
 
                             if model_state.two_pass:
-                                celeb_face, celeb_face_mask_img, _ = dfm_model.convert(celeb_face, morph_factor=model_state.morph_factor)
-                                celeb_face, celeb_face_mask_img = celeb_face[0], celeb_face_mask_img[0]
+                                celeb_faces, celeb_face_mask_imgs, _ = dfm_model.convert(celeb_faces, morph_factor=model_state.morph_factor)
 
                             if post_gamma_red != 1.0 or post_gamma_blue != 1.0 or post_gamma_green != 1.0:
-                                celeb_face = ImageProcessor(celeb_face).gamma(post_gamma_red, post_gamma_blue, post_gamma_green).get_image('HWC')
+                                celeb_faces = ImageProcessor(celeb_faces, arena=self.image_arena).gamma(post_gamma_red, post_gamma_blue, post_gamma_green).get_image('NHWC')
 
-                            fsi.face_align_mask_name = f'{fsi.face_align_image_name}_mask'
-                            fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
-                            fsi.face_swap_mask_name  = f'{fsi.face_swap_image_name}_mask'
+                            for fsi, celeb_face, celeb_face_mask_img, face_align_mask_img in zip(fsi_list, celeb_faces, celeb_face_mask_imgs, face_align_mask_imgs):
+                                fsi.face_align_mask_name = f'{fsi.face_align_image_name}_mask'
+                                fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
+                                fsi.face_swap_mask_name  = f'{fsi.face_swap_image_name}_mask'
 
-                            bcd.set_image(fsi.face_align_mask_name, face_align_mask_img)
-                            bcd.set_image(fsi.face_swap_image_name, celeb_face)
-                            bcd.set_image(fsi.face_swap_mask_name, celeb_face_mask_img)
+                                bcd.set_image(fsi.face_align_mask_name, face_align_mask_img)
+                                bcd.set_image(fsi.face_swap_image_name, celeb_face)
+                                bcd.set_image(fsi.face_swap_mask_name, celeb_face_mask_img)
+                    self.store_stage_cache(bcd)
 
-                self.stop_profile_timing()
+                self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 class Sheet:
     class Host(lib_csw.Sheet.Host):
         def __init__(self):
             super().__init__()
             self.model = lib_csw.DynamicSingleSwitch.Client()
+            self.preload_model = lib_csw.DynamicSingleSwitch.Client()
             self.model_info_label = lib_csw.InfoLabel.Client()
             self.model_dl_progress = lib_csw.Progress.Client()
             self.model_dl_error = lib_csw.Error.Client()
@@ -373,6 +462,7 @@ class Sheet:
         def __init__(self):
             super().__init__()
             self.model = lib_csw.DynamicSingleSwitch.Host()
+            self.preload_model = lib_csw.DynamicSingleSwitch.Host()
             self.model_info_label = lib_csw.InfoLabel.Host()
             self.model_dl_progress = lib_csw.Progress.Host()
             self.model_dl_error = lib_csw.Error.Host()
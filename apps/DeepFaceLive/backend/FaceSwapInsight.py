@@ -1,9 +1,9 @@
-import time
 from pathlib import Path
 import cv2
 import numpy as np
 from modelhub.onnx import InsightFace2D106, InsightFaceSwap, YoloV5Face
 from xlib import cv as lib_cv2
+from xlib import onnxruntime as lib_ort
 from xlib import os as lib_os
 from xlib import path as lib_path
 from xlib.face import ELandmarks2D, FLandmarks2D, FRect
@@ -17,13 +17,13 @@ from .BackendBase import (BackendConnection, BackendDB, BackendHost,
 
 class FaceSwapInsight(BackendHost):
     def __init__(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, faces_path : Path, backend_db : BackendDB = None,
-                  id : int = 0):
+                  inference_server_client : lib_ort.InferenceServerClient = None, id : int = 0):
         self._id = id
         super().__init__(backend_db=backend_db,
                          sheet_cls=Sheet,
                          worker_cls=FaceSwapInsightWorker,
                          worker_state_cls=WorkerState,
-                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, faces_path])
+                         worker_start_args=[weak_heap, reemit_frame_signal, bc_in, bc_out, faces_path, inference_server_client])
 
     def get_control_sheet(self) -> 'Sheet.Host': return super().get_control_sheet()
 
@@ -34,7 +34,7 @@ class FaceSwapInsightWorker(BackendWorker):
     def get_state(self) -> 'WorkerState': return super().get_state()
     def get_control_sheet(self) -> 'Sheet.Worker': return super().get_control_sheet()
 
-    def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, faces_path : Path):
+    def on_start(self, weak_heap : BackendWeakHeap, reemit_frame_signal : BackendSignal, bc_in : BackendConnection, bc_out : BackendConnection, faces_path : Path, inference_server_client : lib_ort.InferenceServerClient):
         self.weak_heap = weak_heap
         self.reemit_frame_signal = reemit_frame_signal
         self.bc_in = bc_in
@@ -49,6 +49,8 @@ class FaceSwapInsightWorker(BackendWorker):
         self.face_vector = None
 
         lib_os.set_timer_resolution(1)
+        self.apply_thread_allocation()
+        lib_ort.set_inference_server_client(inference_server_client)
 
         state, cs = self.get_state(), self.get_control_sheet()
 
@@ -180,60 +182,60 @@ class FaceSwapInsightWorker(BackendWorker):
             if bcd is not None:
                 bcd.assign_weak_heap(self.weak_heap)
 
-                if self.face_vector is None and self.target_face_img is not None:
-                    rects = self.face_detector.extract (self.target_face_img, threshold=0.5)[0]
-                    if len(rects) > 0:
-                        _,H,W,_ = ImageProcessor(self.target_face_img).get_dims()
+                if not self.restore_stage_cache(bcd):
+                    if self.face_vector is None and self.target_face_img is not None:
+                        rects = self.face_detector.extract (self.target_face_img, threshold=0.5)[0]
+                        if len(rects) > 0:
+                            _,H,W,_ = ImageProcessor(self.target_face_img).get_dims()
 
-                        u_rects = [ FRect.from_ltrb( (l/W, t/H, r/W, b/H) ) for l,t,r,b in rects ]
-                        face_urect = FRect.sort_by_area_size(u_rects)[0] # sorted by largest
+                            u_rects = [ FRect.from_ltrb( (l/W, t/H, r/W, b/H) ) for l,t,r,b in rects ]
+                            face_urect = FRect.sort_by_area_size(u_rects)[0] # sorted by largest
 
-                        face_image, face_uni_mat = face_urect.cut(self.target_face_img, 1.6, 192)
-                        lmrks = self.face_marker.extract(face_image)[0]
-                        lmrks = lmrks[...,0:2] / (192,192)
+                            face_image, face_uni_mat = face_urect.cut(self.target_face_img, 1.6, 192)
+                            lmrks = self.face_marker.extract(face_image)[0]
+                            lmrks = lmrks[...,0:2] / (192,192)
 
-                        face_ulmrks = FLandmarks2D.create (ELandmarks2D.L106, lmrks).transform(face_uni_mat, invert=True)
+                            face_ulmrks = FLandmarks2D.create (ELandmarks2D.L106, lmrks).transform(face_uni_mat, invert=True)
 
-                        face_align_img, _ = face_ulmrks.cut(self.target_face_img, state.adjust_c,
-                                                                self.swap_model.get_face_vector_input_size(),
-                                                                x_offset=state.adjust_x,
-                                                                y_offset=state.adjust_y)
-                        self.face_vector = self.swap_model.get_face_vector(face_align_img)
+                            face_align_img, _ = face_ulmrks.cut(self.target_face_img, state.adjust_c,
+                                                                    self.swap_model.get_face_vector_input_size(),
+                                                                    x_offset=state.adjust_x,
+                                                                    y_offset=state.adjust_y)
+                            self.face_vector = self.swap_model.get_face_vector(face_align_img)
 
 
-                swap_model = self.swap_model
-                if swap_model is not None and self.face_vector is not None:
+                    swap_model = self.swap_model
+                    if swap_model is not None and self.face_vector is not None:
 
-                    for i, fsi in enumerate(bcd.get_face_swap_info_list()):
-                        if state.animator_face_id == i:
-                            face_align_image = bcd.get_image(fsi.face_align_image_name)
-                            if face_align_image is not None:
+                        for i, fsi in enumerate(bcd.get_face_swap_info_list()):
+                            if state.animator_face_id == i:
+                                face_align_image = bcd.get_image(fsi.face_align_image_name)
+                                if face_align_image is not None:
 
-                                _,H,W,_ = ImageProcessor(face_align_image).get_dims()
+                                    _,H,W,_ = ImageProcessor(face_align_image).get_dims()
 
-                                anim_image = swap_model.generate(face_align_image, self.face_vector)
-                                anim_image = ImageProcessor(anim_image).resize((W,H)).get_image('HWC')
+                                    anim_image = swap_model.generate(face_align_image, self.face_vector)
+                                    anim_image = ImageProcessor(anim_image).resize((W,H)).get_image('HWC')
 
-                                fsi.face_align_mask_name = f'{fsi.face_align_image_name}_mask'
-                                fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
-                                fsi.face_swap_mask_name  = f'{fsi.face_swap_image_name}_mask'
-                                bcd.set_image(fsi.face_swap_image_name, anim_image)
+                                    fsi.face_align_mask_name = f'{fsi.face_align_image_name}_mask'
+                                    fsi.face_swap_image_name = f'{fsi.face_align_image_name}_swapped'
+                                    fsi.face_swap_mask_name  = f'{fsi.face_swap_image_name}_mask'
+                                    bcd.set_image(fsi.face_swap_image_name, anim_image)
 
-                                white_mask = np.full_like(anim_image, 255, dtype=np.uint8)
-                                bcd.set_image(fsi.face_align_mask_name, white_mask)
-                                bcd.set_image(fsi.face_swap_mask_name, white_mask)
+                                    white_mask = np.full_like(anim_image, 255, dtype=np.uint8)
+                                    bcd.set_image(fsi.face_align_mask_name, white_mask)
+                                    bcd.set_image(fsi.face_swap_mask_name, white_mask)
 
-                            break
+                                break
+                    self.store_stage_cache(bcd)
 
-                self.stop_profile_timing()
+                self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 class Sheet:
     class Host(lib_csw.Sheet.Host):
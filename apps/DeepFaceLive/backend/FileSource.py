@@ -1,4 +1,3 @@
-import time
 from enum import IntEnum
 from pathlib import Path
 
@@ -40,6 +39,7 @@ class FileSourceWorker(BackendWorker):
         self.reemit_frame_signal = reemit_frame_signal
         self.bc_out = bc_out
         self.bcd_uid = 0
+        self.last_bcd_content = None
         self.pending_bcd = None
         self.fp : lib_player.FramePlayer = None
         self.last_p_frame = None
@@ -272,6 +272,7 @@ class FileSourceWorker(BackendWorker):
                 p_frame = pr.new_frame
                 if p_frame is not None:
                     self.bcd_uid += 1
+                    self.weak_heap.count_frame()
                 elif reemit_frame and self.last_p_frame is not None:
                     p_frame = self.last_p_frame
 
@@ -289,18 +290,34 @@ class FileSourceWorker(BackendWorker):
                     bcd.set_frame_timestamp(p_frame.timestamp)
                     bcd.set_frame_image_name(p_frame.name)
 
-                    image = ImageProcessor(p_frame.image).to_uint8().get_image('HWC')
-                    bcd.set_image(p_frame.name, image)
+                    # reemitted frame reuses the image in the weak heap,
+                    # thus the stages can reuse their cached outputs
+                    if pr.new_frame is None and self.last_bcd_content is not None:
+                        bcd.load_content(self.last_bcd_content)
 
-                    self.stop_profile_timing()
+                    if bcd.get_image_shape_dtype(p_frame.name)[0] is None or not bcd.is_weak_heap_valid():
+                        image = ImageProcessor(p_frame.image).to_uint8().get_image('HWC')
+                        bcd.set_image(p_frame.name, image)
+                    self.last_bcd_content = bcd.dump_content()
+
+                    self.stop_profile_timing(bcd)
                     self.pending_bcd = bcd
 
+        # the realtime player should not miss the time of the next frame,
+        # not realtime player takes the next frame only after the pending frame is sent
+        time_to_next_frame = self.fp.get_time_to_next_frame() if self.fp is not None else None
+        if time_to_next_frame is None or (self.pending_bcd is not None and not self.fp.get_is_realtime()):
+            timeout = 0.005
+        else:
+            timeout = min(0.005, time_to_next_frame)
+
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=timeout):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-
-        time.sleep(0.001)
+        elif timeout != 0:
+            # nothing to send: player is paused or waits for the time of the next frame
+            self.reemit_frame_signal.wait(timeout)
 
     def on_stop(self):
         self.set_fp(None)
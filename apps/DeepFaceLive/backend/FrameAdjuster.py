@@ -1,4 +1,3 @@
-import time
 
 import numpy as np
 from xlib import os as lib_os
@@ -72,26 +71,26 @@ class FrameAdjusterWorker(BackendWorker):
             if bcd is not None:
                 bcd.assign_weak_heap(self.weak_heap)
 
-                frame_image_name = bcd.get_frame_image_name()
-                frame_image = bcd.get_image(frame_image_name)
+                if not self.restore_stage_cache(bcd):
+                    frame_image_name = bcd.get_frame_image_name()
+                    frame_image = bcd.get_image(frame_image_name)
 
-                if frame_image is not None:
-                    frame_image_ip = ImageProcessor(frame_image)
-                    frame_image_ip.median_blur(5, opacity=state.median_blur_per / 100.0 )
-                    frame_image_ip.reresize( state.degrade_bicubic_per / 100.0, interpolation=ImageProcessor.Interpolation.CUBIC)
+                    if frame_image is not None:
+                        frame_image_ip = ImageProcessor(frame_image)
+                        frame_image_ip.median_blur(5, opacity=state.median_blur_per / 100.0 )
+                        frame_image_ip.reresize( state.degrade_bicubic_per / 100.0, interpolation=ImageProcessor.Interpolation.CUBIC)
 
-                    frame_image = frame_image_ip.get_image('HWC')
-                    bcd.set_image(frame_image_name, frame_image)
+                        frame_image = frame_image_ip.get_image('HWC')
+                        bcd.set_image(frame_image_name, frame_image)
+                    self.store_stage_cache(bcd)
 
-                self.stop_profile_timing()
+                self.stop_profile_timing(bcd)
                 self.pending_bcd = bcd
 
         if self.pending_bcd is not None:
-            if self.bc_out.is_full_read(1):
+            if self.bc_out.wait_for_full_read(1, timeout=0.005):
                 self.bc_out.write(self.pending_bcd)
                 self.pending_bcd = None
-            else:
-                time.sleep(0.001)
 
 class Sheet:
     class Host(lib_csw.Sheet.Host):
@@ -8,7 +8,7 @@ from xlib import cv as lib_cv
 from xlib import logic as lib_logic
 from xlib import os as lib_os
 from xlib import time as lib_time
-from xlib.image import ImageProcessor
+from xlib.image import ImageArena, ImageProcessor
 from xlib.mp import csw as lib_csw
 from xlib.streamer import FFMPEGStreamer
 
@@ -75,6 +75,9 @@ class StreamOutputWorker(BackendWorker):
 
         self.prev_frame_num = -1
 
+        # the frame of sequence is written before the next one is processed
+        self.sequence_image_arena = ImageArena()
+
         self._wnd_name = 'DeepFaceLive output'
         self._wnd_showing = False
 
@@ -269,11 +272,12 @@ class StreamOutputWorker(BackendWorker):
 
                 elif source_type in [SourceType.SOURCE_N_MERGED_FRAME, SourceType.SOURCE_N_MERGED_FRAME_OR_SOURCE_FRAME]:
                     source_frame = bcd.get_image(bcd.get_frame_image_name())
-                    if source_frame is not None:
-                        source_frame = ImageProcessor(source_frame).to_ufloat32().get_image('HWC')
-
                     merged_frame = bcd.get_image(bcd.get_merged_image_name())
 
+                    if source_frame is not None:
+                        # merged frame is uint8 or float32 depending on FaceMerger output format
+                        source_frame = ImageProcessor(source_frame).to_dtype(merged_frame.dtype if merged_frame is not None else np.uint8).get_image('HWC')
+
                     if merged_frame is None and source_type == SourceType.SOURCE_N_MERGED_FRAME_OR_SOURCE_FRAME:
                         merged_frame = source_frame
 
@@ -302,7 +306,7 @@ class StreamOutputWorker(BackendWorker):
                     buffered_frames.add_buffer( bcd.get_frame_timestamp(), view_image )
 
                     if state.sequence_path is not None:
-                        img = ImageProcessor(view_image, copy=True).to_uint8().get_image('HWC')
+                        img = ImageProcessor(view_image, arena=self.sequence_image_arena).to_uint8().get_image('HWC')
 
                         file_ext, cv_args = '.jpg', [int(cv2.IMWRITE_JPEG_QUALITY), 100]
 
@@ -323,6 +327,8 @@ class StreamOutputWorker(BackendWorker):
                     if state.is_showing_window:
                         cv2.imshow(self._wnd_name, img)
 
+            self.report_latency(bcd)
+
         if state.is_showing_window:
             cv2.waitKey(1)
 
@@ -1,6 +1,8 @@
 from .BackendBase import (BackendConnection, BackendConnectionData, BackendDB,
-                          BackendHost, BackendSignal, BackendWeakHeap,
-                          BackendWorker)
+                          BackendHost, BackendLatencyAggregator,
+                          BackendLocalConnection, BackendReorderConnection,
+                          BackendSignal, BackendWeakHeap, BackendWorker,
+                          BackendWorkerGroup)
 from .CameraSource import CameraSource
 from .FaceAligner import FaceAligner
 from .FaceAnimator import FaceAnimator
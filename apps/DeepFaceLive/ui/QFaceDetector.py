@@ -49,6 +49,9 @@ class QFaceDetector(QBackendPanel):
         q_temporal_smoothing_label = QLabelPopupInfo(label=L('@QFaceDetector.temporal_smoothing'), popup_info_text=L('@QFaceDetector.help.temporal_smoothing') )
         q_temporal_smoothing = QSpinBoxCSWNumber(cs.temporal_smoothing, reflect_state_widgets=[q_temporal_smoothing_label])
 
+        q_detect_every_label = QLabelPopupInfo(label=L('@QFaceDetector.detect_every'), popup_info_text=L('@QFaceDetector.help.detect_every') )
+        q_detect_every       = QSpinBoxCSWNumber(cs.detect_every, reflect_state_widgets=[q_detect_every_label])
+
         grid_l = qtx.QXGridLayout(vertical_spacing=5, horizontal_spacing=5)
         row = 0
         grid_l.addWidget(q_detector_type_label, row, 0, 1, 1, alignment=qtx.AlignRight | qtx.AlignVCenter)
@@ -68,6 +71,8 @@ class QFaceDetector(QBackendPanel):
         row += 1
         grid_l.addLayout( qtx.QXHBoxLayout([q_temporal_smoothing_label, 5, q_temporal_smoothing]), row, 0, 1, 4, alignment=qtx.AlignCenter)
         row += 1
+        grid_l.addLayout( qtx.QXHBoxLayout([q_detect_every_label, 5, q_detect_every]), row, 0, 1, 4, alignment=qtx.AlignCenter)
+        row += 1
         grid_l.addWidget(q_detected_faces, row, 0, 1, 4)
         row += 1
         super().__init__(backend, L('@QFaceDetector.module_title'), layout=qtx.QXVBoxLayout([grid_l]))
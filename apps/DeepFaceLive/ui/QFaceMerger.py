@@ -52,6 +52,9 @@ class QFaceMerger(QBackendPanel):
         q_face_opacity_label = QLabelPopupInfo(label=L('@QFaceMerger.face_opacity') )
         q_face_opacity       = QSliderCSWNumber(cs.face_opacity, reflect_state_widgets=[q_face_opacity_label])
 
+        q_output_format_label = QLabelPopupInfo(label=L('@QFaceMerger.output_format'), popup_info_text=L('@QFaceMerger.help.output_format'))
+        q_output_format       = QComboBoxCSWDynamicSingleSwitch(cs.output_format, reflect_state_widgets=[q_output_format_label])
+
         grid_l = qtx.QXGridLayout(spacing=5)
         row = 0
         grid_l.addWidget(q_device_label, row, 0, alignment=qtx.AlignRight | qtx.AlignVCenter)
@@ -83,6 +86,9 @@ class QFaceMerger(QBackendPanel):
         grid_l.addWidget(q_face_opacity_label, row, 0, alignment=qtx.AlignRight | qtx.AlignVCenter)
         grid_l.addWidget(q_face_opacity, row, 1)
         row += 1
+        grid_l.addWidget(q_output_format_label, row, 0, alignment=qtx.AlignRight | qtx.AlignVCenter)
+        grid_l.addWidget(q_output_format, row, 1)
+        row += 1
 
         super().__init__(backend, L('@QFaceMerger.module_title'),
                          layout=qtx.QXVBoxLayout([grid_l]) )
@@ -31,6 +31,9 @@ class QFaceSwapDFM(QBackendPanel):
         q_model_label = QLabelPopupInfo(label=L('@QFaceSwapDFM.model'), popup_info_text=L('@QFaceSwapDFM.help.model') )
         q_model       = QComboBoxCSWDynamicSingleSwitch(cs.model, reflect_state_widgets=[q_model_label, btn_open_folder])
 
+        q_preload_model_label = QLabelPopupInfo(label=L('@QFaceSwapDFM.preload_model'), popup_info_text=L('@QFaceSwapDFM.help.preload_model') )
+        q_preload_model       = QComboBoxCSWDynamicSingleSwitch(cs.preload_model, reflect_state_widgets=[q_preload_model_label])
+
         q_model_dl_error = self._q_model_dl_error = QErrorCSWError(cs.model_dl_error)
         q_model_dl_progress = self._q_model_dl_progress = QProgressBarCSWProgress(cs.model_dl_progress)
 
@@ -71,6 +74,9 @@ class QFaceSwapDFM(QBackendPanel):
         grid_l.addWidget(q_model_label, row, 0, alignment=qtx.AlignRight | qtx.AlignVCenter  )
         grid_l.addLayout(qtx.QXHBoxLayout([q_model, 2, btn_open_folder, 2, q_model_info_label]), row, 1 )
         row += 1
+        grid_l.addWidget(q_preload_model_label, row, 0, alignment=qtx.AlignRight | qtx.AlignVCenter  )
+        grid_l.addWidget(q_preload_model, row, 1, alignment=qtx.AlignLeft )
+        row += 1
         grid_l.addWidget(q_model_dl_progress, row, 0, 1, 2 )
         row += 1
         grid_l.addWidget(q_model_dl_error, row, 0, 1, 2 )
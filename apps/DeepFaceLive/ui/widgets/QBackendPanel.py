@@ -1,6 +1,7 @@
 from localization import L
 from resources.fonts import QXFontDB
 from resources.gfx import QXImageDB, QXImageSequenceDB
+from xlib import onnxruntime as lib_ort
 from xlib import qt as qtx
 
 from ...backend import BackendHost
@@ -30,10 +31,12 @@ class QBackendPanel(qtx.QXWidget):
                                                                    fixed_width=20)
 
         fps_label = self._fps_label = qtx.QXLabel()
+        threads_label = self._threads_label = qtx.QXLabel(font=QXFontDB.get_default_font(8))
 
         bar_widget = self._bar_widget = \
             qtx.QXFrameHBox(widgets=[btn_on_off, 1, btn_reset_state, 2,
                                      qtx.QXLabel(name, font=QXFontDB.get_default_font(10)),
+                                     (threads_label, qtx.AlignRight), 4,
                                      (fps_label, qtx.AlignRight), 2],
                             size_policy=('expanding', 'fixed'), fixed_height=24)
 
@@ -73,6 +76,16 @@ class QBackendPanel(qtx.QXWidget):
             qtx.hide_and_disable([self._content_widget, self._fps_label])
             self._fps_label.setText(None)
 
+        # cpu threads allocated to the process, see lib_ort.allocate_threads()
+        thread_allocation = lib_ort.get_thread_allocation().get(backend.__class__.__name__, None)
+        if started and thread_allocation is not None:
+            num_threads, cpus = thread_allocation
+            self._threads_label.setText(f"{num_threads} {L('@QBackendPanel.threads')}")
+            self._threads_label.setToolTip('' if cpus is None else f"CPU {', '.join(str(cpu) for cpu in cpus)}")
+            qtx.show_and_enable([self._threads_label])
+        else:
+            qtx.hide_and_disable([self._threads_label])
+
     def _on_backend_profile_timing(self, timing : float):
         fps = int(1.0 / timing if timing != 0 else 0)
         if fps < 10:
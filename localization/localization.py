@@ -111,6 +111,15 @@ class Localization:
                 'ja-JP' : 'フレームレート',
                 'de-DE' : 'FPS'},
 
+    'QBackendPanel.threads':{
+                'en-US' : 'threads',
+                'ru-RU' : 'потоков',
+                'zh-CN' : '线程',
+                'es-ES' : 'hilos',
+                'it-IT' : 'thread',
+                'ja-JP' : 'スレッド',
+                'de-DE' : 'Threads'},
+
     'QDFLAppWindow.file':{
                 'en-US' : 'File',
                 'ru-RU' : 'Файл',
@@ -202,6 +211,60 @@ class Localization:
                 'ja-JP' : '通常',
                 'de-DE' : 'Normal'},
 
+    'QDFLAppWindow.cpu_threads':{
+                'en-US' : 'CPU threads',
+                'ru-RU' : 'Потоки CPU',
+                'zh-CN' : 'CPU线程',
+                'es-ES' : 'Hilos de CPU',
+                'it-IT' : 'Thread della CPU',
+                'ja-JP' : 'CPUスレッド',
+                'de-DE' : 'CPU-Threads'},
+
+    'QDFLAppWindow.cpu_threads.auto':{
+                'en-US' : 'Auto',
+                'ru-RU' : 'Авто',
+                'zh-CN' : '自动',
+                'es-ES' : 'Auto',
+                'it-IT' : 'Auto',
+                'ja-JP' : '自動',
+                'de-DE' : 'Auto'},
+
+    'QLiveSwap.frame_heap':{
+                'en-US' : 'Frame heap',
+                'ru-RU' : 'Куча кадров',
+                'zh-CN' : '帧堆',
+                'es-ES' : 'Montón de fotogramas',
+                'it-IT' : 'Heap dei fotogrammi',
+                'ja-JP' : 'フレームヒープ',
+                'de-DE' : 'Frame-Heap'},
+
+    'QLiveSwap.frame_heap.oldest':{
+                'en-US' : 'oldest data',
+                'ru-RU' : 'старейшие данные',
+                'zh-CN' : '最旧数据',
+                'es-ES' : 'datos más antiguos',
+                'it-IT' : 'dati più vecchi',
+                'ja-JP' : '最古のデータ',
+                'de-DE' : 'älteste Daten'},
+
+    'QLiveSwap.frame_heap.failed_lookups':{
+                'en-US' : 'overwritten lookups',
+                'ru-RU' : 'перезаписанные запросы',
+                'zh-CN' : '被覆盖的读取',
+                'es-ES' : 'lecturas sobrescritas',
+                'it-IT' : 'letture sovrascritte',
+                'ja-JP' : '上書きされた読み取り',
+                'de-DE' : 'überschriebene Abrufe'},
+
+    'QLiveSwap.frame_heap.recommended_size':{
+                'en-US' : 'recommended size',
+                'ru-RU' : 'рекомендуемый размер',
+                'zh-CN' : '推荐大小',
+                'es-ES' : 'tamaño recomendado',
+                'it-IT' : 'dimensione consigliata',
+                'ja-JP' : '推奨サイズ',
+                'de-DE' : 'empfohlene Größe'},
+
     'QFileSource.module_title':{
                 'en-US' : 'File source',
                 'ru-RU' : 'Файловый источник',
@@ -518,6 +581,24 @@ class Localization:
                 'ja-JP' : 'フレームの平均化により顔矩形を安定させます\n静止画やウェブカメラ経由の配信に適しています',
                 'de-DE' : 'Stabilisiert das Gesichtsrechteck durch Mittelwertbildung über die Einzelbilder.\nGut geeignet für statische Szenen oder mit einer Webcam.'},
 
+    'QFaceDetector.detect_every':{
+                'en-US' : 'Detect every',
+                'ru-RU' : 'Детектировать каждый',
+                'zh-CN' : '每隔N帧检测',
+                'es-ES' : 'Detectar cada',
+                'it-IT' : 'Rileva ogni',
+                'ja-JP' : '検出間隔',
+                'de-DE' : 'Erkennen alle'},
+
+    'QFaceDetector.help.detect_every':{
+                'en-US' : 'Full frame detection is performed every N frames.\nIn between, faces are tracked by detection only around the faces of the previous frame.\nIf a face is lost, full frame detection is performed immediately.\n1 - detect every frame.',
+                'ru-RU' : 'Детектирование по всему кадру выполняется каждые N кадров.\nМежду ними лица отслеживаются детектированием только вокруг лиц предыдущего кадра.\nЕсли лицо потеряно, сразу выполняется детектирование по всему кадру.\n1 - детектировать каждый кадр.',
+                'zh-CN' : '每N帧进行一次全帧检测。\n其间仅在上一帧人脸周围检测以跟踪人脸。\n如果丢失人脸，立即进行全帧检测。\n1 - 每帧检测。',
+                'es-ES' : 'La detección en el fotograma completo se realiza cada N fotogramas.\nEntre ellas, las caras se siguen detectando solo alrededor de las caras del fotograma anterior.\nSi se pierde una cara, se realiza inmediatamente la detección en el fotograma completo.\n1 - detectar en cada fotograma.',
+                'it-IT' : "Il rilevamento sull'intero fotogramma viene eseguito ogni N fotogrammi.\nNel frattempo, i volti vengono tracciati rilevando solo attorno ai volti del fotogramma precedente.\nSe un volto viene perso, il rilevamento sull'intero fotogramma viene eseguito immediatamente.\n1 - rileva ogni fotogramma.",
+                'ja-JP' : 'Nフレームごとにフレーム全体で検出します\nその間は前フレームの顔の周辺のみで検出して顔を追跡します\n顔を見失った場合はすぐにフレーム全体で検出します\n1 - 毎フレーム検出',
+                'de-DE' : 'Die Erkennung im gesamten Bild wird alle N Bilder durchgeführt.\nDazwischen werden Gesichter nur um die Gesichter des vorherigen Bildes erkannt und verfolgt.\nGeht ein Gesicht verloren, wird sofort im gesamten Bild erkannt.\n1 - jedes Bild erkennen.'},
+
     'QFaceDetector.detected_faces':{
                 'en-US' : 'Detected faces',
                 'ru-RU' : 'Обнаруженные лица',
@@ -815,6 +896,24 @@ class Localization:
                 'ja-JP' : 'モデルファイルをローカルまたはウェブからダウンロードして入力できます\n独自のモデルを作りたいときはDFLでトレーニングできます',
                 'de-DE' : 'Modelldatei aus einem Ordner oder verfügbar zum Herunterladen aus dem Internet.\nSie können Ihr eigenes Modell in DeepFaceLab trainieren.'},
 
+    'QFaceSwapDFM.preload_model':{
+                'en-US' : 'Preload model',
+                'ru-RU' : 'Предзагрузить модель',
+                'zh-CN' : '预加载模型',
+                'es-ES' : 'Precargar modelo',
+                'it-IT' : 'Precarica modello',
+                'ja-JP' : 'モデルを事前読込',
+                'de-DE' : 'Modell vorladen'},
+
+    'QFaceSwapDFM.help.preload_model':{
+                'en-US' : 'Load the model in background while the current model is working.\nRecently used models are kept in memory, so switching between them is instant.',
+                'ru-RU' : 'Загрузить модель в фоне, пока работает текущая модель.\nНедавно использованные модели остаются в памяти, поэтому переключение между ними мгновенное.',
+                'zh-CN' : '在当前模型运行时于后台加载模型。\n最近使用的模型保留在内存中，因此可以即时切换。',
+                'es-ES' : 'Cargar el modelo en segundo plano mientras funciona el modelo actual.\nLos modelos usados recientemente se mantienen en memoria, por lo que el cambio entre ellos es instantáneo.',
+                'it-IT' : 'Carica il modello in background mentre il modello corrente è in funzione.\nI modelli usati di recente restano in memoria, quindi il passaggio tra di essi è istantaneo.',
+                'ja-JP' : '現在のモデルの動作中にバックグラウンドでモデルを読込みます\n最近使用したモデルはメモリに保持され、即座に切替えられます',
+                'de-DE' : 'Das Modell im Hintergrund laden, während das aktuelle Modell arbeitet.\nZuletzt verwendete Modelle bleiben im Speicher, daher ist der Wechsel zwischen ihnen sofort.'},
+
     'QFaceSwapDFM.swap_all_faces':{
                 'en-US' : 'Swap all faces',
                 'ru-RU' : 'Заменить все лица',
@@ -1069,6 +1168,24 @@ class Localization:
                 'ja-JP' : '合成マスクの不透明度',
                 'de-DE' : 'Gesichtsdeckkraft'},
 
+    'QFaceMerger.output_format':{
+                'en-US' : 'Output format',
+                'ru-RU' : 'Формат вывода',
+                'zh-CN' : '输出格式',
+                'es-ES' : 'Formato de salida',
+                'it-IT' : 'Formato di output',
+                'ja-JP' : '出力形式',
+                'de-DE' : 'Ausgabeformat'},
+
+    'QFaceMerger.help.output_format':{
+                'en-US' : 'uint8 - merged frame takes 4 times less memory and is not converted by the next modules.\nfloat32 - keep merged frame in float.',
+                'ru-RU' : 'uint8 - совмещённый кадр занимает в 4 раза меньше памяти и не конвертируется следующими модулями.\nfloat32 - хранить совмещённый кадр во float.',
+                'zh-CN' : 'uint8 - 合成帧占用的内存减少4倍，后续模块无需转换。\nfloat32 - 以浮点格式保存合成帧。',
+                'es-ES' : 'uint8 - el fotograma combinado ocupa 4 veces menos memoria y no es convertido por los siguientes módulos.\nfloat32 - mantener el fotograma combinado en float.',
+                'it-IT' : 'uint8 - il fotogramma unito occupa 4 volte meno memoria e non viene convertito dai moduli successivi.\nfloat32 - mantieni il fotogramma unito in float.',
+                'ja-JP' : 'uint8 - 合成フレームのメモリ使用量が4分の1になり、後続のモジュールで変換されません。\nfloat32 - 合成フレームをfloatのまま保持します。',
+                'de-DE' : 'uint8 - das zusammengeführte Bild benötigt 4-mal weniger Speicher und wird von den nächsten Modulen nicht konvertiert.\nfloat32 - das zusammengeführte Bild in float behalten.'},
+
     'QStreamOutput.module_title':{
                 'en-US' : 'Stream output',
                 'ru-RU' : 'Выходной поток',
@@ -1348,6 +1465,15 @@ class Localization:
                 'ja-JP' : '解像度',
                 'de-DE' : 'Auflösung:'},
 
+    'FaceSwapDFM.cached_models':{
+                'en-US' : 'Models in memory:',
+                'ru-RU' : 'Модели в памяти:',
+                'zh-CN' : '内存中的模型',
+                'es-ES' : 'Modelos en memoria:',
+                'it-IT' : 'Modelli in memoria:',
+                'ja-JP' : 'メモリ内のモデル',
+                'de-DE' : 'Modelle im Speicher:'},
+
     'FaceSwapDFM.downloading_model':{
                 'en-US' : 'Downloading model...',
                 'ru-RU' : 'Загрузка модели...',
@@ -34,6 +34,14 @@ def main():
     def run_DeepFaceLive(args):
         userdata_path = Path(args.userdata_dir)
         lib_appargs.set_arg_bool('NO_CUDA', args.no_cuda)
+        lib_appargs.set_arg_str('FACE_SWAP_REPLICAS', str(args.face_swap_replicas))
+        lib_appargs.set_arg_bool('WEAK_HEAP_SLAB', args.weak_heap_slab)
+        lib_appargs.set_arg_str('WEAK_HEAP_SIZE_MB', str(args.weak_heap_size_mb))
+        lib_appargs.set_arg_bool('FUSED_FRONT_END', args.fused_front_end)
+        lib_appargs.set_arg_str('ORT_CACHE_DIR', '' if args.no_ort_cache else str(userdata_path / 'ort_cache'))
+        lib_appargs.set_arg_bool('CPU_AFFINITY', args.cpu_affinity)
+        lib_appargs.set_arg_str('DFM_CACHE_SIZE_MB', str(args.dfm_cache_size_mb))
+        lib_appargs.set_arg_bool('SHARED_INFERENCE', args.shared_inference)
 
         print('Running DeepFaceLive.')
         from apps.DeepFaceLive.DeepFaceLiveApp import DeepFaceLiveApp
@@ -42,8 +50,33 @@ def main():
     p = run_subparsers.add_parser('DeepFaceLive')
     p.add_argument('--userdata-dir', default=None, action=fixPathAction, help="Workspace directory.")
     p.add_argument('--no-cuda', action="store_true", default=False, help="Disable CUDA.")
+    p.add_argument('--face-swap-replicas', type=int, default=1, help="Number of parallel FaceSwapDFM processes.")
+    p.add_argument('--weak-heap-slab', action="store_true", default=False, help="Use slab allocator for the shared frame heap. Every size of the frames reserves at least 16 slots, thus the heap should be larger than 16 of the largest frames.")
+    p.add_argument('--weak-heap-size-mb', type=int, default=2048, help="Size of the shared frame heap.")
+    p.add_argument('--fused-front-end', action="store_true", default=False, help="Run FaceDetector, FaceMarker and FaceAligner in one process.")
+    p.add_argument('--no-ort-cache', action="store_true", default=False, help="Do not cache optimized models.")
+    p.add_argument('--cpu-affinity', action="store_true", default=False, help="Pin the processes of the neural network modules to separate sets of CPUs.")
+    p.add_argument('--dfm-cache-size-mb', type=int, default=4096, help="Memory for recently used DFM models kept loaded in FaceSwapDFM.")
+    p.add_argument('--shared-inference', action="store_true", default=False, help="Run the face detection and marker models used by several modules in one shared process.")
     p.set_defaults(func=run_DeepFaceLive)
 
+    def run_DeepFaceLiveHeadless(args):
+        userdata_path = Path(args.userdata_dir)
+        lib_appargs.set_arg_bool('NO_CUDA', args.no_cuda)
+        lib_appargs.set_arg_str('ORT_CACHE_DIR', '' if args.no_ort_cache else str(userdata_path / 'ort_cache'))
+
+        print('Running DeepFaceLive headless.')
+        from apps.DeepFaceLive.DeepFaceLiveHeadlessApp import \
+            DeepFaceLiveHeadlessApp
+        DeepFaceLiveHeadlessApp(userdata_path=userdata_path, config_path=Path(args.config_path)).run()
+
+    p = run_subparsers.add_parser('DeepFaceLiveHeadless')
+    p.add_argument('--userdata-dir', default=None, action=fixPathAction, help="Workspace directory.")
+    p.add_argument('--config-path', required=True, action=fixPathAction, help=".json config file of the headless run.")
+    p.add_argument('--no-cuda', action="store_true", default=False, help="Disable CUDA.")
+    p.add_argument('--no-ort-cache', action="store_true", default=False, help="Do not cache optimized models.")
+    p.set_defaults(func=run_DeepFaceLiveHeadless)
+
     dev_parser = subparsers.add_parser("dev")
     dev_subparsers = dev_parser.add_subparsers()
 
@@ -62,6 +95,35 @@ def main():
     p.add_argument('--delete-parts', action="store_true", default=False)
     p.set_defaults(func=run_merge_large_files)
 
+    def run_quantize_dfm(args):
+        from modelhub import quantize
+        quantize.quantize_dfm_model(Path(args.model_path), Path(args.video_path), max_frames=args.max_frames, static=not args.dynamic)
+
+    p = dev_subparsers.add_parser('quantize_dfm')
+    p.add_argument('--model-path', default=None, action=fixPathAction, help=".dfm model path")
+    p.add_argument('--video-path', default=None, action=fixPathAction, help="video with the faces to calibrate the model")
+    p.add_argument('--max-frames', type=int, default=200)
+    p.add_argument('--dynamic', action="store_true", default=False, help="quantize the weights only, calibration is not used.")
+    p.set_defaults(func=run_quantize_dfm)
+
+    def run_quantize_yolov5face(args):
+        from modelhub import quantize
+        quantize.quantize_yolov5face(Path(args.video_path), max_frames=args.max_frames, static=not args.dynamic)
+
+    p = dev_subparsers.add_parser('quantize_yolov5face')
+    p.add_argument('--video-path', default=None, action=fixPathAction, help="video to calibrate the model")
+    p.add_argument('--max-frames', type=int, default=200)
+    p.add_argument('--dynamic', action="store_true", default=False, help="quantize the weights only, calibration is not used.")
+    p.set_defaults(func=run_quantize_yolov5face)
+
+    def run_update_dfm_models_sha256(args):
+        from scripts import dev
+        dev.update_dfm_models_sha256(Path(args.models_dir))
+
+    p = dev_subparsers.add_parser('update_dfm_models_sha256')
+    p.add_argument('--models-dir', required=True, action=fixPathAction, help="Directory of the downloaded .dfm models.")
+    p.set_defaults(func=run_update_dfm_models_sha256)
+
     def run_extract_FaceSynthetics(args):
         from scripts import dev
 
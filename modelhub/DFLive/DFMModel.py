@@ -1,23 +1,28 @@
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Iterator, List, Tuple, Union
 
 import numpy as np
 from xlib import onnxruntime as lib_ort
 from xlib import path as lib_path
-from xlib.image import ImageProcessor
-from xlib.net import ThreadFileDownloader
+from xlib.image import ImageArena, ImageProcessor
+from xlib.net import ThreadFileDownloader, load_sha256_manifest
 from xlib.onnxruntime.device import ORTDeviceInfo
 
 
 class DFMModelInfo:
-    def __init__(self, name : str, model_path : Path, url : str = None):
+    def __init__(self, name : str, model_path : Path, url : str = None, sha256 : str = None):
         self._name = name
         self._model_path = model_path
         self._url = url
+        self._sha256 = sha256
 
     def get_name(self) -> str: return self._name
     def get_model_path(self) -> Path: return self._model_path
     def get_url(self) -> Union[str, None]: return self._url
+    def get_sha256(self) -> Union[str, None]: return self._sha256
 
     def __eq__(self, other):
         if self is not None and other is not None and isinstance(self, DFMModelInfo) and isinstance(other, DFMModelInfo):
@@ -67,10 +72,20 @@ def get_available_models_info(models_path : Path) -> List[DFMModelInfo]:
             DFMModelInfo(name='Zahar Lupin', model_path=models_path / f'Zahar_Lupin.dfm', url=rf'https://github.com/iperov/DeepFaceLive/releases/download/ZAHAR_LUPIN/Zahar_Lupin.dfm'),
         ]
 
+    # downloaded models are verified with SHA-256 from the manifest
+    manifest_path = Path(__file__).parent / 'DFMModels.sha256'
+    if manifest_path.exists():
+        manifest = load_sha256_manifest(manifest_path)
+        for dfm_model in dfm_models:
+            dfm_model._sha256 = manifest.get(dfm_model.get_model_path().name, None)
+
     # scan additional models in directory
     dfm_model_paths = [ celeb.get_model_path() for celeb in dfm_models]
 
     for dfm_path in lib_path.get_files_paths(models_path, extensions=['.dfm']):
+        if dfm_path.stem.endswith('.int8'):
+            # quantized variant is loaded by DFMModel instead of the original model on CPU
+            continue
         if dfm_path not in dfm_model_paths:
             dfm_models.append( DFMModelInfo(dfm_path.stem, model_path=dfm_path, ) )
 
@@ -87,8 +102,10 @@ class DFMModel:
         if device is None:
             device = lib_ort.get_cpu_device_info()
         self._model_path = model_path
+        # the quantized variant is loaded on CPU if it exists
+        self._session_model_path = lib_ort.get_session_model_path(model_path, device, prefer_quantized=True)
 
-        sess = self._sess = lib_ort.InferenceSession_with_device(str(model_path), device)
+        sess = self._sess = lib_ort.InferenceSession_with_device(str(model_path), device, prefer_quantized=True)
 
         inputs = sess.get_inputs()
 
@@ -99,6 +116,8 @@ class DFMModel:
                 raise Exception(f'Invalid model {model_path}')
             else:
                 self._input_height, self._input_width = inputs[0].shape[1:3]
+                # batch dim is str or None if dynamic
+                self._is_batched_input = inputs[0].shape[0] != 1
                 self._model_type = 1
                 if len(inputs) == 2:
                     if 'morph_value' not in inputs[1].name:
@@ -107,7 +126,25 @@ class DFMModel:
                 elif len(inputs) > 2:
                     raise Exception(f'Invalid model {model_path}')
 
+        # Inputs and outputs are bound to buffers reused across the frames,
+        # if the resolution of the outputs is fixed.
+        self._input_name = inputs[0].name
+        self._morph_value_name = inputs[1].name if self._model_type == 2 else None
+        self._output_names = [ output.name for output in sess.get_outputs() ]
+        self._output_hwc = [ output.shape[1:4] for output in sess.get_outputs() ]
+        self._use_io_binding = all( isinstance(x, int) for hwc in self._output_hwc for x in hwc )
+        self._in_buf = None
+        self._out_bufs = None
+        # the outputs are not in the arena, they are input of the next convert in two pass mode
+        self._arena = ImageArena()
+
     def get_model_path(self) -> Path: return self._model_path
+    def get_memory_size(self) -> int:
+        """
+        approximate memory size of the model in bytes, measured by the file the session is constructed from
+        """
+        return self._session_model_path.stat().st_size
+
     def get_input_res(self) -> Tuple[int, int]:
         return self._input_width, self._input_height
 
@@ -118,6 +155,9 @@ class DFMModel:
         """
          img    np.ndarray  HW,HWC,NHWC uint8,float32
 
+                            NHWC batch of faces is processed in one run
+                            if the model supports it.
+
          morph_factor   float   used if model supports it
 
         returns
@@ -127,17 +167,47 @@ class DFMModel:
          face_mask  NHW1  same dtype as img
         """
 
-        ip = ImageProcessor(img)
+        ip = ImageProcessor(img, arena=self._arena, lazy=True)
 
         N,H,W,C = ip.get_dims()
         dtype = ip.get_dtype()
 
+        if self._use_io_binding:
+            img = ip.resize( (self._input_width,self._input_height) ).get_image('NHWC')
+            in_buf, out_bufs = self._get_buffers(N)
+
+            # normalize directly to the bound input
+            img = img[...,:3] if C >= 3 else img[...,:1]
+            if img.dtype == np.uint8:
+                np.multiply(img, np.float32(1.0 / 255.0), out=in_buf, casting='unsafe')
+            else:
+                np.copyto(in_buf, img, casting='unsafe')
+
+            if self._is_batched_input or N == 1:
+                self._run_io_binding(in_buf, out_bufs, morph_factor)
+            else:
+                # model has fixed batch dim, run the faces one by one
+                for i in range(N):
+                    self._run_io_binding(in_buf[i:i+1], [ out_buf[i:i+1] for out_buf in out_bufs ], morph_factor)
+
+            out_face_mask, out_celeb, out_celeb_mask = out_bufs
+
+            # outputs must not refer to the bound buffers
+            copy = (W,H) == (self._input_width,self._input_height) and dtype == np.float32
+            out_celeb      = ImageProcessor(out_celeb, copy=copy).resize((W,H)).ch(3).to_dtype(dtype).get_image('NHWC')
+            out_celeb_mask = ImageProcessor(out_celeb_mask, copy=copy).resize((W,H)).ch(1).to_dtype(dtype).get_image('NHWC')
+            out_face_mask  = ImageProcessor(out_face_mask, copy=copy).resize((W,H)).ch(1).to_dtype(dtype).get_image('NHWC')
+
+            return out_celeb, out_celeb_mask, out_face_mask
+
         img = ip.resize( (self._input_width,self._input_height) ).ch(3).to_ufloat32().get_image('NHWC')
 
-        if self._model_type == 1:
-            out_face_mask, out_celeb, out_celeb_mask = self._sess.run(None, {'in_face:0': img})
-        elif self._model_type == 2:
-            out_face_mask, out_celeb, out_celeb_mask = self._sess.run(None, {'in_face:0': img, 'morph_value:0':np.float32([morph_factor]) })
+        if self._is_batched_input or N == 1:
+            out_face_mask, out_celeb, out_celeb_mask = self._run(img, morph_factor)
+        else:
+            # model has fixed batch dim, run the faces one by one
+            outs = [ self._run(img[i:i+1], morph_factor) for i in range(N) ]
+            out_face_mask, out_celeb, out_celeb_mask = [ np.concatenate(x, 0) for x in zip(*outs) ]
 
         out_celeb      = ImageProcessor(out_celeb).resize((W,H)).ch(3).to_dtype(dtype).get_image('NHWC')
         out_celeb_mask = ImageProcessor(out_celeb_mask).resize((W,H)).ch(1).to_dtype(dtype).get_image('NHWC')
@@ -145,6 +215,30 @@ class DFMModel:
 
         return out_celeb, out_celeb_mask, out_face_mask
 
+    def _get_buffers(self, N : int) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        returns input and output buffers for the batch of N,
+        buffers are reallocated only if the batch is larger than before
+        """
+        if self._in_buf is None or self._in_buf.shape[0] < N:
+            self._in_buf = np.empty( (N,self._input_height,self._input_width,3), np.float32 )
+            self._out_bufs = [ np.empty( (N,)+tuple(hwc), np.float32 ) for hwc in self._output_hwc ]
+        return self._in_buf[:N], [ out_buf[:N] for out_buf in self._out_bufs ]
+
+    def _run_io_binding(self, in_buf : np.ndarray, out_bufs : List[np.ndarray], morph_factor):
+        io_binding = self._sess.io_binding()
+        io_binding.bind_input(self._input_name, 'cpu', 0, np.float32, in_buf.shape, in_buf.ctypes.data)
+        if self._model_type == 2:
+            io_binding.bind_cpu_input(self._morph_value_name, np.float32([morph_factor]))
+        for name, out_buf in zip(self._output_names, out_bufs):
+            io_binding.bind_output(name, 'cpu', 0, np.float32, out_buf.shape, out_buf.ctypes.data)
+        self._sess.run_with_iobinding(io_binding)
+
+    def _run(self, img, morph_factor):
+        if self._model_type == 1:
+            return self._sess.run(None, {'in_face:0': img})
+        elif self._model_type == 2:
+            return self._sess.run(None, {'in_face:0': img, 'morph_value:0':np.float32([morph_factor]) })
 
 
 class DFMModelInitializer:
@@ -198,7 +292,7 @@ class DFMModelInitializer:
                         new_status = ERROR
                         events.error = 'Model file is not found and URL is not defined.'
                     else:
-                        downloader = ThreadFileDownloader(url=url, savepath=model_path)
+                        downloader = ThreadFileDownloader(url=url, savepath=model_path, sha256=dfm_model_info.get_sha256())
                         new_status = DOWNLOADING
                 else:
                     error = None
@@ -251,3 +345,102 @@ def DFMModel_from_info(dfm_model_info : DFMModelInfo, device : ORTDeviceInfo = N
     instantiates DFMModelInitializer
     """
     return DFMModelInitializer(dfm_model_info=dfm_model_info, device=device)
+
+
+class DFMModelCache:
+    """
+    LRU cache of initialized DFMModels, so switching between recently used models is instant.
+
+     max_memory_mb(4096)    limit of total memory size of the models,
+                            the least recently used models are removed above the limit,
+                            the model in use is always kept, see put()
+
+    Models can be initialized in background thread while the current model is in use, see preload()
+    """
+    def __init__(self, max_memory_mb : int = 4096):
+        self._max_memory_size = max_memory_mb*1024*1024
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+        self._in_use_key = None
+        self._preload_threads = {}
+        self._preload_errors = []
+
+    def get(self, dfm_model_info : DFMModelInfo, device : ORTDeviceInfo) -> Union[DFMModel, None]:
+        """
+        returns cached DFMModel or None
+        """
+        key = (dfm_model_info, device)
+        with self._lock:
+            dfm_model = self._models.get(key, None)
+            if dfm_model is not None:
+                self._models.move_to_end(key)
+            return dfm_model
+
+    def put(self, dfm_model_info : DFMModelInfo, device : ORTDeviceInfo, dfm_model : DFMModel, in_use : bool = False):
+        """
+         in_use(False)  the model is in use by the caller,
+                        it is never removed from the cache until other model is put in use
+        """
+        key = (dfm_model_info, device)
+        with self._lock:
+            self._models[key] = dfm_model
+            self._models.move_to_end(key)
+            if in_use:
+                self._in_use_key = key
+
+            # the model in use is referenced anyway, thus the others are removed to fit the limit
+            for evict_key in [ evict_key for evict_key in self._models.keys() if evict_key != self._in_use_key ]:
+                if sum(dfm_model.get_memory_size() for dfm_model in self._models.values()) <= self._max_memory_size:
+                    break
+                self._models.pop(evict_key)
+
+    def get_models_info(self) -> List[DFMModelInfo]:
+        """
+        returns list of cached models from least to most recently used
+        """
+        with self._lock:
+            return [ dfm_model_info for dfm_model_info, _ in self._models.keys() ]
+
+    def is_preloading(self, dfm_model_info : DFMModelInfo, device : ORTDeviceInfo) -> bool:
+        with self._lock:
+            return (dfm_model_info, device) in self._preload_threads
+
+    def pop_preload_errors(self) -> List[Tuple[DFMModelInfo, str]]:
+        """
+        returns list of (dfm_model_info, error) of failed preloads since the last call
+        """
+        with self._lock:
+            errors, self._preload_errors = self._preload_errors, []
+            return errors
+
+    def preload(self, dfm_model_info : DFMModelInfo, device : ORTDeviceInfo):
+        """
+        initialize the model in background thread and put it to the cache,
+        the model is downloaded if needed
+
+        The caller should not initialize the same model meanwhile, see is_preloading()
+        """
+        key = (dfm_model_info, device)
+        with self._lock:
+            if key in self._models or key in self._preload_threads:
+                return
+            thread = self._preload_threads[key] = threading.Thread(target=self._preload_thread_proc, args=(dfm_model_info, device), daemon=True)
+        thread.start()
+
+    def _preload_thread_proc(self, dfm_model_info : DFMModelInfo, device : ORTDeviceInfo):
+        initializer = DFMModelInitializer(dfm_model_info, device)
+        error = None
+        while True:
+            events = initializer.process_events()
+            if events.new_status_initialized:
+                self.put(dfm_model_info, device, events.dfm_model)
+                break
+            if events.new_status_error:
+                error = events.error
+                break
+            time.sleep(0.01)
+
+        with self._lock:
+            if error is not None:
+                self._preload_errors.append( (dfm_model_info, error) )
+            self._preload_threads.pop( (dfm_model_info, device) )
@@ -1,3 +1,3 @@
-from .DFMModel import (DFMModel_from_info, DFMModel_from_path,
+from .DFMModel import (DFMModel_from_info, DFMModel_from_path, DFMModelCache,
                           DFMModelInfo, get_available_devices,
                           get_available_models_info)
@@ -35,7 +35,7 @@ class CenterFace:
             raise Exception(f'device_info {device_info} is not in available devices for CenterFace')
 
         path = Path(__file__).parent / 'CenterFace.onnx'
-        self._sess = sess = InferenceSession_with_device(str(path), device_info)
+        self._sess = sess = InferenceSession_with_device(str(path), device_info, prefer_quantized=True)
         self._input_name = sess.get_inputs()[0].name
 
     def extract(self, img, threshold : float = 0.5, fixed_window=0, min_face_size=40):
@@ -54,7 +54,7 @@ class CenterFace:
         returns a list of [l,t,r,b] for every batch dimension of img
         """
 
-        ip = ImageProcessor(img)
+        ip = ImageProcessor(img, lazy=True)
         N,H,W,_ = ip.get_dims()
 
         if fixed_window != 0:
@@ -30,7 +30,7 @@ class InsightFace2D106:
         if not path.exists():
             raise FileNotFoundError(f'{path} not found')
             
-        self._sess = sess = InferenceSession_with_device(str(path), device_info)
+        self._sess = sess = InferenceSession_with_device(str(path), device_info, shared=True)
         self._input_name = sess.get_inputs()[0].name
         self._input_width = 192
         self._input_height = 192
@@ -43,7 +43,7 @@ class InsightFace2D106:
 
         returns (N,106,2)
         """
-        ip = ImageProcessor(img)
+        ip = ImageProcessor(img, lazy=True)
         N,H,W,_ = ip.get_dims()
 
         h_scale = H / self._input_height
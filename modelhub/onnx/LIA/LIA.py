@@ -54,7 +54,7 @@ class LIA:
 
          img    np.ndarray      HW HWC 1HWC   uint8/float32
         """
-        feed_img = ImageProcessor(img).resize(self.get_input_size()).ch(3).swap_ch().to_ufloat32(as_tanh=True).get_image('NCHW')
+        feed_img = ImageProcessor(img, lazy=True).resize(self.get_input_size()).ch(3).swap_ch().to_ufloat32(as_tanh=True).get_image('NCHW')
         return self._generator.run(['out_drv_motion'], {'in_src': np.zeros((1,3,256,256), np.float32), 
                                                         'in_drv': feed_img, 
                                                         'in_drv_start_motion': np.zeros((1,20), np.float32),
@@ -74,12 +74,12 @@ class LIA:
          
          driver_start_motion    reference motion for driver  
         """
-        ip = ImageProcessor(img_source)
+        ip = ImageProcessor(img_source, lazy=True)
         dtype = ip.get_dtype()
         _,H,W,_ = ip.get_dims()
 
         out = self._generator.run(['out'], {'in_src': ip.resize(self.get_input_size()).ch(3).swap_ch().to_ufloat32(as_tanh=True).get_image('NCHW'),
-                                            'in_drv' : ImageProcessor(img_driver).resize(self.get_input_size()).ch(3).swap_ch().to_ufloat32(as_tanh=True).get_image('NCHW'),
+                                            'in_drv' : ImageProcessor(img_driver, lazy=True).resize(self.get_input_size()).ch(3).swap_ch().to_ufloat32(as_tanh=True).get_image('NCHW'),
                                             'in_drv_start_motion' : driver_start_motion,
                                             'in_power' : np.array([power], np.float32)
                                             })[0].transpose(0,2,3,1)[0]
@@ -22,7 +22,7 @@ class S3FD:
         path = Path(__file__).parent / 'S3FD.onnx'
         SplittedFile.merge(path, delete_parts=False)
         
-        self._sess = sess = InferenceSession_with_device(str(path), device_info)
+        self._sess = sess = InferenceSession_with_device(str(path), device_info, prefer_quantized=True)
         self._input_name = sess.get_inputs()[0].name
 
 
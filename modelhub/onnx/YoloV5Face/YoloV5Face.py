@@ -31,7 +31,7 @@ class YoloV5Face:
             raise Exception(f'device_info {device_info} is not in available devices for YoloV5Face')
 
         path = Path(__file__).parent / 'YoloV5Face.onnx'
-        self._sess = sess = InferenceSession_with_device(str(path), device_info)
+        self._sess = sess = InferenceSession_with_device(str(path), device_info, prefer_quantized=True, shared=True)
         self._input_name = sess.get_inputs()[0].name
 
     def extract(self, img, threshold : float = 0.3, fixed_window=0, min_face_size=8, augment=False):
@@ -55,7 +55,7 @@ class YoloV5Face:
         returns a list of [l,t,r,b] for every batch dimension of img
         """
 
-        ip = ImageProcessor(img)
+        ip = ImageProcessor(img, lazy=True)
         _,H,W,_ = ip.get_dims()
         if H > 2048 or W > 2048:
             fixed_window = 2048
@@ -67,9 +67,10 @@ class YoloV5Face:
             ip.pad_to_next_divisor(64, 64)
             img_scale = 1.0
 
-        ip.ch(3).to_ufloat32()
-
         _,H,W,_ = ip.get_dims()
+
+        # folded with NCHW layout in one pass
+        ip.ch(3).to_ufloat32()
         
         preds = self._get_preds(ip.get_image('NCHW'))
 
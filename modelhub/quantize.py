@@ -0,0 +1,180 @@
+"""
+INT8 quantization of the models for CPUExecutionProvider.
+
+Quantized model is saved next to the original model,
+see xlib.onnxruntime.get_quantized_model_path(),
+and is loaded instead of the original model on CPU device.
+"""
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import cv2
+import numpy as np
+import onnxruntime as rt
+from onnxruntime import quantization as ort_quant
+from xlib import onnxruntime as lib_ort
+from xlib.face import ELandmarks2D, FLandmarks2D, FRect
+from xlib.image import ImageProcessor
+
+from .onnx import InsightFace2D106, YoloV5Face
+
+
+def _iter_video_frames(video_path : Path, max_frames : int) -> Iterator[np.ndarray]:
+    """
+    yields max_frames HWC uint8 BGR frames evenly spaced through the video
+    """
+    vcap = cv2.VideoCapture(str(video_path))
+    if not vcap.isOpened():
+        raise Exception(f'Unable to open {video_path}')
+    try:
+        frame_count = int(vcap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, frame_count // max_frames) if frame_count > 0 else 1
+
+        frame_idx = 0
+        yielded = 0
+        while yielded < max_frames:
+            ret, frame = vcap.read()
+            if not ret:
+                break
+            if frame_idx % step == 0:
+                yielded += 1
+                yield frame
+            frame_idx += 1
+    finally:
+        vcap.release()
+
+def _iter_aligned_faces(video_path : Path, max_frames : int, resolution : int) -> Iterator[np.ndarray]:
+    """
+    yields HWC uint8 faces aligned the same way as with default settings of FaceDetector, FaceMarker and FaceAligner
+    """
+    device = lib_ort.get_cpu_device_info()
+    detector = YoloV5Face(device)
+    marker = InsightFace2D106(device)
+
+    for frame in _iter_video_frames(video_path, max_frames):
+        H, W = frame.shape[:2]
+        for l,t,r,b in detector.extract(frame, threshold=0.5, fixed_window=480)[0]:
+            face_urect = FRect.from_ltrb( (l/W, t/H, r/W, b/H) )
+
+            face_image, face_uni_mat = face_urect.cut(frame, 1.6, 192)
+            lmrks = marker.extract(face_image)[0][...,0:2] / (192, 192)
+            face_ulmrks = FLandmarks2D.create(ELandmarks2D.L106, lmrks).transform(face_uni_mat, invert=True)
+
+            face_align_img, _ = face_ulmrks.cut(frame, 2.2, resolution, y_offset=-0.08)
+            yield face_align_img
+
+def _get_dfm_inputs(model_path : Path, video_path : Path, max_frames : int) -> List[Dict[str, np.ndarray]]:
+    inputs = rt.InferenceSession(str(model_path), providers=['CPUExecutionProvider']).get_inputs()
+    H, W = inputs[0].shape[1:3]
+    has_morph_value = len(inputs) == 2
+
+    feeds = []
+    for face_image in _iter_aligned_faces(video_path, max_frames, max(W, H)):
+        feed = { inputs[0].name : ImageProcessor(face_image, lazy=True).resize( (W,H) ).ch(3).to_ufloat32().get_image('NHWC') }
+        if has_morph_value:
+            feed[inputs[1].name] = np.float32([0.75])
+        feeds.append(feed)
+    return feeds
+
+def _get_yolov5face_path() -> Path:
+    return Path(__file__).parent / 'onnx' / 'YoloV5Face' / 'YoloV5Face.onnx'
+
+def _get_yolov5face_inputs(video_path : Path, max_frames : int, fixed_window : int = 480) -> List[Dict[str, np.ndarray]]:
+    input_name = rt.InferenceSession(str(_get_yolov5face_path()), providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    feeds = []
+    for frame in _iter_video_frames(video_path, max_frames):
+        ip = ImageProcessor(frame)
+        ip.fit_in(fixed_window, fixed_window, pad_to_target=True, allow_upscale=False)
+        feeds.append( { input_name : ip.ch(3).to_ufloat32().get_image('NCHW') } )
+    return feeds
+
+
+class _CalibrationDataReader(ort_quant.CalibrationDataReader):
+    def __init__(self, feeds : List[Dict[str, np.ndarray]]):
+        self._iter = iter(feeds)
+
+    def get_next(self):
+        return next(self._iter, None)
+
+
+def quantize_model(model_path : Path, feeds : List[Dict[str, np.ndarray]], static : bool = True, on_report : Callable[[str], None] = print) -> Path:
+    """
+    Quantize the onnx model to INT8 and report the difference of the outputs against the original model.
+
+     model_path     Path
+
+     feeds          list of inputs of the model,
+                    first 3/4 are used for calibration, the rest for the report
+
+     static(True)   static quantization of weights and activations calibrated on feeds,
+                    otherwise dynamic quantization of weights only
+
+    returns path of quantized model
+    """
+    if len(feeds) < 2:
+        raise Exception('Not enough data to calibrate the model.')
+
+    model_path = Path(model_path)
+    output_path = lib_ort.get_quantized_model_path(model_path)
+    tmp_path = output_path.parent / f'{output_path.name}.tmp'
+
+    calib_count = max(1, len(feeds)*3 // 4)
+    calib_feeds, eval_feeds = feeds[:calib_count], feeds[calib_count:]
+
+    on_report(f'Quantizing {model_path.name}, {"static" if static else "dynamic"}, {len(calib_feeds)} calibration samples.')
+    try:
+        # Symbolic shape inference and graph optimization improve the quantization.
+        ort_quant.quant_pre_process(str(model_path), str(tmp_path))
+        input_path = tmp_path
+    except Exception as e:
+        on_report(f'Preprocessing is skipped: {e}')
+        input_path = model_path
+
+    try:
+        if static:
+            # U8S8 QDQ is the fastest format on x64 cpus with VNNI.
+            ort_quant.quantize_static(str(input_path), str(output_path), _CalibrationDataReader(calib_feeds),
+                                      quant_format=ort_quant.QuantFormat.QDQ,
+                                      activation_type=ort_quant.QuantType.QUInt8,
+                                      weight_type=ort_quant.QuantType.QInt8,
+                                      per_channel=True,
+                                      calibrate_method=ort_quant.CalibrationMethod.MinMax)
+        else:
+            ort_quant.quantize_dynamic(str(input_path), str(output_path), weight_type=ort_quant.QuantType.QInt8)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    fp32_sess = rt.InferenceSession(str(model_path), providers=['CPUExecutionProvider'])
+    int8_sess = rt.InferenceSession(str(output_path), providers=['CPUExecutionProvider'])
+    output_names = [ output.name for output in fp32_sess.get_outputs() ]
+
+    diffs = { name : [] for name in output_names }
+    for feed in eval_feeds:
+        for name, fp32_out, int8_out in zip(output_names, fp32_sess.run(None, feed), int8_sess.run(None, feed)):
+            diffs[name].append( np.abs(fp32_out.astype(np.float32) - int8_out.astype(np.float32)) )
+
+    on_report(f'Difference against FP32 on {len(eval_feeds)} samples:')
+    for name in output_names:
+        diff = np.concatenate([ x.reshape(-1) for x in diffs[name] ])
+        on_report(f'{name:32} mean {diff.mean():.5f} max {diff.max():.5f}')
+
+    on_report(f'Saved {output_path}')
+    return output_path
+
+def quantize_dfm_model(model_path : Path, video_path : Path, max_frames : int = 200, static : bool = True) -> Path:
+    """
+    Quantize .dfm model calibrated on the faces of the video.
+
+    returns path of quantized model
+    """
+    return quantize_model(model_path, _get_dfm_inputs(model_path, video_path, max_frames), static=static)
+
+def quantize_yolov5face(video_path : Path, max_frames : int = 200, static : bool = True) -> Path:
+    """
+    Quantize YoloV5Face model calibrated on the frames of the video.
+
+    returns path of quantized model
+    """
+    return quantize_model(_get_yolov5face_path(), _get_yolov5face_inputs(video_path, max_frames), static=static)
@@ -1,3 +1,4 @@
+import time
 from pathlib import Path
 
 import numpy as np
@@ -32,6 +33,35 @@ def split_large_files(delete_original=False):
 
     print('Done')
 
+def update_dfm_models_sha256(models_path : Path):
+    """
+    download the predefined .dfm models missing in models_path
+    and write their SHA-256 to modelhub/DFLive/DFMModels.sha256
+    """
+    from modelhub.DFLive import get_available_models_info
+    from xlib.net import ThreadFileDownloader, get_file_sha256
+
+    manifest_path = repo_root / 'modelhub' / 'DFLive' / 'DFMModels.sha256'
+    lines = [ line for line in manifest_path.read_text(encoding='utf-8').splitlines() if line.startswith('#') ]
+
+    models_path.mkdir(parents=True, exist_ok=True)
+    for dfm_model_info in get_available_models_info(models_path):
+        url = dfm_model_info.get_url()
+        if url is None:
+            continue
+        model_path = dfm_model_info.get_model_path()
+        if not model_path.exists():
+            print(f'Downloading {url}...')
+            downloader = ThreadFileDownloader(url=url, savepath=model_path, sha256=dfm_model_info.get_sha256())
+            while downloader.get_progress() != 100.0 and downloader.get_error() is None:
+                time.sleep(0.5)
+            if downloader.get_error() is not None:
+                raise Exception(f'{url}: {downloader.get_error()}')
+        lines.append(f'{get_file_sha256(model_path)}  {model_path.name}')
+
+    manifest_path.write_text('\n'.join(lines)+'\n', encoding='utf-8')
+    print('Done')
+
 def extract_FaceSynthetics(inputdir_path : Path, faceset_path : Path):
     """
     extract FaceSynthetics dataset https://github.com/microsoft/FaceSynthetics
@@ -1,4 +1,6 @@
-from .kernel32 import (CreateEventW, GetCurrentProcess, GetPriorityClass,
+from .kernel32 import (PROCESS_QUERY_LIMITED_INFORMATION, STILL_ACTIVE,
+                       CloseHandle, CreateEventW, GetCurrentProcess,
+                       GetExitCodeProcess, GetPriorityClass, OpenProcess,
                        PriorityClass, QueryPerformanceCounter,
-                       QueryPerformanceFrequency, SetPriorityClass, Sleep,
-                       WaitForSingleObject)
+                       QueryPerformanceFrequency, SetPriorityClass,
+                       SetProcessAffinityMask, Sleep, WaitForSingleObject)
@@ -1,7 +1,10 @@
-from ctypes import c_void_p, c_wchar_p, POINTER
+from ctypes import c_size_t, c_void_p, c_wchar_p, POINTER
 from ..wintypes import BOOL, DWORD, ERROR, HANDLE, HRESULT, LARGE_INTEGER, dll_import
 
 
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+STILL_ACTIVE = 259
+
 class PriorityClass(DWORD):
     HIGH_PRIORITY_CLASS         = DWORD(0x00000080)
     ABOVE_NORMAL_PRIORITY_CLASS = DWORD(0x00008000)
@@ -14,12 +17,21 @@ class PriorityClass(DWORD):
 @dll_import('kernel32')
 def CreateEventW(lpEventAttributes : c_void_p, bManualReset : BOOL, bInitialState : BOOL, lpName : c_wchar_p) -> HANDLE: ...
 
+@dll_import('kernel32')
+def CloseHandle(hObject : HANDLE) -> BOOL: ...
+
 @dll_import('kernel32')
 def GetCurrentProcess() -> HANDLE: ...
 
+@dll_import('kernel32')
+def GetExitCodeProcess(hProcess : HANDLE, lpExitCode : POINTER(DWORD)) -> BOOL: ...
+
 @dll_import('kernel32')
 def GetPriorityClass(hProcess : HANDLE) -> DWORD: ...
 
+@dll_import('kernel32')
+def OpenProcess(dwDesiredAccess : DWORD, bInheritHandle : BOOL, dwProcessId : DWORD) -> HANDLE: ...
+
 @dll_import('kernel32')
 def QueryPerformanceCounter(lpPerformanceCount : POINTER(LARGE_INTEGER) ) -> BOOL: ...
 
@@ -29,6 +41,9 @@ def QueryPerformanceFrequency(lpFrequency : POINTER(LARGE_INTEGER) ) -> BOOL: ..
 @dll_import('kernel32')
 def SetPriorityClass(hProcess : HANDLE, priority_class : DWORD ) -> BOOL: ...
 
+@dll_import('kernel32')
+def SetProcessAffinityMask(hProcess : HANDLE, dwProcessAffinityMask : c_size_t ) -> BOOL: ...
+
 @dll_import('kernel32')
 def WaitForSingleObject(hHandle : HANDLE, dwMilliseconds : DWORD) -> DWORD:...
 
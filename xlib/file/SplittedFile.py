@@ -1,57 +1,73 @@
+import hashlib
 import itertools
+import json
+import os
+import tempfile
 from pathlib import Path
 from typing import List
 
+_block_size = 16*1024*1024
+
+def _copy_sha256(f_in, f_out, size : int = None) -> str:
+    """
+    copy size bytes or until the end from f_in to f_out if it is not None
+
+    returns SHA-256 hex of the copied data
+    """
+    hash = hashlib.sha256()
+    while size is None or size > 0:
+        b = f_in.read(_block_size if size is None else min(_block_size, size))
+        if len(b) == 0:
+            break
+        hash.update(b)
+        if f_out is not None:
+            f_out.write(b)
+        if size is not None:
+            size -= len(b)
+    return hash.hexdigest()
+
 
 class SplittedFile:
     @staticmethod
     def split(filepath : Path, part_size : int, delete_original = False):
         """
         splits a file to the parts
-        
+
         raises:
             Exception
             FileNotFoundError
         """
         if part_size == 0:
             raise Exception(f'part_size == 0')
-        
+
         if filepath.exists():
             filesize = filepath.stat().st_size
-            
+
             n_parts = filesize // part_size
-            
+
             if filesize - part_size*n_parts != 0:
                 n_parts += 1
-            
+
             if n_parts > 100:
                 raise Exception('n_parts > 100')
-                   
-            b = filepath.read_bytes()
-            for n in range(n_parts):
-                part_filepath = filepath.parent / (filepath.name + f'.part{n}')
-                part_filepath.write_bytes(b[n*part_size:(n+1)*part_size])
-            
-            
+
+            with open(filepath, 'rb') as f_in:
+                for n in range(n_parts):
+                    part_filepath = filepath.parent / (filepath.name + f'.part{n}')
+                    with open(part_filepath, 'wb') as f_out:
+                        _copy_sha256(f_in, f_out, part_size)
+
+
             if delete_original:
                 filepath.unlink()
         else:
             raise FileNotFoundError()
-        
-    
+
     @staticmethod
-    def merge(filepath : Path, delete_parts = False):
+    def get_parts(filepath : Path) -> List[Path]:
         """
-        if filepath does not exist, merges parts of file if they exist
-        
-        example
-        
-        filename.ext.part0
-        filename.ext.part1
-        ...
-        merged to filename.ext
+        returns list of existing parts of file
         """
-        
         parts : List[Path] = []
         for n in itertools.count(start=0):
             part_filepath = filepath.parent / (filepath.name + f'.part{n}')
@@ -59,17 +75,125 @@ class SplittedFile:
                 parts.append(part_filepath)
             else:
                 break
-        
+        return parts
+
+    @staticmethod
+    def _get_manifest_path(filepath : Path) -> Path:
+        return filepath.parent / (filepath.name + '.parts.json')
+
+    @staticmethod
+    def _write_manifest(filepath : Path, manifest):
+        manifest_path = SplittedFile._get_manifest_path(filepath)
+        fd, tmp_path = tempfile.mkstemp(dir=manifest_path.parent, prefix=manifest_path.name+'.', suffix='.tmp')
+        try:
+            with open(fd, 'w') as f:
+                f.write(json.dumps(manifest, indent=4))
+            os.replace(tmp_path, manifest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @staticmethod
+    def _is_merged(filepath : Path, parts : List[Path]) -> bool:
+        """
+        returns True if filepath is merged from current parts
+        """
+        if not filepath.exists():
+            return False
+
+        parts_stat = [ part.stat() for part in parts ]
+        if filepath.stat().st_size != sum(stat.st_size for stat in parts_stat):
+            return False
+
+        try:
+            manifest = json.loads(SplittedFile._get_manifest_path(filepath).read_text())
+            manifest_parts = manifest['parts']
+            if [ x['name'] for x in manifest_parts ] != [ part.name for part in parts ] or \
+               [ x['size'] for x in manifest_parts ] != [ stat.st_size for stat in parts_stat ]:
+                return False
+        except:
+            manifest_parts = None
+
+        if manifest_parts is not None and \
+           all( x['mtime_ns'] == stat.st_mtime_ns for x, stat in zip(manifest_parts, parts_stat) ):
+            return True
+
+        # the parts are touched, or the file is merged without manifest,
+        # compare the hashes of the parts with the recorded hashes or the content of merged file
+        merged_f = open(filepath, 'rb') if manifest_parts is None else None
+        try:
+            new_manifest_parts = []
+            for i, (part, stat) in enumerate(zip(parts, parts_stat)):
+                with open(part, 'rb') as f:
+                    sha256 = _copy_sha256(f, None)
+
+                if manifest_parts is not None:
+                    expected_sha256 = manifest_parts[i]['sha256']
+                else:
+                    expected_sha256 = _copy_sha256(merged_f, None, stat.st_size)
+
+                if sha256 != expected_sha256:
+                    return False
+                new_manifest_parts.append( {'name' : part.name, 'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns, 'sha256' : sha256} )
+        finally:
+            if merged_f is not None:
+                merged_f.close()
+
+        try:
+            SplittedFile._write_manifest(filepath, {'parts' : new_manifest_parts})
+        except:
+            # read-only directory, the check is repeated next time
+            ...
+        return True
+
+    @staticmethod
+    def merge(filepath : Path, delete_parts = False):
+        """
+        merges parts of file if they exist and filepath is not merged from them yet
+
+        example
+
+        filename.ext.part0
+        filename.ext.part1
+        ...
+        merged to filename.ext
+
+        The parts are streamed to temporary file which is renamed to filepath.
+        Sizes and SHA-256 of the parts are recorded to filename.ext.parts.json,
+        thus the merge is skipped if the parts are not changed.
+        """
+        parts = SplittedFile.get_parts(filepath)
+
         if len(parts) != 0:
-            if not filepath.exists():
-                bytes_parts = []
-                for part_filepath in parts:
-                    bytes_parts.append( part_filepath.read_bytes() )
-                
-                b = b''.join(bytes_parts)
-                
-                filepath.write_bytes(b)
-            
+            if not SplittedFile._is_merged(filepath, parts):
+                fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=filepath.name+'.', suffix='.tmp')
+                tmp_path = Path(tmp_path)
+                try:
+                    manifest_parts = []
+                    with open(fd, 'wb') as f_out:
+                        for part in parts:
+                            stat = part.stat()
+                            with open(part, 'rb') as f_in:
+                                sha256 = _copy_sha256(f_in, f_out)
+                            manifest_parts.append( {'name' : part.name, 'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns, 'sha256' : sha256} )
+
+                    # mkstemp creates the file accessible only by the owner, keep the permissions of the parts
+                    os.chmod(tmp_path, parts[0].stat().st_mode & 0o777)
+                    os.replace(tmp_path, filepath)
+                finally:
+                    if tmp_path.exists():
+                        tmp_path.unlink()
+
+                try:
+                    SplittedFile._write_manifest(filepath, {'parts' : manifest_parts})
+                except:
+                    # read-only directory, the parts are compared with the merged file next time
+                    ...
+
             if delete_parts:
                 for part_filepath in parts:
                     part_filepath.unlink()
+
+                manifest_path = SplittedFile._get_manifest_path(filepath)
+                if manifest_path.exists():
+                    manifest_path.unlink()
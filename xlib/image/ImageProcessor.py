@@ -1,10 +1,110 @@
 from enum import IntEnum
-from typing import Tuple, Union
+from typing import List, Tuple, Union
 
 import cv2
 import numexpr as ne
 import numpy as np
 
+
+class ImageArena:
+    """
+    Scratch buffers reused by ImageProcessor across the calls.
+
+    The buffer is keyed by the number of the step in the chain of ops, shape and dtype,
+    thus the same chain applied to the images of the same size does not allocate after the first call.
+
+    The image returned by ImageProcessor with the arena
+    is valid until the next ImageProcessor with the same arena is used.
+
+    Allocations are counted only by the ops supporting the arena:
+    resize, fit_in, ch, to_ufloat32, to_uint8, gamma, gaussian_sharpen, get_image
+
+    Other ops and the ops with mask, for example gamma with mask,
+    still allocate new arrays, which are not counted.
+
+    see ImageProcessorTest for the chains which do not allocate after the first call
+    """
+    def __init__(self):
+        self._buffers = {}
+        self._buffers_ids = set()
+        self._alloc_count = 0
+
+    def get_alloc_count(self) -> int:
+        """
+        returns number of buffers allocated by the arena
+        """
+        return self._alloc_count
+
+    def clear(self):
+        """
+        free the buffers
+        """
+        self._buffers = {}
+        self._buffers_ids = set()
+
+    def is_buffer(self, img : np.ndarray) -> bool:
+        """
+        returns True if img is the buffer of the arena or the view of it
+        """
+        return id(img) in self._buffers_ids or (img.base is not None and id(img.base) in self._buffers_ids)
+
+    def _get_buffer(self, idx : int, shape, dtype) -> np.ndarray:
+        key = (idx, tuple(shape), np.dtype(dtype))
+        buffer = self._buffers.get(key, None)
+        if buffer is None:
+            buffer = self._buffers[key] = np.empty(shape, dtype)
+            self._buffers_ids.add(id(buffer))
+            self._alloc_count += 1
+        return buffer
+
+
+class _LazyPointwise:
+    """
+    pending channel selection and elementwise ops of lazy ImageProcessor,
+    evaluated in one pass as
+
+        img[...,chs] * scale + offset  as dtype
+
+    if quantize, the result is clipped to [0..255] and truncated to uint8
+    """
+    def __init__(self, img : np.ndarray):
+        self.chs = list(range(img.shape[-1]))
+        self.scale = 1.0
+        self.offset = 0.0
+        self.dtype = img.dtype
+        self.quantize = False
+
+    def is_affine_identity(self, img : np.ndarray) -> bool:
+        return self.scale == 1.0 and self.offset == 0.0 and self.dtype == img.dtype and not self.quantize
+
+    def is_identity(self, img : np.ndarray) -> bool:
+        return self.is_affine_identity(img) and self.chs == list(range(img.shape[-1]))
+
+def _ch_view(img : np.ndarray, chs : List[int]) -> np.ndarray:
+    """
+    returns img[...,chs] as a view if possible
+    """
+    c0 = chs[0]
+    if len(chs) > 1 and all(c == c0 for c in chs):
+        return np.broadcast_to(img[...,c0:c0+1], img.shape[:-1] + (len(chs),) )
+    d = chs[1]-c0 if len(chs) > 1 else 1
+    if d != 0 and all(c == c0 + d*i for i, c in enumerate(chs)):
+        stop = chs[-1]+d
+        return img[...,c0:(stop if stop >= 0 else None):d]
+    return img[...,chs]
+
+def _ch_reduce(img : np.ndarray, chs : List[int]) -> Tuple[np.ndarray, List[int]]:
+    """
+    apply the channel selection as a view, except the expanding of a channel
+
+    returns img, chs relative to the img
+    """
+    c0 = chs[0]
+    if len(chs) > 1 and all(c == c0 for c in chs):
+        return img[...,c0:c0+1], [0]*len(chs)
+    return _ch_view(img, chs), list(range(len(chs)))
+
+
 class ImageProcessor:
     """
     Generic image processor for numpy images
@@ -15,10 +115,27 @@ class ImageProcessor:
                         HWC  (3 ndim)
                         NHWC (4 ndim)
 
+     arena(None)    ImageArena
+                    the ops write to the reused buffers of the arena instead of new arrays,
+                    and in place if the image is the buffer of the arena already.
+                    The source image is not changed.
+
+     lazy(False)    resize, ch, swap_ch, to_ufloat32, to_uint8, to_dtype, as_float32 are recorded
+                    and executed in as few passes over memory as possible
+                    on get_image() or any other op, for example
+
+                    resize().ch(3).swap_ch().to_ufloat32().get_image('NCHW')
+
+                    resizes uint8 image and then writes float32 NCHW result in one pass.
+                    uint8 image is resized before the conversion to float
+                    if there are less pixels after resize, the result may differ within rounding.
     """
-    def __init__(self, img : np.ndarray, copy=False):
+    def __init__(self, img : np.ndarray, copy=False, arena : ImageArena = None, lazy=False):
         if copy:
             img = img.copy()
+        self._arena = arena
+        self._arena_idx = 0
+        self._lazy_ops = [] if lazy else None
         ndim = img.ndim
         if ndim not in [2,3,4]:
             raise ValueError(f'img.ndim must be 2,3,4, not {ndim}.')
@@ -40,8 +157,144 @@ class ImageProcessor:
         """
         ip = ImageProcessor.__new__(ImageProcessor)
         ip._img = self._img.copy()
+        ip._arena = None
+        ip._arena_idx = 0
+        ip._lazy_ops = None
         return ip
 
+    @property
+    def _img(self) -> np.ndarray:
+        if self._lazy_ops:
+            self._lazy_flush()
+        return self._img_data
+
+    @_img.setter
+    def _img(self, img : np.ndarray):
+        self._img_data = img
+
+    def _lazy_flush(self, format : str = None) -> Union[np.ndarray, None]:
+        """
+        execute the recorded ops
+
+         format(None)   if NHWC permutation, the result is written in this layout
+
+        returns the image in format or None if it is not written
+        """
+        ops, self._lazy_ops = self._lazy_ops, None
+        try:
+            img = self._img_data
+            pw = _LazyPointwise(img)
+
+            for op, *args in ops:
+                if op == 'resize':
+                    size, interpolation = args
+                    _,H,W,_ = img.shape
+                    TW,TH = size
+                    if W == TW and H == TH:
+                        continue
+
+                    # resize only the selected channels, the expanding is applied after
+                    img, pw.chs = _ch_reduce(img, pw.chs)
+
+                    if not pw.is_affine_identity(img) and \
+                       not (img.dtype == np.uint8 and not pw.quantize and TW*TH <= W*H and \
+                            interpolation in [None, ImageProcessor.Interpolation.NEAREST, ImageProcessor.Interpolation.LINEAR]):
+                        img = self._lazy_eval(img, pw)
+                        pw = _LazyPointwise(img)
+
+                    self._img = img
+                    self.resize(size, interpolation)
+                    img = self._img_data
+
+                elif op == 'ch':
+                    TC, = args
+                    pw.chs = [pw.chs[0]]*TC if TC > len(pw.chs) else pw.chs[:TC]
+
+                elif op == 'swap_ch':
+                    pw.chs = pw.chs[::-1]
+
+                else:
+                    if pw.quantize:
+                        # truncation to uint8 cannot be folded with the next op
+                        img = self._lazy_eval(img, pw)
+                        pw = _LazyPointwise(img)
+
+                    if op == 'as_float32':
+                        pw.dtype = np.float32
+                    elif op == 'to_ufloat32':
+                        as_tanh, from_tanh = args
+                        if pw.dtype == np.uint8:
+                            pw.scale, pw.offset = (1.0/127.5, -1.0) if as_tanh else (1.0/255.0, 0.0)
+                            pw.dtype = np.float32
+                        elif pw.dtype in [np.float32, np.float64] and from_tanh:
+                            pw.scale, pw.offset = pw.scale*0.5, (pw.offset+1.0)*0.5
+                    elif op == 'to_uint8':
+                        from_tanh, = args
+                        if pw.dtype in [np.float32, np.float64]:
+                            if from_tanh:
+                                pw.scale, pw.offset = pw.scale*0.5, (pw.offset+1.0)*0.5
+                            pw.scale, pw.offset = pw.scale*255.0, pw.offset*255.0
+                            pw.dtype = np.uint8
+                            pw.quantize = True
+
+            img, pw.chs = _ch_reduce(img, pw.chs)
+            if pw.is_identity(img):
+                self._img = img
+                return None
+
+            out = None
+            if format is not None and len(format) == 4 and set(format) == set('NHWC'):
+                N,H,W,_ = img.shape
+                dims = {'N':N, 'H':H, 'W':W, 'C':len(pw.chs)}
+                out = self._get_buffer([ dims[s] for s in format ], pw.dtype)
+                img = self._lazy_eval(img, pw, out=out.transpose([ format.index(s) for s in 'NHWC' ]))
+            else:
+                img = self._lazy_eval(img, pw)
+            self._img = img
+            return out
+        finally:
+            self._lazy_ops = []
+
+    def _lazy_eval(self, img : np.ndarray, pw : _LazyPointwise, out : np.ndarray = None) -> np.ndarray:
+        """
+        evaluate pending pointwise ops of img in one pass,
+        to out if specified, which can be a strided view
+        """
+        src = _ch_view(img, pw.chs)
+        if out is None:
+            out = self._get_buffer(src.shape, pw.dtype)
+
+        ftype = np.float64 if src.dtype == np.float64 else np.float32
+        if pw.quantize:
+            tmp = np.multiply(src, ftype(pw.scale), dtype=ftype)
+            if pw.offset != 0.0:
+                tmp += ftype(pw.offset)
+            np.clip(tmp, 0, 255, out=tmp)
+            np.copyto(out, tmp, casting='unsafe')
+        elif pw.scale != 1.0 or pw.offset != 0.0:
+            np.multiply(src, ftype(pw.scale), out=out, casting='unsafe')
+            if pw.offset != 0.0:
+                np.add(out, ftype(pw.offset), out=out, casting='unsafe')
+        else:
+            np.copyto(out, src, casting='unsafe')
+        return out
+
+    def _get_buffer(self, shape, dtype) -> np.ndarray:
+        """
+        returns buffer for the output of the op, from the arena if it is set
+        """
+        if self._arena is None:
+            return np.empty(shape, dtype)
+        buffer = self._arena._get_buffer(self._arena_idx, shape, dtype)
+        self._arena_idx += 1
+        return buffer
+
+    def _is_own_image(self) -> bool:
+        """
+        returns True if the image can be changed in place
+        """
+        return self._arena is not None and self._arena.is_buffer(self._img)
+
     def get_dims(self) -> Tuple[int,int,int,int]:
         """
         returns dimensions of current working image
@@ -58,7 +311,8 @@ class ImageProcessor:
         self.to_ufloat32()
         img = orig_img = self._img
 
-        img = np.power(img, np.array([1.0 / blue, 1.0 / green, 1.0 / red], np.float32) )
+        out = img if mask is None and self._is_own_image() else self._get_buffer(img.shape, np.float32)
+        img = np.power(img, np.array([1.0 / blue, 1.0 / green, 1.0 / red], np.float32), out=out)
         np.clip(img, 0, 1.0, out=img)
 
         if mask is not None:
@@ -133,8 +387,9 @@ class ImageProcessor:
 
         if scale != 1.0:
             img = img.transpose( (1,2,0,3) ).reshape( (H,W,N*C) )
-            img = cv2.resize (img, ( int(W*scale), int(H*scale) ), interpolation=ImageProcessor.Interpolation.LINEAR)
-            H,W = img.shape[0:2]
+            TW_, TH_ = int(W*scale), int(H*scale)
+            img = cv2.resize (img, ( TW_, TH_ ), dst=self._get_buffer( (TH_,TW_,N*C), img.dtype), interpolation=ImageProcessor.Interpolation.LINEAR)
+            H,W = TH_, TW_
             img = img.reshape( (H,W,N,C) ).transpose( (2,0,1,3) )
 
         if pad_to_target:
@@ -242,8 +497,9 @@ class ImageProcessor:
 
         img = img.transpose( (1,2,0,3) ).reshape( (H,W,N*C) )
 
-        img = cv2.addWeighted(img, 1.0 + power,
-                              cv2.GaussianBlur(img, (0, 0), sigma), -power, 0)
+        img_blur = cv2.GaussianBlur(img, (0, 0), sigma, dst=self._get_buffer(img.shape, img.dtype))
+        # elementwise, thus is written over the blurred image
+        img = cv2.addWeighted(img, 1.0 + power, img_blur, -power, 0, dst=img_blur)
         img = np.clip(img, 0, 1, out=img)
         img = img.reshape( (H,W,N,C) ).transpose( (2,0,1,3) )
 
@@ -717,6 +973,10 @@ class ImageProcessor:
         zero dim will be set to 1
         """
         format = format.upper()
+        if self._lazy_ops is not None:
+            out = self._lazy_flush(format)
+            if out is not None:
+                return out
         img = self._img
 
         # First slice missing dims
@@ -738,6 +998,11 @@ class ImageProcessor:
             transpose_order = [ d[s] for s in format ]
             img = img.transpose(transpose_order)
 
+        if not img.flags.c_contiguous and self._arena is not None:
+            out = self._get_buffer(img.shape, img.dtype)
+            np.copyto(out, img)
+            return out
+
         return np.ascontiguousarray(img)
 
     def ch(self, TC : int) -> 'ImageProcessor':
@@ -746,16 +1011,21 @@ class ImageProcessor:
 
          TC     int     >= 1
         """
-        img = self._img
-        N,H,W,C = img.shape
-
         if TC <= 0:
             raise ValueError(f'channels must be positive value, not {TC}')
 
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('ch', TC) )
+            return self
+
+        img = self._img
+        N,H,W,C = img.shape
+
         if TC > C:
             # Ch expand
-            img = img[...,0:1]  # Clip to single ch first.
-            img = np.repeat (img, TC, -1) # Expand by repeat
+            out = self._get_buffer( (N,H,W,TC), img.dtype)
+            out[...] = img[...,0:1] # Expand first ch
+            img = out
         elif TC < C:
             # Ch reduction  clip
             img = img[...,:TC]
@@ -787,6 +1057,10 @@ class ImageProcessor:
         """
         resize to (W,H)
         """
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('resize', size, interpolation) )
+            return self
+
         img = self._img
         N,H,W,C = img.shape
 
@@ -796,7 +1070,7 @@ class ImageProcessor:
                 interpolation = ImageProcessor.Interpolation.LINEAR
 
             img = img.transpose( (1,2,0,3) ).reshape( (H,W,N*C) )
-            img = cv2.resize (img, (TW, TH), interpolation=_cv_inter[interpolation])
+            img = cv2.resize (img, (TW, TH), dst=self._get_buffer( (TH,TW,N*C), img.dtype), interpolation=_cv_inter[interpolation])
             img = img.reshape( (TH,TW,N,C) ).transpose( (2,0,1,3) )
 
             self._img = img
@@ -822,6 +1096,9 @@ class ImageProcessor:
 
     def swap_ch(self) -> 'ImageProcessor':
         """swaps order of channels"""
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('swap_ch',) )
+            return self
         self._img = self._img[...,::-1]
         return self
 
@@ -829,6 +1106,9 @@ class ImageProcessor:
         """
         change image format to float32
         """
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('as_float32',) )
+            return self
         self._img = self._img.astype(np.float32)
         return self
 
@@ -851,16 +1131,21 @@ class ImageProcessor:
         """
         Convert to uniform float32
         """
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('to_ufloat32', as_tanh, from_tanh) )
+            return self
+
         if self._img.dtype == np.uint8:
-            self._img = self._img.astype(np.float32)
+            img = np.divide(self._img, np.float32(127.5 if as_tanh else 255.0), out=self._get_buffer(self._img.shape, np.float32))
             if as_tanh:
-                self._img /= 127.5
-                self._img -= 1.0
-            else:
-                self._img /= 255.0
+                img -= 1.0
+            self._img = img
         elif self._img.dtype in [np.float32, np.float64]:
             if from_tanh:
-                self._img += 1.0
+                if self._arena is not None and not self._is_own_image():
+                    self._img = np.add(self._img, 1.0, out=self._get_buffer(self._img.shape, self._img.dtype))
+                else:
+                    self._img += 1.0
                 self._img /= 2.0
 
         return self
@@ -871,9 +1156,18 @@ class ImageProcessor:
 
         if current image dtype is float32/64, then image will be multiplied by *255
         """
+        if self._lazy_ops is not None:
+            self._lazy_ops.append( ('to_uint8', from_tanh) )
+            return self
+
         img = self._img
 
         if img.dtype in [np.float32, np.float64]:
+            if self._arena is not None and not self._is_own_image():
+                # do not change the source image
+                out = self._get_buffer(img.shape, img.dtype)
+                np.copyto(out, img)
+                img = out
             if from_tanh:
                 img += 1.0
                 img /= 2.0
@@ -881,7 +1175,11 @@ class ImageProcessor:
             img *= 255.0
             np.clip(img, 0, 255, out=img)
 
-        self._img = img.astype(np.uint8, copy=False)
+            out = self._get_buffer(img.shape, np.uint8)
+            np.copyto(out, img, casting='unsafe')
+            img = out
+
+        self._img = img
         return self
 
     def _check_normalize_mask(self, mask : np.ndarray):
@@ -0,0 +1,60 @@
+import numpy as np
+
+from .ImageProcessor import ImageArena, ImageProcessor
+
+
+class ImageProcessorTest():
+
+    def test_all():
+        test_funcs = [
+                        image_arena_camera_source_test,
+                        image_arena_dfm_test,
+                    ]
+
+        for test_func in test_funcs:
+            print(f'{test_func.__name__}()')
+            test_func()
+
+        print('Done.')
+
+def _check_no_alloc(name, arena : ImageArena, chain_func):
+    """
+    run the chain twice on the same arena, the second run must not allocate
+    """
+    chain_func()
+    alloc_count = arena.get_alloc_count()
+    chain_func()
+    if arena.get_alloc_count() != alloc_count:
+        raise Exception(f'{name}: {arena.get_alloc_count()-alloc_count} allocations on the second run')
+
+def image_arena_camera_source_test():
+    # the chain of CameraSource
+    arena = ImageArena()
+    img = np.random.randint(0, 256, size=(480,640,3), dtype=np.uint8)
+
+    def chain_func():
+        ip = ImageProcessor(img, arena=arena)
+        ip.ch(3).to_uint8()
+        ip.fit_in(TW=320)
+        ip.rotate90()
+        ip.flip_horizontal()
+        ip.get_image('HWC')
+
+    _check_no_alloc('CameraSource', arena, chain_func)
+
+def image_arena_dfm_test():
+    # the chains of DFMModel.convert() and FaceSwapDFM
+    arena = ImageArena()
+    face_align_images = np.random.uniform(0, 1, size=(2,256,256,3)).astype(np.float32)
+    face_images = np.random.randint(0, 256, size=(2,256,256,3), dtype=np.uint8)
+
+    def chain_func():
+        ip = ImageProcessor(face_align_images, arena=arena)
+        ip.gaussian_sharpen(sigma=1.0, power=0.5)
+        ip.gamma(0.9, 1.0, 1.1)
+        ip.get_image('NHWC')
+
+        ImageProcessor(face_images, arena=arena, lazy=True).resize( (224,224) ).ch(3).to_ufloat32().get_image('NHWC')
+        ImageProcessor(face_align_images, arena=arena).gamma(1.1, 1.0, 0.9).get_image('NHWC')
+
+    _check_no_alloc('DFM', arena, chain_func)
@@ -1,2 +1,3 @@
-from .ImageProcessor import ImageProcessor
-from ._misc import get_NHWC_shape
\ No newline at end of file
+from .ImageProcessor import ImageArena, ImageProcessor
+from ._misc import get_NHWC_shape
+from .ImageProcessorTest import ImageProcessorTest
\ No newline at end of file
@@ -15,13 +15,23 @@ class MPSPSCMRRingData:
     Side readers can read last data without locks.
 
     The data returned is either valid or None.
+
+    Producer and Consumer can wait for each other without polling,
+    see wait_for_read() and wait_for_consumed()
+
+        multi_producer(False)   allow multiple Producers, write() is locked
+
+        multi_consumer(False)   allow multiple Consumers, read() is locked,
+                                every data is read by one of the Consumers
     """
 
-    def __init__(self, table_size, heap_size_mb, multi_producer : bool = False):
+    def __init__(self, table_size, heap_size_mb, multi_producer : bool = False, multi_consumer : bool = False):
         self._table_size = table_size
         self._heap_size = heap_size = heap_size_mb*1024*1024
         self._write_lock = multiprocessing.Lock() if multi_producer else None
-        self._event = multiprocessing.Event()
+        self._read_lock = multiprocessing.Lock() if multi_consumer else None
+        self._event = multiprocessing.Event()      # set on data written
+        self._read_event = multiprocessing.Event() # set on data consumed
 
         self._sizeof_uuid = 16
 
@@ -62,6 +72,41 @@ class MPSPSCMRRingData:
     def get_write_id(self) -> int: return self._mv_ids[0]
     def get_read_id(self) -> int: return self._mv_ids[1]
 
+    def is_consumed(self, buffer_size=0) -> bool:
+        """
+        if fully read by Consumer minus buffer_size
+        """
+        return self._mv_ids[1] >= (self._mv_ids[0] - buffer_size)
+
+    def wait_for_consumed(self, buffer_size=0, timeout : float = None) -> bool:
+        """
+        wait until the data is fully read by Consumer minus buffer_size
+
+        returns True if consumed, False on timeout
+        """
+        if self.is_consumed(buffer_size):
+            return True
+        # clear then recheck, thus the set() from Consumer cannot be missed
+        self._read_event.clear()
+        if self.is_consumed(buffer_size):
+            return True
+        self._read_event.wait(timeout)
+        return self.is_consumed(buffer_size)
+
+    def wait_for_read(self, timeout : float = None) -> bool:
+        """
+        wait until the data is written by Producer
+
+        returns True if ready to .read()
+        """
+        if self._mv_ids[0] != self._mv_ids[1]:
+            return True
+        self._event.clear()
+        if self._mv_ids[0] != self._mv_ids[1]:
+            return True
+        self._event.wait(timeout)
+        return self._mv_ids[0] != self._mv_ids[1]
+
 
     def write(self, data : Union[bytes, bytearray]):
         """
@@ -152,19 +197,40 @@ class MPSPSCMRRingData:
 
         return result
 
+    def skip(self) -> bool:
+        """
+        increment read_id without reading the data
+
+        returns False if there is no data
+        """
+        if self._read_lock is not None:
+            self._read_lock.acquire()
+
+        rid = self._mv_ids[1]
+        is_skipped = rid < self._mv_ids[0]
+        if is_skipped:
+            self._mv_ids[1] = rid+1
+
+        if self._read_lock is not None:
+            self._read_lock.release()
+
+        if is_skipped:
+            self._read_event.set()
+        return is_skipped
+
     def read(self, timeout=0, update_rid=True) -> Union[bytearray, None]:
         """
         read data incrementing read_id
         """
         if self._mv_ids[0] == self._mv_ids[1]:
-            if timeout == 0:
-                return None
-            if not self._event.wait(timeout):
+            if timeout == 0 or not self.wait_for_read(timeout):
                 return None
-            self._event.clear()
-                
+
+        if self._read_lock is not None:
+            self._read_lock.acquire()
+
         wid, rid = self._mv_ids[0], self._mv_ids[1]
-        
+
         result = None
         while rid < wid:
             rid = rid+1
@@ -174,13 +240,10 @@ class MPSPSCMRRingData:
 
         if update_rid:
             self._mv_ids[1] = rid
+
+        if self._read_lock is not None:
+            self._read_lock.release()
+
+        if update_rid:
+            self._read_event.set()
         return result
-        
-    # def wait_for_read(self, timeout : float) -> bool:
-    #     """
-    #     returns True if ready to .read()
-    #     """
-    #     result = self._event.wait(timeout)
-    #     if result:
-    #         self._event.clear()
-    #     return result
\ No newline at end of file
@@ -1,10 +1,29 @@
+import math
 import multiprocessing
+import os
+import struct
+import time
 import uuid
 from typing import Union
 
+from .. import os as lib_os
 from ..io import FormattedMemoryViewIO
 from .MPSharedMemory import MPSharedMemory
 
+_slab_class = struct.Struct('qqqqqqdq')
+_slab_class_cursor = struct.Struct('qd')
+_slab_class_writers = 56
+_slab_slot_header = struct.Struct('qq')
+_slab_slot_time = struct.Struct('d')
+_stats_slot = struct.Struct('32sqqqqqq')
+
+_stats_process_name = None
+_stats_pid = 32
+_stats_alloc_bytes = 40
+_stats_alloc_count = 48
+_stats_lookups = 56
+_stats_failed_lookups = 64
+_stats_frames = 72
 
 class MPWeakHeap:
     """
@@ -23,26 +42,99 @@ class MPWeakHeap:
 
         (16) UUID sig
 
+        (8) alloc_time
+
         ...data...
 
+
+    slab mode heap structure
+
+    |next_class_uid class_table ... slab slab slab ...|
+
+    class_table entry:
+        (8) class_uid, 0 if entry is free
+        (8) class_size
+        (8) slot_count
+        (8) first_slab
+        (8) slab_count
+        (8) cursor
+        (8) last_use_time
+        (8) writers, number of the writers copying the data to the slots
+
+    slot structure:
+        (8) generation, (class_uid << 40) | cursor, 0 while the data is written
+        (8) data_size
+        (8) alloc_time
+        ...data...
+
+    Size classes are created from the sizes of the allocations,
+    each class owns contiguous slabs, which are split to equal slots used as a ring.
+    Every class reserves at least one slab and at least 16 slots,
+    thus the heap should be larger than 16 of the largest data.
+    If there is no space for the new class, least recently used classes are evicted.
+
+
+    Statistics are counted per process in separated shared memory, see get_stats()
+    The slot of the statistics of the exited process is taken by the next process with the same name,
+    thus the restarted processes continue the counters.
     """
     class DataRef:
+        sizeof = 8+16
+
         def __init__(self, block_offset, uuid : bytes):
             self._block_offset = block_offset
             self._uuid = uuid
 
-    def __init__(self, size_mb : int):
+        def pack(self) -> bytes:
+            """pack to bytes of DataRef.sizeof"""
+            return struct.pack('q', self._block_offset) + self._uuid
+
+        @staticmethod
+        def unpack(b : Union[bytes, bytearray, memoryview]) -> 'MPWeakHeap.DataRef':
+            block_offset, = struct.unpack_from('q', b, 0)
+            return MPWeakHeap.DataRef(block_offset, bytes(b[8:24]))
 
+    def __init__(self, size_mb : int, slab : bool = False):
+        """
+            size_mb     size of the heap
 
+            slab        use slab mode: O(1) allocation in slots of the size classes,
+                        suitable when the data has a few fixed sizes, such as video frames
+        """
         self._heap_size = size_mb * 1024 * 1024 # should be 16 byte aligned
         self._shared_mem = MPSharedMemory(self._heap_size)
         self._lock = multiprocessing.Lock()
 
+        self._stats_max_slots = 64
+        self._stats_mem = MPSharedMemory(8 + self._stats_max_slots*_stats_slot.size)
+        # (pid, name) : offset of the statistics slot
+        self._stats_slot_offsets = {}
+        self._stats_prev = None
+
+        self._slab = slab
+        if slab:
+            self._slab_max_classes = 32
+            self._slab_min_slots = 16
+            self._slab_class_table_offset = 64
+            self._slab_first_offset = 4096
+            self._slab_slot_header_size = 8+8+8
+            # slabs of about 1MB, thus the small classes do not reserve the large part of the heap
+            self._slab_count = max(64, (self._heap_size - self._slab_first_offset) // (1024*1024) )
+            self._slab_size = ((self._heap_size - self._slab_first_offset) // self._slab_count) & ~63
+            # the lock is held only to take and stamp the slot, the data is written without lock,
+            # the eviction waits for the writers of the class
+            self._slab_class_locks = [ multiprocessing.Lock() for _ in range(self._slab_max_classes) ]
+            # class_size : (class_idx, class_uid) found by this process
+            self._slab_class_idxs = {}
+
+            struct.pack_into('q', self._shared_mem.get_mv(), 0, 1)
+            return
+
         # Initialize heap structure
         self._ring_head_block_offset = 0
         self._first_block_offset = 8
-        self._block_header_size = 8+8+16
-        self._block_data_start_offset = 8+8+16
+        self._block_header_size = 8+8+16+8
+        self._block_data_start_offset = 8+8+16+8
 
         fmv = FormattedMemoryViewIO(self._shared_mem.get_mv())
         fmv.seek(self._ring_head_block_offset), fmv.write_fmt('q', self._first_block_offset)
@@ -59,9 +151,6 @@ class MPWeakHeap:
             data
 
         """
-        heap_size = self._heap_size
-        block_header_size = self._block_header_size
-
         if isinstance(data, memoryview):
             data = data.cast('B')
             if not data.contiguous:
@@ -70,6 +159,15 @@ class MPWeakHeap:
         else:
             data_size = len(data)
 
+        self._stats_add(_stats_alloc_bytes, data_size)
+        self._stats_add(_stats_alloc_count, 1)
+
+        if self._slab:
+            return self._slab_add_data(data, data_size)
+
+        heap_size = self._heap_size
+        block_header_size = self._block_header_size
+
         lock = self._lock
         fmv = FormattedMemoryViewIO(self._shared_mem.get_mv())
         lock.acquire()
@@ -102,7 +200,7 @@ class MPWeakHeap:
 
                 # update current block structure
                 uid = uuid.uuid4().bytes
-                fmv.seek(cur_block_offset), fmv.write_fmt('qq', block_new_size, data_size ), fmv.write(uid)
+                fmv.seek(cur_block_offset), fmv.write_fmt('qq', block_new_size, data_size ), fmv.write(uid), fmv.write_fmt('d', time.time())
 
                 # update ring_head_block_offset
                 fmv.seek(self._ring_head_block_offset),  fmv.write_fmt('q', next_block_offset)
@@ -151,6 +249,18 @@ class MPWeakHeap:
 
         if data is overwritten already, None will be returned
         """
+        if self._slab:
+            result = self._slab_get_data(data_ref)
+        else:
+            result = self._ring_get_data(data_ref)
+
+        self._stats_add(_stats_lookups, 1)
+        if result is None:
+            self._stats_add(_stats_failed_lookups, 1)
+        return result
+
+    def _ring_get_data(self, data_ref : 'MPWeakHeap.DataRef') -> Union[bytearray, None]:
+
         lock = self._lock
         fmv = FormattedMemoryViewIO(self._shared_mem.get_mv())
 
@@ -180,10 +290,28 @@ class MPWeakHeap:
 
         return result
 
+    def is_data_valid(self, data_ref : 'MPWeakHeap.DataRef') -> bool:
+        """
+        returns True if the data is not overwritten yet
+        """
+        if self._slab:
+            offset = data_ref._block_offset
+            return self._shared_mem.get_mv()[offset:offset+16] == data_ref._uuid
+
+        fmv = FormattedMemoryViewIO(self._shared_mem.get_mv())
+        fmv.seek(data_ref._block_offset+16)
+        self._lock.acquire()
+        uuid = fmv.read(16)
+        self._lock.release()
+        return data_ref._uuid == uuid
+
     def summary(self) -> str:
         """
         returns a string with summary of heap
         """
+        if self._slab:
+            return self._slab_summary()
+
         result = []
 
 
@@ -220,3 +348,372 @@ class MPWeakHeap:
         lock.release()
 
         return '\n'.join(result)
+
+    def _slab_class_offset(self, class_idx : int) -> int:
+        return self._slab_class_table_offset + class_idx*_slab_class.size
+
+    def _slab_find_class(self, class_size : int):
+        """
+        returns (class_idx, class_uid) or None
+        """
+        mv = self._shared_mem.get_mv()
+        for class_idx in range(self._slab_max_classes):
+            class_uid, cur_class_size = struct.unpack_from('qq', mv, self._slab_class_offset(class_idx))
+            if class_uid != 0 and cur_class_size == class_size:
+                return class_idx, class_uid
+        return None
+
+    def _slab_get_class(self, class_size : int):
+        """
+        returns (class_idx, class_uid) of existing or new class
+        """
+        mv = self._shared_mem.get_mv()
+
+        result = self._slab_class_idxs.get(class_size, None)
+        if result is not None:
+            class_idx, class_uid = result
+            if struct.unpack_from('q', mv, self._slab_class_offset(class_idx))[0] == class_uid:
+                return result
+
+        result = self._slab_find_class(class_size)
+        if result is None:
+            self._lock.acquire()
+            try:
+                result = self._slab_find_class(class_size)
+                if result is None:
+                    result = self._slab_create_class(class_size)
+            finally:
+                self._lock.release()
+
+        self._slab_class_idxs[class_size] = result
+        return result
+
+    def _slab_create_class(self, class_size : int):
+        """
+        create new class, evicting least recently used classes if needed.
+        Should be called under self._lock
+        """
+        mv = self._shared_mem.get_mv()
+        slot_stride = self._slab_slot_header_size + class_size
+        slab_size = self._slab_size
+
+        slab_count = -(-slot_stride*self._slab_min_slots // slab_size)
+        if slab_count > self._slab_count:
+            raise Exception(f'Not enough space in MPWeakHeap to allocate {class_size}')
+
+        while True:
+            free_class_idx = None
+            is_slab_used = [False]*self._slab_count
+            lru_class_idx, lru_time = None, None
+
+            for class_idx in range(self._slab_max_classes):
+                class_uid, _, _, cur_first_slab, cur_slab_count, _, last_use_time, _ = _slab_class.unpack_from(mv, self._slab_class_offset(class_idx))
+                if class_uid == 0:
+                    if free_class_idx is None:
+                        free_class_idx = class_idx
+                else:
+                    is_slab_used[cur_first_slab:cur_first_slab+cur_slab_count] = [True]*cur_slab_count
+                    if lru_time is None or last_use_time < lru_time:
+                        lru_class_idx, lru_time = class_idx, last_use_time
+
+            first_slab = None
+            if free_class_idx is not None:
+                run = 0
+                for slab_idx, is_used in enumerate(is_slab_used):
+                    run = 0 if is_used else run+1
+                    if run == slab_count:
+                        first_slab = slab_idx-slab_count+1
+                        break
+
+            if first_slab is not None:
+                break
+
+            self._slab_evict_class(lru_class_idx)
+
+        class_uid, = struct.unpack_from('q', mv, 0)
+        struct.pack_into('q', mv, 0, class_uid+1)
+
+        slot_count = slab_count*slab_size // slot_stride
+        _slab_class.pack_into(mv, self._slab_class_offset(free_class_idx), class_uid, class_size, slot_count, first_slab, slab_count, 0, time.time(), 0)
+        return free_class_idx, class_uid
+
+    def _slab_evict_class(self, class_idx : int):
+        """
+        free the class and invalidate all its slots
+        """
+        mv = self._shared_mem.get_mv()
+        class_offset = self._slab_class_offset(class_idx)
+
+        lock = self._slab_class_locks[class_idx]
+        lock.acquire()
+        _, class_size, slot_count, first_slab, _, _, _, writers = _slab_class.unpack_from(mv, class_offset)
+        # new writers do not take the slots of the freed class
+        struct.pack_into('q', mv, class_offset, 0)
+
+        # wait for the writers which took the slots before, otherwise they write to the slabs of the new class,
+        # the count of the writer terminated during the copy is never decremented, thus the wait is limited
+        wait_t = time.perf_counter()
+        while writers != 0 and time.perf_counter() - wait_t < 1.0:
+            lock.release()
+            time.sleep(0.0005)
+            lock.acquire()
+            writers, = struct.unpack_from('q', mv, class_offset+_slab_class_writers)
+
+        slot_stride = self._slab_slot_header_size + class_size
+        slot_offset = self._slab_first_offset + first_slab*self._slab_size
+        zero_header = bytes(16)
+        for _ in range(slot_count):
+            mv[slot_offset:slot_offset+16] = zero_header
+            slot_offset += slot_stride
+        lock.release()
+
+    def _slab_add_data(self, data, data_size : int) -> 'MPWeakHeap.DataRef':
+        class_size = max(4096, data_size + (-data_size & 4095))
+        mv = self._shared_mem.get_mv()
+
+        while True:
+            class_idx, class_uid = self._slab_get_class(class_size)
+            class_offset = self._slab_class_offset(class_idx)
+
+            lock = self._slab_class_locks[class_idx]
+            lock.acquire()
+            cur_class_uid, _, slot_count, first_slab, _, cursor, _, writers = _slab_class.unpack_from(mv, class_offset)
+            if cur_class_uid != class_uid:
+                # class is evicted by other process, get new one
+                lock.release()
+                continue
+
+            _slab_class_cursor.pack_into(mv, class_offset+40, cursor+1, time.time())
+            struct.pack_into('q', mv, class_offset+_slab_class_writers, writers+1)
+
+            slot_header_size = self._slab_slot_header_size
+            slot_offset = self._slab_first_offset + first_slab*self._slab_size + (cursor % slot_count)*(slot_header_size+class_size)
+            # the slot is invalid while the data is written, thus the readers of the previous data see the change
+            mv[slot_offset:slot_offset+16] = bytes(16)
+            _slab_slot_time.pack_into(mv, slot_offset+16, time.time())
+            lock.release()
+
+            try:
+                mv[slot_offset+slot_header_size:slot_offset+slot_header_size+data_size] = data
+            finally:
+                lock.acquire()
+                cur_cursor, = struct.unpack_from('q', mv, class_offset+40)
+                writers, = struct.unpack_from('q', mv, class_offset+_slab_class_writers)
+                struct.pack_into('q', mv, class_offset+_slab_class_writers, writers-1)
+
+                header = _slab_slot_header.pack( (class_uid << 40) | (cursor & 0xFFFFFFFFFF), data_size)
+                if cur_cursor - cursor < slot_count:
+                    # the slot is not taken by the next round of the ring yet
+                    mv[slot_offset:slot_offset+16] = header
+                lock.release()
+            return MPWeakHeap.DataRef(slot_offset, header)
+
+    def _slab_get_data(self, data_ref : 'MPWeakHeap.DataRef') -> Union[bytearray, None]:
+        mv = self._shared_mem.get_mv()
+        offset = data_ref._block_offset
+
+        # No lock: the slot is valid if the generation is the same before and after the read
+        if mv[offset:offset+16] != data_ref._uuid:
+            return None
+
+        _, data_size = _slab_slot_header.unpack(data_ref._uuid)
+        offset += self._slab_slot_header_size
+        result = bytearray(mv[offset:offset+data_size])
+        offset = data_ref._block_offset
+
+        if mv[offset:offset+16] != data_ref._uuid:
+            return None
+        return result
+
+    def _slab_summary(self) -> str:
+        mv = self._shared_mem.get_mv()
+        result = []
+        for class_idx in range(self._slab_max_classes):
+            class_uid, class_size, slot_count, first_slab, slab_count, cursor, _, _ = _slab_class.unpack_from(mv, self._slab_class_offset(class_idx))
+            if class_uid != 0:
+                result.append(f'[{class_idx}]: class_size:{class_size} slots:{slot_count} slabs:{first_slab}-{first_slab+slab_count-1} allocated:{cursor}')
+        return '\n'.join(result)
+
+    @staticmethod
+    def set_process_stats_name(name : str):
+        """
+        set the name under which the statistics of the current process are counted from now,
+        can be switched between the parts of the process.
+        Default is the name of multiprocessing.current_process()
+        """
+        global _stats_process_name
+        _stats_process_name = name
+
+    def _stats_get_slot_offset(self) -> int:
+        """
+        returns offset of the statistics slot of the current process and name, or -1 if no free slots
+        """
+        pid = os.getpid()
+        name = _stats_process_name or multiprocessing.current_process().name
+        offset = self._stats_slot_offsets.get( (pid, name), None)
+        if offset is None:
+            # First access from this process with this name
+            mv = self._stats_mem.get_mv()
+
+            b_name = name.encode('utf-8')[:32]
+
+            self._lock.acquire()
+            slot_count, = struct.unpack_from('q', mv, 0)
+
+            # the slot of the same name of the exited process continues the counters
+            offset = -1
+            free_offset = -1
+            for slot_idx in range(slot_count):
+                slot_offset = 8 + slot_idx*_stats_slot.size
+                slot_name, slot_pid = struct.unpack_from('32sq', mv, slot_offset)
+                if slot_name.rstrip(b'\0') == b_name and (slot_pid == pid or not lib_os.is_process_alive(slot_pid)):
+                    offset = slot_offset
+                    break
+                if free_offset == -1 and slot_pid != pid and not lib_os.is_process_alive(slot_pid):
+                    free_offset = slot_offset
+
+            if offset != -1:
+                struct.pack_into('q', mv, offset+_stats_pid, pid)
+            elif slot_count < self._stats_max_slots:
+                struct.pack_into('q', mv, 0, slot_count+1)
+                offset = 8 + slot_count*_stats_slot.size
+                _stats_slot.pack_into(mv, offset, b_name, pid, 0, 0, 0, 0, 0)
+            elif free_offset != -1:
+                # the counters of the other name are lost
+                offset = free_offset
+                _stats_slot.pack_into(mv, offset, b_name, pid, 0, 0, 0, 0, 0)
+            self._lock.release()
+
+            self._stats_slot_offsets[ (pid, name) ] = offset
+        return offset
+
+    def _stats_add(self, field_offset : int, value : int):
+        # the slot is written only by the current process, thus no lock is needed
+        offset = self._stats_get_slot_offset()
+        if offset != -1:
+            mv = self._stats_mem.get_mv()
+            offset += field_offset
+            struct.pack_into('q', mv, offset, struct.unpack_from('q', mv, offset)[0] + value)
+
+    def count_frame(self):
+        """
+        count the new frame, should be called by the source of the frames.
+        Used to calculate the footprint of the frame in the heap.
+        """
+        self._stats_add(_stats_frames, 1)
+
+    def get_oldest_age(self) -> Union[float, None]:
+        """
+        returns the age in seconds of the oldest data which is not overwritten yet,
+        i.e. how long the data lives in the heap.
+        In slab mode returns the minimum among size classes, because the class which wraps faster loses the data first.
+
+        None if the heap is not full yet
+        """
+        mv = self._shared_mem.get_mv()
+        t = time.time()
+
+        if self._slab:
+            result = None
+            slot_header_size = self._slab_slot_header_size
+            for class_idx in range(self._slab_max_classes):
+                class_uid, class_size, slot_count, first_slab, _, cursor, _, _ = _slab_class.unpack_from(mv, self._slab_class_offset(class_idx))
+                if class_uid != 0 and cursor >= slot_count:
+                    slot_offset = self._slab_first_offset + first_slab*self._slab_size + (cursor % slot_count)*(slot_header_size+class_size)
+                    age = t - _slab_slot_time.unpack_from(mv, slot_offset+16)[0]
+                    if result is None or age < result:
+                        result = age
+            return result
+
+        # The oldest data is the first non-empty block after the ring head
+        self._lock.acquire()
+        cur_block_offset, = struct.unpack_from('q', mv, self._ring_head_block_offset)
+        result = None
+        for _ in range(64):
+            block_size, data_size = struct.unpack_from('qq', mv, cur_block_offset)
+            if data_size != 0:
+                result = t - struct.unpack_from('d', mv, cur_block_offset+32)[0]
+                break
+            cur_block_offset += block_size
+            if cur_block_offset >= self._heap_size:
+                break
+        self._lock.release()
+        return result
+
+    def get_stats(self, keep_frames : int = 32) -> dict:
+        """
+        returns dict of statistics of all processes
+
+            alloc_bytes             total allocated bytes
+            alloc_bytes_per_sec     since the previous call of get_stats() in this process,
+                                    None on first call
+            lookups                 total amount of get_data()
+            failed_lookups          total amount of get_data() of overwritten data
+            frames                  total amount of frames, see count_frame()
+            oldest_age              see get_oldest_age()
+            frame_footprint         allocated bytes per frame, None if no frames
+            recommended_size_mb     minimum heap size to keep the data of keep_frames frames,
+                                    None if no frames
+            processes               dict name : dict of alloc_bytes, lookups, failed_lookups
+        """
+        mv = self._stats_mem.get_mv()
+
+        stats = {'alloc_bytes' : 0, 'lookups' : 0, 'failed_lookups' : 0, 'frames' : 0, 'processes' : {} }
+        slot_count, = struct.unpack_from('q', mv, 0)
+        for slot_idx in range(min(slot_count, self._stats_max_slots)):
+            name, _, alloc_bytes, _, lookups, failed_lookups, frames = _stats_slot.unpack_from(mv, 8 + slot_idx*_stats_slot.size)
+            name = name.rstrip(b'\0').decode('utf-8', errors='ignore')
+
+            stats['alloc_bytes'] += alloc_bytes
+            stats['lookups'] += lookups
+            stats['failed_lookups'] += failed_lookups
+            stats['frames'] += frames
+
+            # replicas of the same process are summed
+            process_stats = stats['processes'].setdefault(name, {'alloc_bytes' : 0, 'lookups' : 0, 'failed_lookups' : 0})
+            process_stats['alloc_bytes'] += alloc_bytes
+            process_stats['lookups'] += lookups
+            process_stats['failed_lookups'] += failed_lookups
+
+        t = time.time()
+        prev = self._stats_prev
+        if prev is not None and prev[0] == os.getpid() and t > prev[1]:
+            stats['alloc_bytes_per_sec'] = (stats['alloc_bytes']-prev[2]) / (t-prev[1])
+        else:
+            stats['alloc_bytes_per_sec'] = None
+        self._stats_prev = (os.getpid(), t, stats['alloc_bytes'])
+
+        stats['oldest_age'] = self.get_oldest_age()
+
+        frames = stats['frames']
+        if frames != 0:
+            stats['frame_footprint'] = stats['alloc_bytes'] / frames
+            stats['recommended_size_mb'] = math.ceil(stats['frame_footprint']*keep_frames / (1024*1024) )
+        else:
+            stats['frame_footprint'] = None
+            stats['recommended_size_mb'] = None
+        return stats
+
+    @staticmethod
+    def format_stats(stats : dict) -> str:
+        """
+        format the result of get_stats() to a readable string
+        """
+        MB = 1024*1024
+        lines = []
+
+        s = f'allocated: {stats["alloc_bytes"]/MB:.1f} MB'
+        if stats['alloc_bytes_per_sec'] is not None:
+            s += f', {stats["alloc_bytes_per_sec"]/MB:.1f} MB/s'
+        if stats['oldest_age'] is not None:
+            s += f', oldest data age: {stats["oldest_age"]:.2f} s'
+        lines.append(s)
+
+        if stats['frame_footprint'] is not None:
+            lines.append(f'frame footprint: {stats["frame_footprint"]/MB:.2f} MB, recommended heap size: {stats["recommended_size_mb"]} MB')
+
+        lines.append(f'failed lookups: {stats["failed_lookups"]} of {stats["lookups"]}')
+        for name, process_stats in stats['processes'].items():
+            if process_stats['failed_lookups'] != 0:
+                lines.append(f'    {name}: {process_stats["failed_lookups"]} of {process_stats["lookups"]}')
+        return '\n'.join(lines)
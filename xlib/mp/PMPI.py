@@ -10,6 +10,7 @@ class PMPI:
     def __init__(self, pipe : Connection = None):
         self.pipe = pipe
         self.funcs = {}
+        self.send_mirrors = []
 
     def set_pipe(self, pipe):
         self.pipe = pipe
@@ -26,6 +27,12 @@ class PMPI:
             d[name] = ar = []
         ar.append(func)
 
+    def add_send_mirror(self, pmpi : 'PMPI', name_prefix : str = ''):
+        """
+        also send the messages which name starts with name_prefix to pmpi
+        """
+        self.send_mirrors.append( (pmpi, name_prefix) )
+
     def send_msg(self, name, *args, **kwargs):
         """
         send message with name and args/kwargs
@@ -33,6 +40,10 @@ class PMPI:
         if self.pipe is not None:
             self.pipe.send( (name, args, kwargs) )
 
+        for pmpi, name_prefix in self.send_mirrors:
+            if name.startswith(name_prefix):
+                pmpi.send_msg(name, *args, **kwargs)
+
     def process_messages(self, timeout=0):
         """
         arguments
@@ -3,6 +3,7 @@ import threading
 import time
 import traceback
 from enum import IntEnum
+from typing import Union
 
 from ... import db as lib_db
 from ...python import Disposable, EventListener
@@ -234,6 +235,7 @@ class Host(Base):
         self._is_busy = False
         self._process = None
         self._reset_restart = False
+        self._worker_group = None
 
         self._on_state_change_evl = EventListener()
 
@@ -264,6 +266,15 @@ class Host(Base):
 
     def send_msg(self, name, *args, **kwargs): self._pmpi.send_msg(name, *args, **kwargs)
 
+    def get_state(self) -> WorkerState:
+        """
+        get WorkerState object of Host.
+
+        Inner variables can be modified while the worker is stopped,
+        they will be passed to the worker on next start.
+        """
+        return self._state
+
     def reset_state(self):
         """
         reset state to default
@@ -284,14 +295,29 @@ class Host(Base):
             # Save only when the process is fully started / stopped
             self._db.set_value(self._db_key_host_onoff, self._process_status == Host._ProcessStatus.STARTED )
 
+    def get_saved_on_off_state(self, default_state=True) -> bool:
+        """
+        returns saved on_off state from db. Default is on.
+        """
+        return self._db.get_value(self._db_key_host_onoff, default_state)
+
     def restore_on_off_state(self, default_state=True):
         """
         restore saved on_off state from db. Default is on.
         """
-        is_on = self._db.get_value(self._db_key_host_onoff, default_state)
-        if is_on:
+        if self.get_saved_on_off_state(default_state):
             self.start()
 
+    def set_worker_group(self, worker_group : 'WorkerGroup'):
+        """
+        Run the worker in the process of WorkerGroup instead of own process.
+        Should be called before the first start of any worker of the group.
+        """
+        self._worker_group = worker_group
+        self._worker_group_idx = worker_group._add_host(self)
+
+    def get_worker_group(self) -> Union['WorkerGroup', None]: return self._worker_group
+
     def start(self):
         """
         Start the worker.
@@ -308,6 +334,10 @@ class Host(Base):
                 self._process_status = Host._ProcessStatus.STARTING
                 self._on_state_change_evl_call()
 
+                if self._worker_group is not None:
+                    self._process = self._worker_group._start_worker(self._worker_group_idx, worker_pipe, self._state)
+                    return True
+
                 process = self._process = multiprocessing.Process(target=Worker._start_proc,
                                         args=[self._worker_cls, self._worker_sheet_cls, worker_pipe, self._state, self._worker_start_args, self._worker_start_kwargs],
                                         daemon=True)
@@ -417,6 +447,7 @@ class Worker(Base):
         self._run = True
         self._req_restart = False
         self._req_save_state = False
+        self._error = None
         self._get_pmpi().call_on_msg('_stop', lambda: setattr(self, '_run', False))
 
     def on_start(self, *args, **kwargs):
@@ -462,38 +493,138 @@ class Worker(Base):
         return self._started
 
     @staticmethod
-    def _start_proc(cls_, sheet_cls, pipe, state, worker_start_args, worker_start_kwargs):
+    def _create(cls_, sheet_cls, pipe, state) -> 'Worker':
         self = cls_(sheet=sheet_cls())
         self._get_pmpi().set_pipe(pipe)
         self._state = state
+        return self
 
-        error = None
+    def _proc_start(self, worker_start_args, worker_start_kwargs) -> bool:
+        """
+        returns False on error
+        """
         try:
             self.on_start(*worker_start_args, **worker_start_kwargs)
             self._started = True
             self.send_msg('_start')
-            while True:
-                if self._req_save_state:
-                    self._req_save_state = False
-                    self.send_msg('_state', self._state)
-
-                if not self._run:
-                    break
+            return True
+        except Exception as e:
+            self._error = f'{str(e)} {traceback.format_exc()}'
+        return False
 
-                self._pmpi.process_messages()
-                self.on_tick()
+    def _proc_tick(self) -> bool:
+        """
+        returns False if the worker is stopped or on error
+        """
+        try:
+            if self._req_save_state:
+                self._req_save_state = False
+                self.send_msg('_state', self._state)
 
-            self.on_stop()
+            if not self._run:
+                self.on_stop()
+                return False
 
+            self._pmpi.process_messages()
+            self.on_tick()
+            return True
         except Exception as e:
-            error = f'{str(e)} {traceback.format_exc()}'
+            self._error = f'{str(e)} {traceback.format_exc()}'
+        return False
+
+    def _proc_stop(self):
+        self.send_msg('_stop', error=self._error, restart=self._req_restart)
+
+    @staticmethod
+    def _start_proc(cls_, sheet_cls, pipe, state, worker_start_args, worker_start_kwargs):
+        self = Worker._create(cls_, sheet_cls, pipe, state)
 
-        self.send_msg('_stop', error=error, restart=self._req_restart)
+        if self._proc_start(worker_start_args, worker_start_kwargs):
+            while self._proc_tick():
+                pass
+
+        self._proc_stop()
         time.sleep(1.0)
 
 
+class WorkerGroup:
+    """
+    Runs the workers of the Hosts in a single process, see Host.set_worker_group().
+
+    The workers are ticked in turn, thus the workers should not wait in on_tick for a long time.
+    Useful for cheap workers chained one after another, which lose more on the context switches
+    and the data transfer between processes than gain from parallelism.
+
+    The process is started on first start of the worker, and lives until the main process exits.
+    Start arguments of all workers are passed to the process at once,
+    thus the objects shared between the workers stay the same objects in the process.
+    """
+    class _WorkerProcess:
+        """
+        replacement of multiprocessing.Process for Host
+        """
+        def __init__(self, worker_group : 'WorkerGroup', worker_id : int):
+            self._worker_group = worker_group
+            self._worker_id = worker_id
 
+        def is_alive(self) -> bool:
+            return self._worker_group._process.is_alive()
 
+        def terminate(self):
+            # the worker is removed from the group if it is still running
+            self._worker_group._send_cmd('_kill', self._worker_id)
 
+        def join(self):
+            ...
 
+    def __init__(self):
+        self._hosts = []
+        self._process = None
+        self._pipe = None
+        self._worker_id = 0
+
+    def _add_host(self, host : Host) -> int:
+        if self._process is not None:
+            raise Exception('Unable to add the host to already started WorkerGroup.')
+        self._hosts.append(host)
+        return len(self._hosts)-1
+
+    def _send_cmd(self, name, *args):
+        if self._pipe is not None:
+            self._pipe.send( (name, args) )
+
+    def _start_worker(self, host_idx, pipe, state) -> 'WorkerGroup._WorkerProcess':
+        if self._process is None:
+            self._pipe, worker_group_pipe = multiprocessing.Pipe()
+            workers_args = [ (host._worker_cls, host._worker_sheet_cls, host._worker_start_args, host._worker_start_kwargs) for host in self._hosts ]
+            self._process = multiprocessing.Process(target=WorkerGroup._group_proc, args=[worker_group_pipe, workers_args], daemon=True)
+            self._process.start()
+
+        self._worker_id += 1
+        self._send_cmd('_start', self._worker_id, host_idx, pipe, state)
+        return WorkerGroup._WorkerProcess(self, self._worker_id)
 
+    @staticmethod
+    def _group_proc(pipe, workers_args):
+        workers = {}
+        while True:
+            # wait for the commands only if there are no workers
+            while pipe.poll(0 if len(workers) != 0 else 0.1):
+                name, args = pipe.recv()
+                if name == '_start':
+                    worker_id, host_idx, worker_pipe, state = args
+                    cls_, sheet_cls, worker_start_args, worker_start_kwargs = workers_args[host_idx]
+
+                    worker = Worker._create(cls_, sheet_cls, worker_pipe, state)
+                    if worker._proc_start(worker_start_args, worker_start_kwargs):
+                        workers[worker_id] = worker
+                    else:
+                        worker._proc_stop()
+                elif name == '_kill':
+                    worker_id, = args
+                    workers.pop(worker_id, None)
+
+            for worker_id, worker in list(workers.items()):
+                if not worker._proc_tick():
+                    worker._proc_stop()
+                    workers.pop(worker_id)
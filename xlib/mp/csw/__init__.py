@@ -4,7 +4,7 @@ Controllable Subprocess Worker
 
 
 from .CSWBase import (DB, Control, ControlClient, ControlHost, Host, Sheet,
-                      Worker, WorkerState)
+                      Worker, WorkerGroup, WorkerState)
 from .DynamicSingleSwitch import DynamicSingleSwitch
 from .Error import Error
 from .Flag import Flag
@@ -1,32 +1,98 @@
+import hashlib
 import io
+import json
+import os
 import threading
+import time
 import urllib.request
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Tuple, Union
+
+
+def get_file_sha256(path : Union[str, Path]) -> str:
+    """
+    returns lower case SHA-256 hex of the file
+    """
+    hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            b = f.read(16*1024*1024)
+            if len(b) == 0:
+                break
+            hash.update(b)
+    return hash.hexdigest()
+
+def load_sha256_manifest(path : Union[str, Path]) -> Dict[str, str]:
+    """
+    load manifest in format of sha256sum utility
+
+        <sha256 hex>  <file name>
+
+    empty lines and lines started with # are skipped.
+
+    returns dict of file name -> lower case sha256 hex
+    """
+    result = {}
+    for line in Path(path).read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        sha256, filename = line.split(maxsplit=1)
+        # '*' marks binary mode in sha256sum output
+        result[filename.lstrip('*')] = sha256.lower()
+    return result
 
 
 class ThreadFileDownloader:
     """
-    FileDownloader using sub thread
+    FileDownloader using sub threads
 
      url            str
 
      savepath(None) str,Path
+                    if None, the file is downloaded into memory, see get_bytes()
+
+     sha256(None)   str     expected SHA-256 hex of the file
 
+     max_connections(4)     number of parallel connections downloading the chunks of the file,
+                            used if the server supports Range requests
+
+     min_chunk_size(8MB)    min size of the chunk of parallel connection
+
+     retries(5)     number of retries of the chunk on connection error,
+                    used if the server supports Range requests
+
+     timeout(30.0)  timeout of connection in seconds
+
+    The file is written to savepath.part and renamed to savepath after verification.
+    If the server supports Range requests, interrupted download is resumed
+    from savepath.part and its state in savepath.part.json
 
     Use .get_error() to check the error
     """
 
-    def __init__(self, url, savepath : Union[str, Path] = None):
+    def __init__(self, url, savepath : Union[str, Path] = None, sha256 : str = None,
+                       max_connections : int = 4, min_chunk_size : int = 8*1024*1024, retries : int = 5, timeout : float = 30.0):
         if savepath is not None:
             savepath = Path(savepath)
             self._partpath = savepath.parent / ( savepath.name + '.part' )
+            self._statepath = savepath.parent / ( savepath.name + '.part.json' )
         else:
             self._partpath = None
+            self._statepath = None
         self._savepath = savepath
 
         self._url = url
+        self._sha256 = sha256.lower() if sha256 is not None else None
+        self._max_connections = max(1, max_connections)
+        self._min_chunk_size = max(1, min_chunk_size)
+        self._retries = retries
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
         self._error = None
+        self._chunk_error = None
+        self._completed = False
         self._file_size = None
         self._file_size_dl = None
         self._bytes = None
@@ -37,12 +103,15 @@ class ThreadFileDownloader:
     def get_progress(self) -> float:
         """
         return progress of downloading as [0.0...100.0] value
-        where 100.0 mean download is completed
+        where 100.0 mean download is completed and verified
         """
-        if self._file_size is None or self._file_size_dl is None:
+        if self._completed:
+            return 100.0
+
+        if self._file_size is None or self._file_size_dl is None or self._file_size == 0:
             return 0.0
 
-        return (self._file_size_dl / self._file_size) * 100.0
+        return min(99.9, (self._file_size_dl / self._file_size) * 100.0)
 
     def get_bytes(self) -> bytes:
         """
@@ -56,44 +125,145 @@ class ThreadFileDownloader:
         """
         return self._error
 
+    def _open_url(self, start : int = None, end : int = None):
+        headers = {}
+        if start is not None:
+            headers['Range'] = f'bytes={start}-{end-1}'
+        return urllib.request.urlopen(urllib.request.Request(self._url, headers=headers), timeout=self._timeout)
+
+    def _get_file_info(self) -> Tuple[int, bool]:
+        """
+        returns (file_size, is Range requests supported)
+        """
+        with self._open_url(0, 1) as url_req:
+            if url_req.status == 206:
+                # Content-Range: bytes 0-0/file_size
+                file_size = url_req.getheader('content-range', '').split('/')[-1]
+                if file_size.isdigit():
+                    return int(file_size), True
+            return int( url_req.getheader('content-length') ), False
+
     def _thread(self):
         try:
-            url_req = urllib.request.urlopen(self._url)
-            file_size = self._file_size = int( url_req.getheader('content-length') )
-            self._file_size_dl = 0
-            savepath = self._savepath
-            partpath = self._partpath
-
-            if partpath is not None:
-                if partpath.exists():
-                    partpath.unlink()
-                f = open(partpath, 'wb')
+            if self._savepath is None:
+                self._download_to_memory()
             else:
-                f = io.BytesIO()
+                self._download_to_file()
+        except Exception as e:
+            self._error = str(e)
+
+    def _download_to_memory(self):
+        url_req = urllib.request.urlopen(self._url, timeout=self._timeout)
+        self._file_size = int( url_req.getheader('content-length') )
+        self._file_size_dl = 0
 
-            while url_req is not None:
-                buffer = url_req.read(8192)
+        f = io.BytesIO()
+        with url_req:
+            while True:
+                buffer = url_req.read(65536)
                 if not buffer:
                     break
-
                 f.write(buffer)
+                self._file_size_dl += len(buffer)
 
-                new_file_size_dl = self._file_size_dl + len(buffer)
+        if self._file_size_dl != self._file_size:
+            raise Exception('Connection is closed before the file is downloaded.')
 
-                if new_file_size_dl >= file_size:
-                    if partpath is not None:
-                        f.close()
-                        if savepath.exists():
-                            savepath.unlink()
-                        partpath.rename(savepath)
-                    else:
-                        self._bytes = f.getvalue()
-                        f.close()
-                    url_req.close()
-                    url_req = None
+        b = f.getvalue()
+        if self._sha256 is not None and hashlib.sha256(b).hexdigest() != self._sha256:
+            raise Exception('SHA-256 of the downloaded file does not match.')
 
-                self._file_size_dl = new_file_size_dl
+        self._bytes = b
+        self._completed = True
 
+    def _download_to_file(self):
+        savepath, partpath, statepath = self._savepath, self._partpath, self._statepath
 
-        except Exception as e:
-            self._error = str(e)
+        file_size, is_ranges = self._get_file_info()
+        self._file_size = file_size
+
+        # [ [pos, end], ... ] of the chunks
+        chunks = None
+        if is_ranges and partpath.exists() and statepath.exists():
+            try:
+                state = json.loads(statepath.read_text())
+                if state['url'] == self._url and state['file_size'] == file_size and \
+                   partpath.stat().st_size == file_size:
+                    chunks = state['chunks']
+            except:
+                ...
+
+        if chunks is None:
+            chunk_count = max(1, min(self._max_connections, file_size // self._min_chunk_size)) if is_ranges else 1
+            bounds = [ file_size*i // chunk_count for i in range(chunk_count+1) ]
+            chunks = [ [bounds[i], bounds[i+1]] for i in range(chunk_count) ]
+            with open(partpath, 'wb') as f:
+                f.truncate(file_size)
+
+        self._file_size_dl = file_size - sum(end-pos for pos, end in chunks)
+
+        threads = [ threading.Thread(target=self._chunk_thread, args=(chunk, is_ranges), daemon=True) for chunk in chunks if chunk[0] < chunk[1] ]
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads):
+            if is_ranges:
+                self._save_state(file_size, chunks)
+            time.sleep(0.5)
+
+        if is_ranges:
+            self._save_state(file_size, chunks)
+
+        if self._chunk_error is not None:
+            raise Exception(self._chunk_error)
+
+        if self._sha256 is not None and get_file_sha256(partpath) != self._sha256:
+            # the data is corrupted, start from scratch next time
+            partpath.unlink()
+            if statepath.exists():
+                statepath.unlink()
+            raise Exception('SHA-256 of the downloaded file does not match.')
+
+        if statepath.exists():
+            statepath.unlink()
+        os.replace(partpath, savepath)
+        self._completed = True
+
+    def _save_state(self, file_size : int, chunks : List[List[int]]):
+        with self._lock:
+            s = json.dumps({'url' : self._url, 'file_size' : file_size, 'chunks' : [ list(chunk) for chunk in chunks ] })
+
+        tmp_path = self._statepath.parent / (self._statepath.name + '.tmp')
+        tmp_path.write_text(s)
+        os.replace(tmp_path, self._statepath)
+
+    def _chunk_thread(self, chunk : List[int], is_ranges : bool):
+        retries = 0
+        # unbuffered, thus the saved state does not point beyond the data written
+        with open(self._partpath, 'r+b', buffering=0) as f:
+            while chunk[0] < chunk[1] and self._chunk_error is None:
+                try:
+                    with (self._open_url(chunk[0], chunk[1]) if is_ranges else self._open_url()) as url_req:
+                        if is_ranges and url_req.status != 206:
+                            raise Exception('Range request is not satisfied by the server.')
+
+                        f.seek(chunk[0])
+                        while chunk[0] < chunk[1]:
+                            buffer = url_req.read(min(65536, chunk[1]-chunk[0]))
+                            if not buffer:
+                                raise Exception('Connection is closed before the file is downloaded.')
+                            f.write(buffer)
+
+                            with self._lock:
+                                chunk[0] += len(buffer)
+                                self._file_size_dl += len(buffer)
+                            retries = 0
+
+                except Exception as e:
+                    if not is_ranges or retries >= self._retries:
+                        with self._lock:
+                            if self._chunk_error is None:
+                                self._chunk_error = str(e)
+                        return
+                    retries += 1
+                    time.sleep(min(10.0, 0.5 * 2**retries))
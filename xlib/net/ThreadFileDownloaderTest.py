@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .ThreadFileDownloader import ThreadFileDownloader
+
+
+class ThreadFileDownloaderTest():
+
+    def test_all():
+        test_funcs = [
+                        download_test,
+                        resume_test,
+                        chunk_retry_test,
+                        sha256_mismatch_test,
+                    ]
+
+        for test_func in test_funcs:
+            print(f'{test_func.__name__}()')
+            test_func()
+
+        print('Done.')
+
+class _Server:
+    """
+    local HTTP server of the data with single Range requests support
+
+        fail_count  number of responses closed in the middle of the data
+    """
+    def __init__(self, data : bytes, fail_count : int = 0):
+        self.data = data
+        self.fail_count = fail_count
+        self.sent_bytes = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                ...
+
+            def do_GET(self):
+                data = server.data
+                start, end = 0, len(data)
+                range = self.headers.get('Range', None)
+                if range is not None:
+                    start, end = range[len('bytes='):].split('-')
+                    start, end = int(start), int(end)+1
+
+                with server.lock:
+                    is_fail = server.fail_count > 0 and end-start > 1
+                    if is_fail:
+                        server.fail_count -= 1
+
+                self.send_response(206 if range is not None else 200)
+                if range is not None:
+                    self.send_header('Content-Range', f'bytes {start}-{end-1}/{len(data)}')
+                self.send_header('Content-Length', str(end-start))
+                self.end_headers()
+
+                if is_fail:
+                    end = start + (end-start) // 2
+                    self.close_connection = True
+                self.wfile.write(data[start:end])
+                with server.lock:
+                    server.sent_bytes += end-start
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}/file.bin'
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+def _wait(downloader : ThreadFileDownloader, timeout : float = 30.0):
+    t = time.perf_counter()
+    while downloader.get_progress() != 100.0 and downloader.get_error() is None:
+        if time.perf_counter() - t > timeout:
+            raise Exception('download timeout')
+        time.sleep(0.01)
+
+def _run(test_func):
+    data = os.urandom(1024*1024 + 123)
+    dir_path = Path(tempfile.mkdtemp())
+    try:
+        test_func(data, dir_path, dir_path / 'file.bin')
+    finally:
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+def download_test():
+    def test_func(data, dir_path, savepath):
+        server = _Server(data)
+        try:
+            downloader = ThreadFileDownloader(server.url, savepath=savepath, sha256=hashlib.sha256(data).hexdigest(), min_chunk_size=256*1024)
+            _wait(downloader)
+        finally:
+            server.shutdown()
+        if downloader.get_error() is not None:
+            raise Exception(downloader.get_error())
+        if savepath.read_bytes() != data:
+            raise Exception('downloaded data does not match')
+    _run(test_func)
+
+def resume_test():
+    def test_func(data, dir_path, savepath):
+        # the first half of every chunk is downloaded already
+        file_size = len(data)
+        bounds = [ file_size*i // 4 for i in range(5) ]
+        chunks = [ [ (bounds[i]+bounds[i+1]) // 2, bounds[i+1] ] for i in range(4) ]
+        part = bytearray(file_size)
+        for i in range(4):
+            part[bounds[i]:chunks[i][0]] = data[bounds[i]:chunks[i][0]]
+
+        server = _Server(data)
+        try:
+            (dir_path / 'file.bin.part').write_bytes(part)
+            (dir_path / 'file.bin.part.json').write_text(json.dumps({'url' : server.url, 'file_size' : file_size, 'chunks' : chunks}))
+
+            downloader = ThreadFileDownloader(server.url, savepath=savepath, sha256=hashlib.sha256(data).hexdigest(), min_chunk_size=256*1024)
+            _wait(downloader)
+        finally:
+            server.shutdown()
+        if downloader.get_error() is not None:
+            raise Exception(downloader.get_error())
+        if savepath.read_bytes() != data:
+            raise Exception('resumed data does not match')
+
+        # 1 byte of the Range check and the remaining halves of the chunks
+        expected_sent_bytes = 1 + sum(end-pos for pos, end in chunks)
+        if server.sent_bytes != expected_sent_bytes:
+            raise Exception(f'{server.sent_bytes} bytes are downloaded instead of {expected_sent_bytes}')
+    _run(test_func)
+
+def chunk_retry_test():
+    def test_func(data, dir_path, savepath):
+        server = _Server(data, fail_count=2)
+        try:
+            downloader = ThreadFileDownloader(server.url, savepath=savepath, sha256=hashlib.sha256(data).hexdigest(), min_chunk_size=256*1024)
+            _wait(downloader)
+        finally:
+            server.shutdown()
+        if downloader.get_error() is not None:
+            raise Exception(downloader.get_error())
+        if savepath.read_bytes() != data:
+            raise Exception('retried data does not match')
+        if server.fail_count != 0:
+            raise Exception('failed responses are not requested')
+    _run(test_func)
+
+def sha256_mismatch_test():
+    def test_func(data, dir_path, savepath):
+        server = _Server(data)
+        try:
+            downloader = ThreadFileDownloader(server.url, savepath=savepath, sha256=hashlib.sha256(b'other').hexdigest(), min_chunk_size=256*1024)
+            _wait(downloader)
+        finally:
+            server.shutdown()
+        if downloader.get_error() is None or 'SHA-256' not in downloader.get_error():
+            raise Exception('SHA-256 mismatch is not reported')
+        if savepath.exists() or (dir_path / 'file.bin.part').exists() or (dir_path / 'file.bin.part.json').exists():
+            raise Exception('corrupted download is not removed')
+    _run(test_func)
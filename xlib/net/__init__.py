@@ -1 +1,3 @@
-from .ThreadFileDownloader import ThreadFileDownloader
\ No newline at end of file
+from .ThreadFileDownloader import (ThreadFileDownloader, get_file_sha256,
+                                   load_sha256_manifest)
+from .ThreadFileDownloaderTest import ThreadFileDownloaderTest
\ No newline at end of file
@@ -0,0 +1,352 @@
+import pickle
+import threading
+import time
+import traceback
+import uuid
+from typing import Dict, List, Union
+
+import numpy as np
+
+from .. import mp as lib_mp
+from .. import os as lib_os
+from .. import time as lib_time
+from .device import ORTDeviceInfo
+from .threads import apply_thread_allocation, set_intra_op_num_threads
+
+_client = None
+
+_INPUT_OVERWRITTEN_ERROR = 'Input data is overwritten in the weak heap.'
+
+def get_inference_server_client() -> Union['InferenceServerClient', None]:
+    """
+    returns client set by set_inference_server_client() in this process
+    """
+    return _client
+
+def set_inference_server_client(client : Union['InferenceServerClient', None]):
+    """
+    set client of InferenceServer used by InferenceSession_with_device(..., shared=True) in this process,
+    None - the sessions are constructed in this process
+    """
+    global _client
+    _client = client
+
+
+class InferenceServer(lib_mp.MPWorker):
+    """
+    Process which holds one session per (model, device) for several processes,
+    thus the weights and thread pool of the model are not duplicated.
+
+    The processes use the sessions via clients, see create_client() and InferenceSession_with_device(..., shared=True)
+
+    The tensors are transferred through weak_heap.
+
+    Run requests of the same session arrived together are batched into one run,
+    if the model has dynamic batch dimension.
+
+    The load of the server is measured as the sum of average run times of the sessions, see get_load()
+
+     weak_heap          MPWeakHeap
+
+     max_clients(16)    max number of clients
+
+    starts immediately after construction.
+    """
+    def __init__(self, weak_heap : lib_mp.MPWeakHeap, max_clients : int = 16):
+        self._weak_heap = weak_heap
+        self._req_rd = lib_mp.MPSPSCMRRingData(table_size=1024, heap_size_mb=2, multi_producer=True)
+        # every client has own ring of responses
+        self._resp_rds = [ lib_mp.MPSPSCMRRingData(table_size=256, heap_size_mb=1) for _ in range(max_clients) ]
+        self._clients_count = 0
+        self._load = None
+        super().__init__(sub_args=[], process_count=1)
+
+    def get_load(self) -> Union[float, None]:
+        """
+        returns sum of average run times of the sessions in seconds, or None if nothing is run yet
+        """
+        return self._load
+
+    def set_thread_allocation(self, num_threads : int, cpus : Union[List[int], None]):
+        """
+        set allocation from allocate_threads() for the sessions opened after the call
+        """
+        self._send_msg('_thread_allocation', num_threads, cpus)
+
+    def _on_host_sub_message(self, process_id, name, *args, **kwargs):
+        if name == '_load':
+            self._load, = args
+
+    def _on_sub_host_message(self, name, *args, **kwargs):
+        if name == '_thread_allocation':
+            num_threads, cpus = args
+            set_intra_op_num_threads(num_threads)
+            if cpus is not None:
+                lib_os.set_process_affinity(cpus)
+
+    def create_client(self) -> 'InferenceServerClient':
+        """
+        Create new picklable client.
+
+        Should be called before the process of the client is started.
+        Every process should use own client.
+        """
+        if self._clients_count >= len(self._resp_rds):
+            raise Exception('Max number of InferenceServer clients is exceeded.')
+        client_id = self._clients_count
+        self._clients_count += 1
+        return InferenceServerClient(self._weak_heap, self._req_rd, client_id, self._resp_rds[client_id])
+
+    def _on_sub_initialize(self):
+        apply_thread_allocation('InferenceServer')
+
+        # [ (sess, is_batchable) ]
+        self._sessions = []
+        # (model_path, device index, prefer_quantized) : sess_id
+        self._sessions_ids = {}
+        # sess_id : AverageMeasurer of run
+        self._run_measurers = {}
+        self._run_times = {}
+        self._load_send_t = 0
+
+    def _on_sub_tick(self, process_id):
+        # serve the requests without the delay of polling of host messages
+        t = time.perf_counter()
+        while time.perf_counter() - t < 0.1:
+            self._sub_serve(timeout=0.005)
+
+        if len(self._run_times) != 0 and t - self._load_send_t >= 1.0:
+            self._load_send_t = t
+            self._send_msg('_load', sum(self._run_times.values()))
+
+    def _sub_serve(self, timeout : float):
+        b = self._req_rd.read(timeout=timeout)
+        if b is None:
+            return
+
+        reqs = []
+        while b is not None:
+            reqs.append(pickle.loads(b))
+            b = self._req_rd.read()
+
+        # requests of the same session with the same shapes except batch dimension
+        run_groups = {}
+        for req in reqs:
+            name, client_id, req_id = req[0:3]
+            if name == 'open':
+                self._sub_respond(client_id, req_id, *self._sub_open(*req[3:]))
+            elif name == 'run':
+                sess_id, output_names, inputs = req[3:]
+                key = (sess_id, None if output_names is None else tuple(output_names),
+                       tuple( (input_name, tuple(shape[1:]), dtype) for input_name, _, shape, dtype in inputs ) )
+                run_groups.setdefault(key, []).append(req)
+
+        for reqs in run_groups.values():
+            self._sub_run(reqs)
+
+    def _sub_respond(self, client_id : int, req_id : bytes, error : Union[str, None], result):
+        self._resp_rds[client_id].write(pickle.dumps( (req_id, error, result) ))
+
+    def _sub_open(self, model_path : str, device_info : ORTDeviceInfo, prefer_quantized : bool):
+        from .InferenceSession import InferenceSession_with_device
+
+        key = (model_path, device_info.get_index(), prefer_quantized)
+        try:
+            sess_id = self._sessions_ids.get(key, None)
+            if sess_id is None:
+                sess = InferenceSession_with_device(model_path, device_info, prefer_quantized=prefer_quantized)
+
+                node_args = sess.get_inputs() + sess.get_outputs()
+                is_batchable = all( len(x.shape) != 0 and not isinstance(x.shape[0], int) for x in node_args )
+
+                sess_id = len(self._sessions)
+                self._sessions.append( (sess, is_batchable) )
+                self._sessions_ids[key] = sess_id
+
+            sess, _ = self._sessions[sess_id]
+            return None, (sess_id, [ (x.name, x.shape, x.type) for x in sess.get_inputs() ],
+                                   [ (x.name, x.shape, x.type) for x in sess.get_outputs() ])
+        except Exception as e:
+            return str(e), None
+
+    def _sub_run(self, reqs : List):
+        weak_heap = self._weak_heap
+        sess, is_batchable = self._sessions[reqs[0][3]]
+        output_names = reqs[0][4]
+
+        # [ (client_id, req_id, feed) ]
+        feeds = []
+        for _, client_id, req_id, _, _, inputs in reqs:
+            feed = {}
+            for input_name, data_ref, shape, dtype in inputs:
+                buffer = weak_heap.get_data(lib_mp.MPWeakHeap.DataRef.unpack(data_ref))
+                if buffer is None:
+                    feed = None
+                    break
+                feed[input_name] = np.ndarray(shape, dtype=dtype, buffer=buffer)
+
+            if feed is None:
+                self._sub_respond(client_id, req_id, _INPUT_OVERWRITTEN_ERROR, None)
+            else:
+                feeds.append( (client_id, req_id, feed) )
+
+        if len(feeds) == 0:
+            return
+
+        run_measurer = self._run_measurers.get(reqs[0][3], None)
+        if run_measurer is None:
+            run_measurer = self._run_measurers[reqs[0][3]] = lib_time.AverageMeasurer(samples=120)
+        run_measurer.start()
+        try:
+            if is_batchable and len(feeds) > 1:
+                feed = { input_name : np.concatenate([ feed[input_name] for _, _, feed in feeds ], 0) for input_name in feeds[0][2].keys() }
+                outputs = sess.run(output_names, feed)
+
+                offsets = np.cumsum([0] + [ next(iter(feed.values())).shape[0] for _, _, feed in feeds ])
+                outputs_list = [ [ output[offsets[i]:offsets[i+1]] for output in outputs ] for i in range(len(feeds)) ]
+            else:
+                outputs_list = [ sess.run(output_names, feed) for _, _, feed in feeds ]
+        except Exception as e:
+            error = f'{e} {traceback.format_exc()}'
+            for client_id, req_id, _ in feeds:
+                self._sub_respond(client_id, req_id, error, None)
+            return
+        self._run_times[reqs[0][3]] = run_measurer.stop()
+
+        for (client_id, req_id, _), outputs in zip(feeds, outputs_list):
+            result = []
+            for output in outputs:
+                output = np.ascontiguousarray(output)
+                result.append( (weak_heap.add_data(output.data).pack(), output.shape, output.dtype.str) )
+            self._sub_respond(client_id, req_id, None, result)
+
+
+class InferenceServerDataError(Exception):
+    """
+    the data of the request is overwritten in the weak heap, the request can be repeated
+    """
+
+class InferenceServerClient:
+    """
+    Client of InferenceServer, see InferenceServer.create_client()
+    """
+    def __init__(self, weak_heap : lib_mp.MPWeakHeap, req_rd : lib_mp.MPSPSCMRRingData, client_id : int, resp_rd : lib_mp.MPSPSCMRRingData):
+        self._weak_heap = weak_heap
+        self._req_rd = req_rd
+        self._client_id = client_id
+        self._resp_rd = resp_rd
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d.pop('_lock')
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._lock = threading.Lock()
+
+    def _request(self, name : str, *args, timeout : float = 30.0):
+        with self._lock:
+            # unique id, thus responses of the requests timed out before are skipped
+            req_id = uuid.uuid4().bytes
+            self._req_rd.write(pickle.dumps( (name, self._client_id, req_id) + args ))
+
+            t = time.perf_counter()
+            while True:
+                b = self._resp_rd.read(timeout=0.1)
+                if b is not None:
+                    resp_req_id, error, result = pickle.loads(b)
+                    if resp_req_id == req_id:
+                        if error is not None:
+                            raise (InferenceServerDataError if error == _INPUT_OVERWRITTEN_ERROR else Exception)(error)
+                        return result
+                elif time.perf_counter() - t >= timeout:
+                    raise Exception('InferenceServer is not responding.')
+
+    def open_session(self, model_path : str, device_info : ORTDeviceInfo, prefer_quantized : bool = False) -> 'InferenceServerSession':
+        """
+        returns session of the model held by InferenceServer
+
+        can raise Exception
+        """
+        sess_id, inputs, outputs = self._request('open', str(model_path), device_info, prefer_quantized, timeout=120.0)
+        return InferenceServerSession(self, sess_id, [ _NodeArg(*x) for x in inputs ], [ _NodeArg(*x) for x in outputs ],
+                                      str(model_path), device_info, prefer_quantized)
+
+    def run(self, sess_id : int, output_names : Union[List[str], None], input_feed : Dict[str, np.ndarray], timeout : float = 30.0) -> List[np.ndarray]:
+        """
+        raises
+            InferenceServerDataError    the data is overwritten in the weak heap
+            Exception
+        """
+        weak_heap = self._weak_heap
+
+        inputs = []
+        for input_name, x in input_feed.items():
+            x = np.ascontiguousarray(x)
+            inputs.append( (input_name, weak_heap.add_data(x.data).pack(), x.shape, x.dtype.str) )
+
+        outputs = []
+        for data_ref, shape, dtype in self._request('run', sess_id, output_names, inputs, timeout=timeout):
+            buffer = weak_heap.get_data(lib_mp.MPWeakHeap.DataRef.unpack(data_ref))
+            if buffer is None:
+                raise InferenceServerDataError('Output data is overwritten in the weak heap.')
+            outputs.append( np.ndarray(shape, dtype=dtype, buffer=buffer) )
+        return outputs
+
+
+class _NodeArg:
+    def __init__(self, name : str, shape : List, type : str):
+        self.name = name
+        self.shape = shape
+        self.type = type
+
+class InferenceServerSession:
+    """
+    Session held by InferenceServer
+    with the part of interface of onnxruntime.InferenceSession
+
+    The run is repeated if the data is overwritten in the weak heap.
+    If the server fails or does not respond in run_timeout (first_run_timeout for the first run with warmup of the device),
+    the session is constructed in this process and used from then on.
+    """
+    first_run_timeout = 30.0
+    run_timeout = 2.0
+    run_retries = 2
+
+    def __init__(self, client : InferenceServerClient, sess_id : int, inputs : List[_NodeArg], outputs : List[_NodeArg],
+                       model_path : str, device_info : ORTDeviceInfo, prefer_quantized : bool):
+        self._client = client
+        self._sess_id = sess_id
+        self._inputs = inputs
+        self._outputs = outputs
+        self._model_path = model_path
+        self._device_info = device_info
+        self._prefer_quantized = prefer_quantized
+        self._local_sess = None
+        self._is_first_run = True
+
+    def get_inputs(self) -> List[_NodeArg]: return self._inputs
+    def get_outputs(self) -> List[_NodeArg]: return self._outputs
+
+    def run(self, output_names : Union[List[str], None], input_feed : Dict[str, np.ndarray], run_options=None) -> List[np.ndarray]:
+        if self._local_sess is None:
+            for i in range(self.run_retries+1):
+                try:
+                    outputs = self._client.run(self._sess_id, output_names, input_feed, timeout=self.first_run_timeout if self._is_first_run else self.run_timeout)
+                    self._is_first_run = False
+                    return outputs
+                except InferenceServerDataError as e:
+                    if i < self.run_retries:
+                        continue
+                    error = e
+                except Exception as e:
+                    error = e
+                break
+
+            from .InferenceSession import InferenceSession_with_device
+            print(f'InferenceServer is failed, constructing the session in this process: {error}')
+            self._local_sess = InferenceSession_with_device(self._model_path, self._device_info, prefer_quantized=self._prefer_quantized)
+
+        return self._local_sess.run(output_names, input_feed, run_options)
@@ -1,15 +1,123 @@
+import hashlib
+import os
+from io import BytesIO
+from pathlib import Path
+
 import onnx
 import onnxruntime as rt
-from io import BytesIO
+
+from .. import appargs as lib_appargs
 from .device import ORTDeviceInfo
+from .InferenceServer import get_inference_server_client
+from .threads import get_intra_op_num_threads
+
+
+def get_cache_dir() -> Path:
+    """
+    returns directory of optimized models cache, or None if the cache is disabled.
+
+    The directory is taken from ORT_CACHE_DIR arg, thus it is the same in all subprocesses.
+    """
+    cache_dir = lib_appargs.get_arg_str('ORT_CACHE_DIR')
+    if cache_dir is None or len(cache_dir) == 0:
+        return None
+    return Path(cache_dir)
+
+def set_cache_dir(cache_dir : Path):
+    """
+    set directory of optimized models cache, None - disable the cache
+    """
+    lib_appargs.set_arg_str('ORT_CACHE_DIR', '' if cache_dir is None else str(cache_dir))
 
+# (path, st_size, st_mtime_ns) : sha256 hexdigest of the model file
+_model_digests = {}
 
-def InferenceSession_with_device(onnx_model_or_path, device_info : ORTDeviceInfo):
+def _get_model_digest(cache_dir : Path, model_path) -> str:
+    """
+    returns sha256 hexdigest of the model file.
+
+    The digest is memoized by the path, size and modification time of the file,
+    in this process and in the sidecar file in the cache dir, thus the large models are hashed once.
+    """
+    model_path = Path(model_path).resolve()
+    st = model_path.stat()
+    key = (str(model_path), st.st_size, st.st_mtime_ns)
+
+    digest = _model_digests.get(key, None)
+    if digest is not None:
+        return digest
+
+    sidecar_path = cache_dir / 'digests' / f"{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()}.sha256"
+    try:
+        digest = sidecar_path.read_text()
+    except Exception:
+        digest = None
+
+    if digest is None or len(digest) != 64:
+        hash = hashlib.sha256()
+        with open(model_path, 'rb') as f:
+            while True:
+                b = f.read(16*1024*1024)
+                if len(b) == 0:
+                    break
+                hash.update(b)
+        digest = hash.hexdigest()
+
+        try:
+            sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = sidecar_path.parent / f'{sidecar_path.name}.{os.getpid()}.tmp'
+            tmp_path.write_text(digest)
+            os.replace(tmp_path, sidecar_path)
+        except Exception:
+            pass
+
+    _model_digests[key] = digest
+    return digest
+
+def _get_cache_path(cache_dir : Path, onnx_model_or_path, device_ep : str) -> Path:
+    hash = hashlib.sha256()
+    if isinstance(onnx_model_or_path, bytes):
+        hash.update(onnx_model_or_path)
+    else:
+        hash.update(_get_model_digest(cache_dir, onnx_model_or_path).encode('utf-8'))
+    hash.update(rt.__version__.encode('utf-8'))
+    hash.update(device_ep.encode('utf-8'))
+    return cache_dir / f'{hash.hexdigest()}.onnx'
+
+def get_quantized_model_path(model_path) -> Path:
+    """
+    returns path of INT8 quantized variant of the model,
+    for example model.onnx -> model.int8.onnx
+    """
+    model_path = Path(model_path)
+    return model_path.parent / f'{model_path.stem}.int8{model_path.suffix}'
+
+def get_session_model_path(model_path, device_info : ORTDeviceInfo, prefer_quantized : bool = False) -> Path:
+    """
+    returns path of the model which the session is constructed from by InferenceSession_with_device()
+    """
+    if prefer_quantized and device_info.is_cpu():
+        quantized_path = get_quantized_model_path(model_path)
+        if quantized_path.exists():
+            return quantized_path
+    return Path(model_path)
+
+def InferenceSession_with_device(onnx_model_or_path, device_info : ORTDeviceInfo, prefer_quantized : bool = False, shared : bool = False):
     """
     Construct onnxruntime.InferenceSession with this Device.
 
      device_info     ORTDeviceInfo
 
+     prefer_quantized(False)    load quantized variant of the model on CPU if it exists,
+                                see get_quantized_model_path()
+
+     shared(False)      use the session held by InferenceServer if the client is set in this process,
+                        see set_inference_server_client()
+
+    Optimized model is loaded from the cache directory if it is set, see set_cache_dir()
+
+    Number of threads is set by set_intra_op_num_threads() or apply_thread_allocation()
+
     can raise Exception
     """
 
@@ -22,14 +130,57 @@ def InferenceSession_with_device(onnx_model_or_path, device_info : ORTDeviceInfo
     if device_ep not in rt.get_available_providers():
         raise Exception(f'{device_ep} is not avaiable in onnxruntime')
 
+    if shared and isinstance(onnx_model_or_path, (str, Path)):
+        client = get_inference_server_client()
+        if client is not None:
+            try:
+                return client.open_session(str(onnx_model_or_path), device_info, prefer_quantized=prefer_quantized)
+            except Exception as e:
+                print(f'Unable to use InferenceServer, constructing the session in this process: {e}')
+
+    if isinstance(onnx_model_or_path, (str, Path)):
+        onnx_model_or_path = str(get_session_model_path(onnx_model_or_path, device_info, prefer_quantized=prefer_quantized))
+
     ep_flags = {}
     if device_ep in ['CUDAExecutionProvider','DmlExecutionProvider']:
         ep_flags['device_id'] = device_info.get_index()
 
-    sess_options = rt.SessionOptions()
-    sess_options.log_severity_level = 4
-    sess_options.log_verbosity_level = -1
-    if device_ep == 'DmlExecutionProvider':
-        sess_options.enable_mem_pattern = False
-    sess = rt.InferenceSession(onnx_model_or_path, providers=[ (device_ep, ep_flags) ], sess_options=sess_options)
+    def get_sess_options():
+        sess_options = rt.SessionOptions()
+        sess_options.log_severity_level = 4
+        sess_options.log_verbosity_level = -1
+        if device_ep == 'DmlExecutionProvider':
+            sess_options.enable_mem_pattern = False
+
+        intra_op_num_threads = get_intra_op_num_threads()
+        if intra_op_num_threads != 0:
+            sess_options.intra_op_num_threads = intra_op_num_threads
+            sess_options.inter_op_num_threads = 1
+            sess_options.execution_mode = rt.ExecutionMode.ORT_SEQUENTIAL
+        return sess_options
+
+    cache_dir = get_cache_dir()
+    if cache_dir is not None:
+        tmp_path = None
+        try:
+            cache_path = _get_cache_path(cache_dir, onnx_model_or_path, device_ep)
+            if not cache_path.exists():
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_dir / f'{cache_path.name}.{os.getpid()}.tmp'
+
+                # Hardware specific optimizations of ORT_ENABLE_ALL are not saved,
+                # they are applied on load of the optimized model.
+                sess_options = get_sess_options()
+                sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+                sess_options.optimized_model_filepath = str(tmp_path)
+                rt.InferenceSession(onnx_model_or_path, providers=[ (device_ep, ep_flags) ], sess_options=sess_options)
+                os.replace(tmp_path, cache_path)
+
+            return rt.InferenceSession(str(cache_path), providers=[ (device_ep, ep_flags) ], sess_options=get_sess_options())
+        except Exception as e:
+            print(f'Unable to use cached optimized model, using the original model: {e}')
+            if tmp_path is not None and tmp_path.exists():
+                tmp_path.unlink()
+
+    sess = rt.InferenceSession(onnx_model_or_path, providers=[ (device_ep, ep_flags) ], sess_options=get_sess_options())
     return sess
@@ -1,3 +1,13 @@
 from .device import (ORTDeviceInfo, get_available_devices_info,
                      get_cpu_device_info)
-from .InferenceSession import InferenceSession_with_device
+from .InferenceServer import (InferenceServer, InferenceServerClient,
+                              InferenceServerDataError, InferenceServerSession,
+                              get_inference_server_client,
+                              set_inference_server_client)
+from .InferenceSession import (InferenceSession_with_device, get_cache_dir,
+                               get_quantized_model_path,
+                               get_session_model_path, set_cache_dir)
+from .threads import (allocate_threads, apply_thread_allocation,
+                      get_cpu_count, get_intra_op_num_threads,
+                      get_thread_allocation, set_intra_op_num_threads,
+                      set_thread_allocation)
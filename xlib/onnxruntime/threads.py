@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Dict, List, Tuple, Union
+
+from .. import appargs as lib_appargs
+from .. import os as lib_os
+
+_intra_op_num_threads = 0
+
+def get_intra_op_num_threads() -> int:
+    """
+    returns number of threads used by InferenceSession_with_device in this process, 0 - default of onnxruntime
+    """
+    return _intra_op_num_threads
+
+def set_intra_op_num_threads(num_threads : int):
+    """
+    set number of threads used by the sessions constructed after the call in this process
+    """
+    global _intra_op_num_threads
+    _intra_op_num_threads = max(0, int(num_threads))
+
+def get_cpu_count() -> int:
+    return os.cpu_count() or 1
+
+def allocate_threads(loads : Dict[str, float], total_threads : int = 0, cpu_affinity : bool = False, groups : Dict[str, List[str]] = None) -> Dict[str, Tuple[int, Union[List[int], None]]]:
+    """
+    Split the budget of cpu threads between the processes proportional to their load.
+
+     loads          dict of process name -> load, for example average time of the frame
+
+     total_threads  budget of threads, 0 - number of cpus
+
+     cpu_affinity   assign non overlapping sets of cpus to the processes
+
+     groups(None)   dict of process name -> names in loads running in this one process,
+                    the process gets one share for the sum of their loads,
+                    and the names get the allocation of the process
+
+    Every process gets at least one thread.
+
+    returns dict of process name -> (num_threads, list of cpus or None)
+    """
+    cpu_count = get_cpu_count()
+    if total_threads <= 0:
+        total_threads = cpu_count
+
+    loads = dict(loads)
+    groups = { group_name : [ name for name in names if name in loads ] for group_name, names in (groups or {}).items() }
+    groups = { group_name : names for group_name, names in groups.items() if len(names) != 0 }
+    for group_name, names in groups.items():
+        loads[group_name] = sum( max(0.0, loads.pop(name)) for name in names )
+
+    names = sorted(loads.keys())
+    threads = { name : 1 for name in names }
+
+    free_threads = total_threads - len(names)
+    if free_threads > 0:
+        loads_sum = sum( max(0.0, loads[name]) for name in names )
+        if loads_sum == 0:
+            loads = { name : 1.0 for name in names }
+            loads_sum = len(names)
+
+        # largest remainder
+        shares = { name : free_threads * max(0.0, loads[name]) / loads_sum for name in names }
+        for name in names:
+            threads[name] += int(shares[name])
+            free_threads -= int(shares[name])
+        for name in sorted(names, key=lambda name: shares[name] - int(shares[name]), reverse=True)[:free_threads]:
+            threads[name] += 1
+
+    allocation = {}
+    cpu = 0
+    for name in names:
+        cpus = None
+        if cpu_affinity:
+            cpus = sorted(set( (cpu+i) % cpu_count for i in range(threads[name]) ))
+            cpu += threads[name]
+        allocation[name] = (threads[name], cpus)
+
+    for group_name, names in groups.items():
+        for name in names:
+            allocation[name] = allocation[group_name]
+    return allocation
+
+def get_thread_allocation() -> Dict[str, Tuple[int, Union[List[int], None]]]:
+    """
+    returns allocation set by set_thread_allocation()
+    """
+    s = lib_appargs.get_arg_str('ORT_THREAD_ALLOCATION')
+    if s is None or len(s) == 0:
+        return {}
+    return { name : (num_threads, cpus) for name, (num_threads, cpus) in json.loads(s).items() }
+
+def set_thread_allocation(allocation : Dict[str, Tuple[int, Union[List[int], None]]]):
+    """
+    set allocation from allocate_threads() for the subprocesses started after the call,
+    see apply_thread_allocation()
+    """
+    lib_appargs.set_arg_str('ORT_THREAD_ALLOCATION', json.dumps(allocation))
+
+def apply_thread_allocation(name : str) -> bool:
+    """
+    apply the allocation of the process name to the current process
+
+    returns False if the process has no allocation
+    """
+    x = get_thread_allocation().get(name, None)
+    if x is None:
+        return False
+    num_threads, cpus = x
+    set_intra_op_num_threads(num_threads)
+    if cpus is not None:
+        lib_os.set_process_affinity(cpus)
+    return True
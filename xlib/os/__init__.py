@@ -1,2 +1,3 @@
-from .os import (ProcessPriority, get_process_priority, set_process_priority,
+from .os import (ProcessPriority, get_process_priority, is_process_alive,
+                 set_process_affinity, set_process_priority,
                  set_timer_resolution)
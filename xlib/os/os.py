@@ -1,7 +1,9 @@
+import ctypes
 import os
 import platform
 import traceback
 from enum import IntEnum
+from typing import List
 
 is_win = False
 is_linux = False
@@ -92,6 +94,49 @@ def set_process_priority(prio : ProcessPriority):
     except:
         print(f'set_process_priority error: {traceback.format_exc()}')
 
+def set_process_affinity(cpus : List[int]) -> bool:
+    """
+    restrict the current process to run on the cpus
+
+     cpus       list of cpu indexes
+
+    return True if success
+    """
+    try:
+        if is_win:
+            mask = 0
+            for cpu in cpus:
+                mask |= 1 << cpu
+            return bool(kernel32.SetProcessAffinityMask(kernel32.GetCurrentProcess(), mask))
+        elif is_linux:
+            os.sched_setaffinity(0, cpus)
+            return True
+    except:
+        print(f'set_process_affinity error: {traceback.format_exc()}')
+    return False
+
+def is_process_alive(pid : int) -> bool:
+    """
+    returns True if the process with pid is running
+    """
+    if is_win:
+        hProcess = kernel32.OpenProcess(kernel32.PROCESS_QUERY_LIMITED_INFORMATION, 0, pid)
+        if hProcess.value is None:
+            return False
+        exit_code = wintypes.DWORD()
+        kernel32.GetExitCodeProcess(hProcess, ctypes.byref(exit_code))
+        kernel32.CloseHandle(hProcess)
+        return exit_code.value == kernel32.STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but owned by other user
+        ...
+    return True
+
 def set_timer_resolution(milliseconds : int) -> bool:
     """
     sets minimum timer resolution, in milliseconds, for time services, such as sleep or wait.
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Tuple
+from typing import Tuple, Union
 
 import numpy as np
 from ..image import ImageProcessor
@@ -56,6 +56,20 @@ class FramePlayer(Disposable):
     def get_frame_count(self): return self._frame_count
     def get_frame_idx(self): return self._frame_idx
 
+    def get_time_to_next_frame(self) -> Union[float, None]:
+        """
+        returns time in seconds until the next frame is due, 0 if it is due already,
+        or None if the player is not playing
+        """
+        if not self._is_playing:
+            return None
+        if not self._is_realtime:
+            return 0.0
+        fps = self._fps
+        if fps == 0:
+            fps = self._default_fps
+        return max(0.0, self._frame_timestamp + 1.0/fps - datetime.now().timestamp())
+
     def get_is_autorewind(self): return self._is_autorewind
     def set_is_autorewind(self, is_autorewind):
         if not isinstance(is_autorewind, bool):
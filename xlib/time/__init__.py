@@ -1 +1 @@
-from .time_ import timeit, measure, FPSCounter, AverageMeasurer
\ No newline at end of file
+from .time_ import timeit, measure, mono_timestamp, FPSCounter, AverageMeasurer
\ No newline at end of file
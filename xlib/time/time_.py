@@ -32,6 +32,15 @@ else:
         def __exit__(self, a,b,c):
             print(f'timeit!: {datetime.now().timestamp()-self.t}')
 
+def mono_timestamp() -> float:
+    """
+    monotonic timestamp in seconds.
+
+    Uses system-wide high-resolution counter,
+    thus timestamps are comparable across processes of the same machine.
+    """
+    return time.perf_counter()
+
 class measure:
     def __init__(self):
         self.t = time.time()